@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import logger
+from .model import User
+
+# The warm browser of a worker process, selenium is only ever imported there.
+_browser = None
+
+
+def _init_worker():
+    """
+    Start headless Chrome as soon as the worker process is up, so the first refresh finds it warm.
+    """
+    global _browser
+    from multiprocessing.util import Finalize
+    from TranslateGuard.config import setup_logging
+    from .uc_back import SeleniumRequests
+    setup_logging()
+    try:
+        _browser = SeleniumRequests(None)
+        # Worker processes skip atexit, quit Chrome from the multiprocessing exit finalizers.
+        Finalize(None, _quit_browser, exitpriority=10)
+    except Exception as e:
+        logger.error("Browser worker could not start Chrome, will retry on the first job | Why: %s", e)
+
+
+def _quit_browser():
+    if _browser is not None and _browser._driver is not None:
+        try:
+            _browser._driver.quit()
+        except Exception as e:
+            logger.warning("Browser worker could not quit Chrome | Why: %s", e)
+
+
+def _ping() -> bool:
+    return _browser is not None
+
+
+def _refresh_job(user: User, cookies: list[dict]) -> tuple[list[dict], dict, str]:
+    """
+    Log user in with the warm browser of this worker, runs inside the worker process.
+    """
+    global _browser
+    from .uc_back import SeleniumRequests
+    try:
+        if _browser is None:
+            _browser = SeleniumRequests(None)
+        _browser.user = user
+        return _browser.fetch_access_token_cookies(cookies, quit_driver=False)
+    except Exception as e:
+        # Start over with a new browser next time, this one may be what broke.
+        _quit_browser()
+        _browser = None
+        # Exceptions of this package don't survive pickling, hand back their text.
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+class BrowserPool:
+    """
+    Worker processes each keeping a warm headless Chrome, serving selenium logins.
+    Browser start up and page scripting stay off the event loop and the GIL of the server,
+    and several accounts can log in at once.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self.stats = {"refreshed": 0, "failed": 0, "seconds": 0.0}
+
+    async def warm_up(self) -> int:
+        """
+        Start every worker and its browser, returns how many have Chrome running.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            ready = await asyncio.gather(*[loop.run_in_executor(self.executor, _ping) for _ in range(self.workers)])
+        except BrokenProcessPool as e:
+            logger.error("Browser pool is broken | Why: %s", e)
+            return 0
+        logger.info("Browser pool warm | %s of %s worker(s) have Chrome running", sum(ready), self.workers)
+        return sum(ready)
+
+    async def refresh(self, user: User, cookies: list[dict]) -> tuple[list[dict], dict, str]:
+        """
+        New cookies, session json and device_id of user logged in with cookies, fetched by a worker.
+        """
+        start = time.monotonic()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, _refresh_job, user, cookies)
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        self.stats["refreshed"] += 1
+        self.stats["seconds"] += time.monotonic() - start
+        return result
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,88 +1,207 @@
 import asyncio
 import base64
-import json
+import hashlib
 import re
+import time
 import uuid
-from asyncio import QueueFull
 
 import aiohttp
 
 from TranslateGuard.base_exceptions import UnequalParagraphCountException, ErrorMsg
 from TranslateGuard.base_formatter import build_result
 from TranslateGuard.base_message_enum import DebugInfoMsg, Service
+from TranslateGuard.bisect_executor import bisect_ask, RetryBudget
+from TranslateGuard import deadline, metrics, tracing
 from TranslateGuard.config import config
-from TranslateGuard.utils import SingletonMeta
+from TranslateGuard.deadline import engine_timeout
+from TranslateGuard.scheduler import Scheduler
+from TranslateGuard.serialization import loads
+from TranslateGuard.utils import SingletonMeta, RetryPolicy
 from . import logger
-from .auth_handler import get_cookies, save_cookies, get_access_token
+from .auth_handler import get_cookies, save_cookies, get_access_token, get_access_token_expires, \
+    save_access_token
+from .browser_pool import BrowserPool
 from .exceptions import ChatWebReverseException, ChatWebReverseErrorType
 from .formatter import build_prompt_web_chat_gpt
 from .headers import get_headers_for_del_conversation, get_headers_for_general, get_headers_for_conversation, \
     get_wss_headers, get_headers_for_openai
 from .model import User, Conversation
-from .playload import get_req_con_playload
-from .uc_back import SeleniumRequests
+from .playload import render_req_con_playload
+from .refresher import AuthRefresher
+from .requirements import RequirementsTokenPool
 
 PATTERN_DATA = re.compile(r'data: (.*)', re.DOTALL)
 
 
+def _retryable(e: Exception) -> bool:
+    """
+    5xx and connection errors are worth another try.
+    """
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, aiohttp.ClientConnectionError)
+
+
+def _retryable_with_auth(e: Exception) -> bool:
+    return _retryable(e) or (isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500
+                             and e.status != 429)
+
+
+def _frame_key(frame: dict) -> str | None:
+    """
+    Frames of one websocket answer share a conversation_id (or at least a response_id).
+    """
+    return frame.get("conversation_id") or frame.get("response_id")
+
+
+def _put_capped(entries: dict, key: str, value, cap: int = 32):
+    """
+    Keep at most cap entries, the oldest goes first.
+    """
+    entries.pop(key, None)
+    if len(entries) >= cap:
+        entries.pop(next(iter(entries)))
+    entries[key] = value
+
+
 class ChatgptAgent:
     def __init__(self, user: User, session: aiohttp.ClientSession):
         self.user = user
         self.sl = None  # Selenium instance
-        self.lock = asyncio.Lock()
+        self.browser_pool = None  # Warm browsers in worker processes, used instead of sl if set
+        self.auth_lock = asyncio.Lock()
         self.cookies = self._init_cookies()
         self.access_token = self._get_access_token()
+        self.access_token_expires = get_access_token_expires(user.EMAIL)
+        # Set while the AuthRefresher logs in again, the pool sends no prompts meanwhile.
+        self.refreshing = False
+        # Set while the websocket is connected, answers can only arrive then.
+        self.ready = False
+        # With an AuthRefresher, a 4xx during a prompt hands the login to it instead of running selenium inline.
+        self.auth_refresher = None
         self.session = self._update_cookies_for_session(session)
-        self.conversation = Conversation(user=user)
+        # Every conversation answers one prompt at a time, the account runs all of them in parallel.
+        self.conversations = [Conversation(user=user) for _ in range(config.get("CONVERSATIONS_PER_ACCOUNT", 2))]
+        self.idle_conversations = asyncio.Queue()
+        for conversation in self.conversations:
+            self.idle_conversations.put_nowait(conversation)
         self.wss_url = None
         self.wss_client = None
         self.websocket_request_id = str(uuid.uuid4())
-        self.queue = asyncio.Queue(maxsize=1)
-        self.proxy = "http://127.0.0.1:7890"
+        # Futures of in-flight prompts, keyed by the prompt message_id, the parent_id of its answer.
+        self.pending: dict[str, asyncio.Future] = {}
+        # conversation_id of in-flight prompts, by message_id, once the conversation is known.
+        self._pending_conversations: dict[str, str] = {}
+        # Last content frame of each websocket response, keyed by conversation_id or response_id.
+        self._latest_frames: dict[str, dict] = {}
+        # Finished answers that arrived before their prompt was registered, keyed by parent_id.
+        self._orphans: dict[str, tuple[str, str]] = {}
+        self.proxy = config.get("CHATGPT_PROXY", "http://127.0.0.1:7890")
+        # Another backend speaking the same api, e.g. the fake one of the benchmarks.
+        self.base_url = config.get("CHATGPT_BASE_URL", "https://chat.openai.com")
         self.device_id = ''
+        self.retry_policy = RetryPolicy(_retryable,
+                                        max_retries=config.get("RETRY_MAX", 2),
+                                        deadline=config.get("RETRY_DEADLINE", 20))
+        self.auth_retry_policy = RetryPolicy(_retryable_with_auth,
+                                             max_retries=config.get("RETRY_MAX", 2),
+                                             deadline=config.get("RETRY_DEADLINE", 20))
+        # Sentinel tokens fetched ahead of prompts, None if prefetching is disabled.
+        size = config.get("REQUIREMENTS_PREFETCH", len(self.conversations))
+        self.requirements = RequirementsTokenPool(size, ttl=config.get("REQUIREMENTS_TOKEN_TTL", 60)) \
+            if size else None
+
+    @property
+    def conversation(self) -> Conversation:
+        return self.conversations[0]
+
+    async def _call(self, func, *args, refresh_auth: bool = False, **kwargs):
+        """
+        Run a call to chat.openai.com under the account retry policy: 5xx and connection errors
+        back off and retry, with refresh_auth a 4xx refreshes cookies with selenium once and retries.
+        """
+        refreshed = False
+
+        async def before_retry(e: Exception):
+            nonlocal refreshed
+            if isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500:
+                if refreshed:
+                    raise e
+                refreshed = True
+                await self._update_cookies()
 
-    # @retry(e_type_list=[ErrorMsg.ConnectionError])
-    async def del_conversation_remote(self, again: bool = False) -> bool | None:
-        resp = None
         try:
-            resp = await self.session.patch(
-                url=f"https://chat.openai.com/backend-api/conversation/{self.conversation.conversation_id}",
-                headers=get_headers_for_del_conversation(self.access_token, self.conversation.conversation_id),
-                json={"is_visible": False})
-            resp_json = await resp.json()
-            is_done = resp_json["success"]
-            if is_done:
-                logger.info(f"SUCCESS: Delete current conversation {self.user.EMAIL}:\n {resp_json}")
-            return is_done
+            return await (self.auth_retry_policy if refresh_auth else self.retry_policy).run(
+                func, *args, source=self.user.EMAIL, before_retry=before_retry, **kwargs)
         except aiohttp.ClientResponseError as e:
-            if 400 <= e.status < 500:
-                logger.error(ChatWebReverseErrorType.ERROR_4XX, Service.ChatWebGpt, self.user.EMAIL, resp.status,
-                             resp.text)
-                if not again:
-                    if not self.sl:
-                        self.sl = SeleniumRequests(self.user)
-                    await self._update_cookies()
-                    await self.del_conversation_remote(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL, resp.status)
-            else:
-                logger.error(ChatWebReverseErrorType.ERROR_5XX, Service.ChatWebGpt, self.user.EMAIL, resp.status,
-                             resp.text)
-                if not again:
-                    await self.del_conversation_remote(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL, resp.status)
+            logger.error(ChatWebReverseErrorType.ERROR_4XX if e.status < 500 else ChatWebReverseErrorType.ERROR_5XX,
+                         Service.ChatWebGpt, self.user.EMAIL, e.status, e.message)
+            raise
+
+    async def _del_conversation_remote(self, conversation: Conversation) -> bool:
+        resp = await self.session.patch(
+            url=f"{self.base_url}/backend-api/conversation/{conversation.conversation_id}",
+            headers=get_headers_for_del_conversation(self.access_token, conversation.conversation_id),
+            json={"is_visible": False})
+        resp_json = await resp.json(loads=loads)
+        is_done = resp_json["success"]
+        if is_done:
+            logger.info(f"SUCCESS: Delete current conversation {self.user.EMAIL}:\n {resp_json}")
+        return is_done
+
+    async def del_conversation_remote(self, conversation: Conversation) -> bool | None:
+        try:
+            return await self._call(self._del_conversation_remote, conversation, refresh_auth=True)
+        except aiohttp.ClientResponseError as e:
+            logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL, e.status)
         except Exception as e:
             logger.exception(e)
 
+    def runtime_state(self) -> dict:
+        """
+        What a restarted server needs to reuse this account without a new handshake.
+        """
+        return {"access_token_sha1": hashlib.sha1((self.access_token or "").encode()).hexdigest(),
+                "device_id": self.device_id,
+                "wss_url": self.wss_url,
+                "websocket_request_id": self.websocket_request_id,
+                "conversations": [{"conversation_id": conversation.conversation_id,
+                                   "current_node": conversation.current_node,
+                                   "is_echo": conversation.is_echo,
+                                   "is_new": conversation.is_new}
+                                  for conversation in self.conversations]}
+
+    def restore_runtime_state(self, state: dict) -> bool:
+        """
+        Take over state saved by runtime_state, only if it was saved for the same access token.
+        """
+        if not self.access_token or \
+                state["access_token_sha1"] != hashlib.sha1(self.access_token.encode()).hexdigest():
+            return False
+        self.device_id = state["device_id"]
+        self.wss_url = state["wss_url"]
+        self.websocket_request_id = state["websocket_request_id"]
+        for conversation, saved in zip(self.conversations, state["conversations"]):
+            conversation.conversation_id = saved["conversation_id"]
+            conversation.current_node = saved["current_node"]
+            conversation.is_echo = saved["is_echo"]
+            conversation.is_new = saved["is_new"]
+        return True
+
+    def jar_cookies(self) -> list[dict]:
+        """
+        The live cookies of the session, in the stored format.
+        """
+        return [{'name': c.key, 'value': c.value, 'domain': c['domain'], 'path': c['path']}
+                for c in self.session.cookie_jar]
+
     async def close(self):
-        if self.conversation.is_echo:
-            self.cookies = [{'name': c.key, 'value': c.value, 'domain': c['domain'], 'path': c['path']}
-                            for c in self.session.cookie_jar]
-            save_cookies(self.user.EMAIL, self.cookies)
+        self.cookies = self.jar_cookies()
+        save_cookies(self.user.EMAIL, self.cookies)
+        echoed = [conversation for conversation in self.conversations if conversation.is_echo]
+        if echoed:
             if config.SHOULD_DEL_CON:
-                async with self.lock:
-                    await self.del_conversation_remote()
+                await asyncio.gather(*[self.del_conversation_remote(conversation) for conversation in echoed])
 
     def _init_cookies(self):
         try:
@@ -109,101 +228,134 @@ class ChatgptAgent:
     async def _update_cookies(self):
         """
         Use selenium update cookies.
+        Only one conversation launches selenium, the others reuse what it fetched.
         """
-        logger.warning(f"Will use selenium update cookies | Email: {self.user.EMAIL}")
-        self.cookies, self.access_token, self.device_id = await asyncio.to_thread(self.sl.fetch_access_token_cookies)
-        self._update_cookies_for_session(self.session)
+        access_token = self.access_token
+        async with self.auth_lock:
+            if self.access_token != access_token:
+                return
+            logger.warning(f"Will use selenium update cookies | Email: {self.user.EMAIL}")
+            start = time.monotonic()
+            try:
+                if self.browser_pool is not None:
+                    cookies, session, self.device_id = await self.browser_pool.refresh(self.user, self.cookies)
+                else:
+                    if not self.sl:
+                        # Selenium is only imported once a login is actually needed.
+                        from .uc_back import SeleniumRequests
+                        self.sl = SeleniumRequests(self.user)
+                    cookies, session, self.device_id = await asyncio.to_thread(
+                        self.sl.fetch_access_token_cookies, self.cookies)
+            except Exception:
+                metrics.SELENIUM_REFRESHES.inc(self.user.EMAIL, "error")
+                raise
+            metrics.SELENIUM_REFRESHES.inc(self.user.EMAIL, "ok")
+            metrics.SELENIUM_REFRESH_LATENCY.observe(time.monotonic() - start, self.user.EMAIL)
+            save_cookies(self.user.EMAIL, cookies)
+            save_access_token(self.user.EMAIL, session)
+            self.cookies, self.access_token = cookies, session["accessToken"]
+            self._update_cookies_for_session(self.session)
+            self.access_token_expires = get_access_token_expires(self.user.EMAIL)
+            if self.requirements is not None:
+                self.requirements.clear()
 
-    async def _get_device_id(self, again=False):
+    async def refresh_auth(self):
         """
+        Log in again with selenium ahead of expiry.
         """
-        resp = None
+        await self._update_cookies()
+
+    async def _fetch_device_id(self):
+        resp = await self.session.get(
+            self.base_url,
+            headers=get_headers_for_openai(),
+            proxy=self.proxy
+        )
+        self.session.cookie_jar.update_cookies(resp.cookies)
+        text = await resp.text()
+        logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, text[:200])
+        if match := re.search(r'"DeviceId":\s*"([^"]*)"', text):
+            logger.debug('DeviceId: %s', match.group(1))
+            self.device_id = match.group(1)
+
+    async def _get_device_id(self):
         try:
-            resp = await self.session.get(
-                "https://chat.openai.com",
-                headers=get_headers_for_openai(),
-                proxy=self.proxy
-            )
-            self.session.cookie_jar.update_cookies(resp.cookies)
-            text = await resp.text()
-            logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, text[:200])
-            match = re.search(r'"DeviceId":\s*"([^"]*)"', text)
-            logger.debug('XXXXXXXXXXXXXXXDeviceId', match.group(1))
-            if match:
-                self.device_id = match.group(1)
+            await self._call(self._fetch_device_id, refresh_auth=True)
         except aiohttp.ClientResponseError as e:
-            if 400 <= e.status < 500:
-                logger.error(ChatWebReverseErrorType.ERROR_4XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             e.message)
-                if not again:
-                    if not self.sl:
-                        self.sl = SeleniumRequests(self.user)
-                    await self._update_cookies()
-                    await self._get_device_id(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 e.status)
-            else:
-                logger.error(ChatWebReverseErrorType.ERROR_5XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             e.message)
-                if not again:
-                    await self._get_device_id(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 e.status)
+            logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL, e.status)
         except Exception as e:
             logger.exception(e)
 
-    async def register_websocket(self, again: bool = False):
+    async def _register_websocket(self) -> str:
+        resp = await self.session.post(
+            f"{self.base_url}/backend-api/register-websocket",
+            headers=get_headers_for_general(self.access_token, self.device_id),
+            proxy=self.proxy
+        )
+        self.session.cookie_jar.update_cookies(resp.cookies)
+        wss_data = await resp.json(loads=loads)
+        logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, wss_data)
+        self.wss_url = wss_data["wss_url"]
+        return wss_data["wss_url"]
+
+    async def register_websocket(self) -> str | None:
         """
         Register websocket to fetch a wss_url.
         """
         try:
-            resp = await self.session.post(
-                "https://chat.openai.com/backend-api/register-websocket",
-                headers=get_headers_for_general(self.access_token, self.device_id),
-                proxy=self.proxy
-            )
-            self.session.cookie_jar.update_cookies(resp.cookies)
-            wss_data = await resp.json()
-            logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, wss_data)
-            self.wss_url = wss_data["wss_url"]
-            return wss_data["wss_url"]
+            return await self._call(self._register_websocket, refresh_auth=True)
         except aiohttp.ClientResponseError as e:
-            if 400 <= e.status < 500:
-                logger.error(ChatWebReverseErrorType.ERROR_4XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             e.message)
-                if not again:
-                    if not self.sl:
-                        self.sl = SeleniumRequests(self.user)
-                    await self._update_cookies()
-                    await self.register_websocket(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 e.status)
-            else:
-                logger.error(ChatWebReverseErrorType.ERROR_5XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             e.message)
-                if not again:
-                    await self.register_websocket(again=True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 e.status)
+            logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL, e.status)
         except Exception as e:
             logger.exception(e)
 
+    def _route_frame(self, frame: dict):
+        """
+        Hand a finished websocket answer to the prompt it answers, its parent_id is the prompt message_id.
+        A late answer of a prompt that timed out or was cancelled must never reach the next prompt
+        of its conversation, so the conversation_id only routes answers without a parent_id,
+        and only if a single prompt is pending on that conversation.
+        """
+        body = base64.b64decode(frame["body"]).decode("utf-8")
+        message_data = loads(PATTERN_DATA.search(body).group(1))
+        text = message_data["message"]["content"]["parts"][0]
+        node = frame.get("message_id") or message_data["message"]["id"]
+        conversation_id = message_data.get("conversation_id") or frame.get("conversation_id")
+        parent_id = (message_data["message"].get("metadata") or {}).get("parent_id")
+        if not parent_id and conversation_id:
+            prompts = [message_id for message_id, conversation in self._pending_conversations.items()
+                       if conversation == conversation_id]
+            if len(prompts) == 1:
+                parent_id = prompts[0]
+        if not parent_id:
+            logger.warning("Dropped websocket answer without parent_id | Email %s | conversation_id %s",
+                           self.user.EMAIL, conversation_id)
+            return
+        if (future := self.pending.get(parent_id)) is not None:
+            if not future.done():
+                future.set_result((text, node))
+            return
+        logger.warning("Unclaimed websocket answer | Email %s | conversation_id %s | parent_id %s",
+                       self.user.EMAIL, conversation_id, parent_id)
+        _put_capped(self._orphans, parent_id, (text, node))
+
     async def wss_client_background(self):
         """
-        Demon for fetching data from websocket
+        Demon for fetching data from websocket, routes every answer to its conversation.
         """
         while True:
             try:
+                if not self.wss_url and not await self.register_websocket():
+                    await asyncio.sleep(5)
+                    continue
                 headers = get_wss_headers(self.device_id, self.conversation.conversation_id)
                 async with self.session.ws_connect(self.wss_url,
                                                    heartbeat=20,
                                                    headers=headers) as self.wss_client:
                     logger.info("START wss_client_background")
-                    data_str = None
+                    # Responses of the previous connection never get their DONE on this one.
+                    self._latest_frames.clear()
+                    self.ready = True
                     async for msg in self.wss_client:
 
                         # logger.debug("WSMsgType: msg.type:%s\nmsg.date:↓↓↓\n%s", msg.type, msg.data)
@@ -212,22 +364,18 @@ class ChatgptAgent:
                             #     logger.debug(DebugInfoMsg.FETCH_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, msg.data)
                             #     continue
                             if '"message_id"' in msg.data:
-                                data_str = msg.data
+                                frame = loads(msg.data)["data"]
+                                _put_capped(self._latest_frames, _frame_key(frame), frame)
                                 continue
                             elif '"ZGF0YTogW0RPTkVdCgo="' in msg.data:
-                                if not data_str:
+                                frame = self._latest_frames.pop(_frame_key(loads(msg.data)["data"]), None)
+                                if not frame:
                                     continue
-                                # self.sequenceId = re.findall(r'"sequenceId":(\d+)', data_str)[0]
-                                logger.debug(DebugInfoMsg.FETCH_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, data_str)
-                                message_data = json.loads(data_str)
-                                self.conversation.current_node = message_data["data"]["message_id"]
-                                message_data = base64.b64decode(message_data["data"]["body"]).decode("utf-8")
-                                message_data = PATTERN_DATA.search(message_data).group(1)
-                                message_data = json.loads(message_data)
+                                logger.debug(DebugInfoMsg.FETCH_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, frame)
                                 try:
-                                    self.queue.put_nowait(message_data["message"]["content"]["parts"][0])
-                                except QueueFull as e:
-                                    logger.error(e)
+                                    self._route_frame(frame)
+                                except (KeyError, IndexError, AttributeError, ValueError) as e:
+                                    logger.error(ErrorMsg.UnhandledError, Service.ChatWebGpt, self.user.EMAIL, e)
                             else:
                                 continue
                         elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
@@ -236,6 +384,7 @@ class ChatgptAgent:
                             break
             except asyncio.CancelledError:
                 logger.info("wss_client_background has been cancelled")
+                self.ready = False
                 break
             except aiohttp.ClientResponseError as e:
                 logger.error(ChatWebReverseErrorType.ERROR_4XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
@@ -243,111 +392,107 @@ class ChatgptAgent:
                 await self.register_websocket()
             except Exception as e:
                 logger.exception(e)
+            self.ready = False
             await asyncio.sleep(5)
 
-    async def _chat_requirements(self, again: bool = False) -> str | None:
-        resp = None
+    async def _chat_requirements(self) -> str:
+        resp = await self.session.post(
+            f"{self.base_url}/backend-api/sentinel/chat-requirements",
+            headers=get_headers_for_general(self.access_token, self.device_id),
+            proxy=self.proxy,
+            timeout=aiohttp.ClientTimeout(total=deadline.timeout(40))
+        )
+        self.session.cookie_jar.update_cookies(resp.cookies)
+        resp_json = await resp.json(loads=loads)
+        logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, resp_json)
+        return resp_json["token"]
+
+    async def _prefetch_requirements(self) -> tuple[str, str | None]:
+        access_token = self.access_token
+        return await self._chat_requirements(), access_token
+
+    async def requirements_background(self):
+        """
+        Demon keeping chat-requirements tokens ready for the next prompts.
+        """
         try:
-            resp = await self.session.post(
-                "https://chat.openai.com/backend-api/sentinel/chat-requirements",
-                headers=get_headers_for_general(self.access_token, self.device_id),
-                proxy=self.proxy
-            )
-            self.session.cookie_jar.update_cookies(resp.cookies)
-            resp_json = await resp.json()
-            logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, resp_json)
-            return resp_json["token"]
-        except aiohttp.ClientResponseError as e:
-            if e.status >= 500:
-                logger.error(ChatWebReverseErrorType.ERROR_5XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             resp.text)
-                if not again:
-                    return await self._chat_requirements(True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 resp.status)
-            else:
-                raise
-        except Exception as e:
-            # logger.error(ErrorMsg.ConnectionError, Service.ChatWebGpt, self.user.EMAIL, str(e))
-            logger.exception(e)
+            await self.requirements.run(self._prefetch_requirements, lambda: self.access_token,
+                                        source=self.user.EMAIL)
+        except asyncio.CancelledError:
+            logger.info("requirements_background has been cancelled | stats %s", self.requirements.stats)
 
     async def _complete_conversation(self,
                                      conversation: Conversation,
                                      headers: dict,
-                                     payload: dict,
-                                     again: bool = False) -> str | None:
-        resp = None
+                                     payload: bytes,
+                                     message_id: str) -> str:
+        if (future := self.pending.get(message_id)) is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[message_id] = future
         try:
-            if not self.queue.empty():
-                logger.info('Discarded item Email %s | Text: %s↓↓↓:', self.user.EMAIL, self.queue.get_nowait())
-            resp = await self.session.post(
-                "https://chat.openai.com/backend-api/conversation",
-                headers=headers,
-                json=payload,
-                proxy=self.proxy
-            )
-            self.session.cookie_jar.update_cookies(resp.cookies)
-            resp_json = await resp.json()
+            if conversation.conversation_id:
+                self._pending_conversations[message_id] = conversation.conversation_id
+            with tracing.span("chat.post"):
+                resp = await self.session.post(
+                    f"{self.base_url}/backend-api/conversation",
+                    headers=headers,
+                    data=payload,
+                    proxy=self.proxy,
+                    timeout=aiohttp.ClientTimeout(total=deadline.timeout(40))
+                )
+                self.session.cookie_jar.update_cookies(resp.cookies)
+                resp_json = await resp.json(loads=loads)
             logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, resp_json)
-            if self.conversation.is_new:
-                self.conversation.is_new = False
-                self.conversation.is_echo = True
-                self.conversation.conversation_id = resp_json["conversation_id"]
-            msg = await asyncio.wait_for(self.queue.get(), 45)
-            self.queue.task_done()
+            if conversation.is_new:
+                conversation.is_new = False
+                conversation.is_echo = True
+                conversation.conversation_id = resp_json["conversation_id"]
+                self._pending_conversations[message_id] = conversation.conversation_id
+            if (orphan := self._orphans.pop(message_id, None)) and not future.done():
+                future.set_result(orphan)
+            posted = time.monotonic()
+            with tracing.span("chat.websocket"):
+                msg, conversation.current_node = await asyncio.wait_for(future,
+                                                                        engine_timeout(Service.ChatWebGpt, 45))
+            metrics.CHAT_WEBSOCKET_DELAY.observe(time.monotonic() - posted, self.user.EMAIL)
             logger.info(DebugInfoMsg.TRANSLATED_TEXT, Service.ChatWebGpt, self.user.EMAIL, msg)
             return msg
         except asyncio.TimeoutError:
-            logger.debug(ErrorMsg.TimeOutError, Service.ChatWebGpt, self.user.EMAIL, "asyncio.queue")
-            raise
-        except aiohttp.ClientResponseError as e:
-            if e.status >= 500:
-                logger.error(ChatWebReverseErrorType.ERROR_5XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                             resp.text)
-                if not again:
-                    return await self._complete_conversation(conversation, headers, payload, True)
-                else:
-                    logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                                 resp.status)
-            else:
-                raise
-        except Exception as e:
+            logger.debug(ErrorMsg.TimeOutError, Service.ChatWebGpt, self.user.EMAIL, "websocket answer")
             raise
+        finally:
+            if self.pending.get(message_id) is future:
+                del self.pending[message_id]
+            self._pending_conversations.pop(message_id, None)
+
+    async def _ask_web_chat(self, conversation: Conversation, payload: bytes, message_id: str) -> str:
+        token = self.requirements.take(self.access_token) if self.requirements is not None else None
+        with tracing.span("chat.requirements", pooled=token is not None):
+            conversation.requirements_token = token or await self._chat_requirements()
+        headers = get_headers_for_conversation(self.access_token, self.device_id,
+                                               conversation.requirements_token,
+                                               conversation.conversation_id)
+        return await self._complete_conversation(conversation, headers, payload, message_id)
 
-    async def ask_web_chat(self, prompt: str, again: bool = False) -> str | None:
+    async def ask_web_chat(self, prompt: str, conversation: Conversation) -> str | None:
         """
         Prepare a conversation for asking.
+        A 4xx refreshes cookies with selenium and asks again with a new requirements token.
         """
-        con_pay_load = get_req_con_playload(prompt,
-                                            self.websocket_request_id,
-                                            self.conversation.conversation_id,
-                                            self.conversation.current_node,
-                                            str(uuid.uuid4()))
+        message_id = str(uuid.uuid4())
+        con_pay_load = render_req_con_playload(prompt,
+                                               self.websocket_request_id,
+                                               conversation.conversation_id,
+                                               conversation.current_node,
+                                               message_id)
+        if self.auth_refresher is None:
+            return await self._call(self._ask_web_chat, conversation, con_pay_load, message_id, refresh_auth=True)
         try:
-            self.conversation.requirements_token = await self._chat_requirements()
-            headers = get_headers_for_conversation(self.access_token, self.device_id,
-                                                   self.conversation.requirements_token,
-                                                   self.conversation.conversation_id)
-            text = await self._complete_conversation(self.conversation, headers, con_pay_load)
-            return text
+            return await self._call(self._ask_web_chat, conversation, con_pay_load, message_id)
         except aiohttp.ClientResponseError as e:
-            logger.error(ChatWebReverseErrorType.ERROR_4XX, Service.ChatWebGpt, self.user.EMAIL, e.status,
-                         e.message)
-            if not again:
-                logger.info("Using Selenium | will call _complete_conversation again")
-                if not self.sl:
-                    self.sl = SeleniumRequests(self.user)
-                await self._update_cookies()
-                headers = get_headers_for_conversation(self.access_token, self.device_id,
-                                                       self.conversation.requirements_token,
-                                                       self.conversation.conversation_id)
-                return await self._complete_conversation(self.conversation, headers, con_pay_load)
-            else:
-                logger.error(ChatWebReverseErrorType.RETRY_FAILED, Service.ChatWebGpt, self.user.EMAIL,
-                             e.status)
-                raise
-        except Exception:
+            if 400 <= e.status < 500 and e.status != 429:
+                # Let the refresher log in, the pool retries this prompt on another account.
+                self.auth_refresher.request(self)
             raise
 
     async def ask(self, paragraphs: list[str]) -> str | None:
@@ -357,9 +502,16 @@ class ChatgptAgent:
         prompt = build_prompt_web_chat_gpt(paragraphs)
         logger.info(DebugInfoMsg.PROMPT, Service.ChatWebGpt, self.user.EMAIL, prompt)
         try:
-            async with self.lock:
-                result = await self.ask_web_chat(prompt)
-            if (resp := build_result(result, length=len(paragraphs), source=self.user.EMAIL)) is not None:
+            start = time.monotonic()
+            with tracing.span("chat.queue_wait"):
+                conversation = await self.idle_conversations.get()
+            metrics.CHAT_QUEUE_WAIT.observe(time.monotonic() - start, self.user.EMAIL)
+            try:
+                result = await self.ask_web_chat(prompt, conversation)
+            finally:
+                self.idle_conversations.put_nowait(conversation)
+            if (resp := build_result(result, length=len(paragraphs), source=self.user.EMAIL,
+                                     engine=Service.ChatWebGpt)) is not None:
                 logger.debug(DebugInfoMsg.TRANSLATED_TEXT, Service.ChatWebGpt, self.user.EMAIL, resp)
                 return resp
         except UnequalParagraphCountException as e:
@@ -375,64 +527,56 @@ class ChatAgentPool(metaclass=SingletonMeta):
         self.instances = {user["EMAIL"]: ChatgptAgent(User(**user), app["client_sessions"][user["EMAIL"]])
                           for user in config.ACCOUNTS if user["USE"]}
         self.instance_list = list(self.instances.values())
-        self.count = -1
+        self.scheduler = Scheduler(Service.ChatWebGpt, self.instance_list,
+                                   label=lambda agent: agent.user.EMAIL,
+                                   capacity=lambda agent: len(agent.conversations))
+        self.scheduler.filters.append(lambda agent: agent.ready and not agent.refreshing)
+        self.browser_pool = None
+        if workers := min(config.get("BROWSER_WORKERS", 1), len(self.instance_list)):
+            self.browser_pool = BrowserPool(workers)
+            for agent in self.instance_list:
+                agent.browser_pool = self.browser_pool
+        self.auth_refresher = None
+        if config.get("AUTH_REFRESH_ENABLE", True):
+            self.auth_refresher = AuthRefresher(self.instance_list,
+                                                lead=config.get("AUTH_REFRESH_BEFORE", 86400),
+                                                drain_timeout=config.get("AUTH_REFRESH_DRAIN", 30),
+                                                retry_interval=config.get("AUTH_REFRESH_RETRY", 300))
+            for agent in self.instance_list:
+                agent.auth_refresher = self.auth_refresher
 
     @property
-    def current(self):
-        if self.count < 0:
-            return self.instance_list[0]
-        else:
-            return self.instance_list[(self.count - 1) % len(self.instance_list)]
+    def current(self) -> ChatgptAgent:
+        return self.scheduler.last
 
     @property
     def next_instance(self) -> ChatgptAgent:
-        self.count += 1
-        return self.instance_list[self.count % len(self.instance_list)]
+        return self.scheduler.pick()
+
+    async def _ask_once(self, paragraphs: list[str], attempt: int) -> list[str] | None:
+        if attempt and len(paragraphs) == 1:
+            # The model split, merged or echoed a lone paragraph, quote it so it reads as one text.
+            # attempt only counts bad answers, a transport error retries the paragraph as it was.
+            paragraphs = ['&nbsp;' + paragraphs[0] + '&nbsp;']
+        agent = self.next_instance
+        with self.scheduler.track(agent):
+            return await agent.ask(paragraphs)
 
     async def ask(self, paragraphs: list[str]) -> list[str] | None:
-        add_quotation = False
-        for _ in range(len(self.instances)):
-            try:
-                return await self.next_instance.ask(paragraphs)
-            except UnequalParagraphCountException as e:
-                if len(paragraphs) == 1:
-                    if not add_quotation:
-                        paragraphs[0] = '&nbsp;' + paragraphs[0] + '&nbsp;'
-                        add_quotation = True
-                    continue
-                logger.warning(f"Email:{e.source} Failed | Retry spilt paragraphs")
-                task1 = None
-                task2 = None
-                done_email = None
-                for _ in range(len(self.instances)):
-                    try:
-                        task1 = asyncio.create_task(self.next_instance.ask(paragraphs[0:(len(paragraphs) // 2)]))
-                        done_email = self.current.user.EMAIL
-                        break
-                    except UnequalParagraphCountException as e:
-                        raise ChatWebReverseException(
-                            ErrorMsg.UnequalParagraphCountError % (e.source, e.length_origin, e.length_result))
-                    except Exception as e:
-                        logger.exception(e)
-                for _ in range(len(self.instances)):
-                    try:
-                        task2 = asyncio.create_task(
-                            self.next_instance.ask(paragraphs[(len(paragraphs) // 2):len(paragraphs)]))
-                        done_email = done_email + ", " + self.current.user.EMAIL
-                        break
-                    except UnequalParagraphCountException as e:
-                        raise ChatWebReverseException(
-                            ErrorMsg.UnequalParagraphCountError % (e.source, e.length_origin, e.length_result))
-                    except Exception as e:
-                        logger.exception(e)
-                result = await task1
-                result += await task2
-                logger.info(DebugInfoMsg.TRANSLATED_TEXT, Service.ChatWebGpt, done_email, result)
-                return result
-            except Exception as e:
-                logger.exception(e)
-        raise ChatWebReverseException(ChatWebReverseErrorType.FAILED_FATAL)
+        budget = RetryBudget(config.get("SPLIT_RETRY_BUDGET", 2) * len(paragraphs) + len(self.instances))
+        try:
+            result = await bisect_ask(self._ask_once, paragraphs, budget,
+                                      source=Service.ChatWebGpt, max_attempts=len(self.instances))
+        except Exception as e:
+            logger.exception(e)
+            raise ChatWebReverseException(ChatWebReverseErrorType.FAILED_FATAL) from e
+        if budget.spent:
+            logger.info(DebugInfoMsg.TRANSLATED_TEXT, Service.ChatWebGpt, f"{budget.spent} extra call(s)", result)
+        return result
 
     async def close(self):
         logger.debug('Start chat agent close()')
         await asyncio.gather(*[ins.close() for ins in self.instance_list], return_exceptions=True)
+        if self.browser_pool is not None:
+            logger.info("Browser pool stats: %s", self.browser_pool.stats)
+            self.browser_pool.close()
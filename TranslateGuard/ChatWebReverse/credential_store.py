@@ -0,0 +1,272 @@
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import threading
+from json import JSONDecodeError
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows, only single process mode
+    fcntl = None
+
+from . import logger
+from TranslateGuard.config import config, CONFIG_PATH
+from TranslateGuard.base_exceptions import ErrorMsg
+from TranslateGuard.base_message_enum import DebugInfoMsg
+from TranslateGuard.serialization import dumps_str
+
+AUTH_PATH = CONFIG_PATH / "ChatgptAuth"
+
+
+class CredentialStore:
+    """
+    Cookies and access tokens of all accounts, kept in memory.
+    Changes are written in the background, debounced into one batch, atomically:
+    the JSON backend merges them into the file under a lock and replaces it, the SQLite backend upserts
+    in one transaction. Either way worker processes owning other accounts keep theirs.
+    Outside a running event loop changes are written right away.
+    """
+
+    def __init__(self, path: Path, backend: str = "json", debounce: float = 1):
+        self.path = path
+        self.backend = backend
+        self.debounce = debounce
+        self._state: dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self._loaded = False
+        self._write_lock = threading.Lock()
+        self._flush_lock: asyncio.Lock | None = None
+        self._flush_task: asyncio.Task | None = None
+        self.stats = {"writes": 0, "accounts_written": 0, "failed": 0}
+
+    # ---- loading ----
+
+    def _read(self) -> dict[str, dict]:
+        state = {}
+        if self.backend == "sqlite":
+            if self.path.exists():
+                with sqlite3.connect(self.path) as db:
+                    for email, cookies, access_token in db.execute(
+                            "SELECT email, cookies, access_token FROM credential"):
+                        state[email] = {"cookies": json.loads(cookies) if cookies else None,
+                                        "access_token": json.loads(access_token) if access_token else None}
+        elif self.path.exists() and os.path.getsize(self.path):
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        return state
+
+    @staticmethod
+    def _read_legacy(email: str) -> dict:
+        """
+        Per account {email}_cookies.json and {email}_accessToken.json files of older versions.
+        """
+        entry = {"cookies": None, "access_token": None}
+        for key, name in (("cookies", f"{email}_cookies.json"), ("access_token", f"{email}_accessToken.json")):
+            path = AUTH_PATH / name
+            if path.exists() and os.path.getsize(path):
+                try:
+                    with open(path, 'r') as f:
+                        entry[key] = json.load(f)
+                except JSONDecodeError as e:
+                    logger.warning(ErrorMsg.MyJSONDecodeError, "CredentialStore", email, e.msg, e.pos, e.doc)
+        return entry
+
+    def _load(self, emails: list[str]) -> tuple[dict[str, dict], set[str]]:
+        """
+        All stored accounts, and the emails migrated from account files.
+        """
+        try:
+            state = self._read()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.error("Credential store %s unreadable, starting from account files | Why: %s", self.path, e)
+            state = {}
+        migrated = set()
+        for email in emails:
+            if email not in state:
+                state[email] = self._read_legacy(email)
+                if any(state[email].values()):
+                    migrated.add(email)
+        return state, migrated
+
+    def _apply(self, state: dict[str, dict], migrated: set[str]):
+        for email, entry in state.items():
+            self._state.setdefault(email, entry)
+        # Written with the next batch.
+        self._dirty.update(migrated)
+        self._loaded = True
+
+    async def load(self, emails: list[str]):
+        """
+        Read every account in a worker thread, before agents ask for their credentials.
+        """
+        self._apply(*await asyncio.to_thread(self._load, emails))
+
+    def _entry(self, email: str) -> dict:
+        if not self._loaded:
+            # Not loaded ahead, e.g. a script using a single agent.
+            self._apply(*self._load([email]))
+        if email not in self._state:
+            self._state[email] = self._read_legacy(email)
+        return self._state[email]
+
+    # ---- access ----
+
+    def get_cookies(self, email: str) -> list[dict] | None:
+        return self._entry(email)["cookies"]
+
+    def get_access_token(self, email: str) -> dict | None:
+        """
+        The /api/auth/session json of email, with accessToken and expires.
+        """
+        return self._entry(email)["access_token"]
+
+    def set_cookies(self, email: str, cookies: list[dict]):
+        entry = self._entry(email)
+        if entry["cookies"] != cookies:
+            entry["cookies"] = cookies
+            self._mark(email)
+
+    def set_access_token(self, email: str, access_token: dict):
+        entry = self._entry(email)
+        if entry["access_token"] != access_token:
+            entry["access_token"] = access_token
+            self._mark(email)
+
+    # ---- persistence ----
+
+    def _mark(self, email: str):
+        self._dirty.add(email)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            batch = self._take_batch()
+            try:
+                self._write(batch)
+            except Exception:
+                self._dirty.update(batch)
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    def _take_batch(self) -> dict[str, tuple[str, str]]:
+        """
+        Serialize the dirty accounts while still on the loop.
+        """
+        batch = {email: (dumps_str(self._state[email]["cookies"]), dumps_str(self._state[email]["access_token"]))
+                 for email in self._dirty}
+        self._dirty = set()
+        return batch
+
+    def _write(self, batch: dict[str, tuple[str, str]]):
+        with self._write_lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.backend == "sqlite":
+                    with sqlite3.connect(self.path) as db:
+                        db.execute("CREATE TABLE IF NOT EXISTS credential ("
+                                   "email TEXT PRIMARY KEY, cookies TEXT, access_token TEXT)")
+                        db.executemany("INSERT OR REPLACE INTO credential VALUES (?, ?, ?)",
+                                       [(email, cookies, access_token)
+                                        for email, (cookies, access_token) in batch.items()])
+                else:
+                    self._write_json(batch)
+                self.stats["writes"] += 1
+                self.stats["accounts_written"] += len(batch)
+                logger.debug(DebugInfoMsg.SAVE_SUCCESS, self.path)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(ErrorMsg.SavedFailed, self.path, e)
+                raise
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """
+        Serialize the read-modify-write of processes sharing the JSON file.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.path.with_name(self.path.name + ".lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_json(self, batch: dict[str, tuple[str, str]]):
+        entries = {email: f'{{"cookies":{cookies},"access_token":{token}}}'
+                   for email, (cookies, token) in batch.items()}
+        with self._file_lock():
+            try:
+                stored = self._read()
+            except ValueError as e:
+                logger.error("Credential store %s unreadable, overwriting it | Why: %s", self.path, e)
+                stored = {}
+            # Accounts of other processes are kept as they are on disk.
+            for email, entry in stored.items():
+                entries.setdefault(email, dumps_str(entry))
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, 'w') as f:
+                f.write("{" + ",".join(f'{dumps_str(email)}:{entry}' for email, entry in entries.items()) + "}")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.debounce)
+        await self.flush()
+
+    async def flush(self):
+        """
+        Write pending changes now, in a worker thread.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            while self._dirty:
+                batch = self._take_batch()
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception:
+                    # Keep them dirty, the next change or checkpoint writes them again.
+                    self._dirty.update(batch)
+                    return
+
+    async def checkpoint_background(self, agents: list, interval: float = 300):
+        """
+        Demon copying the live cookie jar of every agent into the store.
+        """
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                for agent in agents:
+                    self.set_cookies(agent.user.EMAIL, agent.jar_cookies())
+            except asyncio.CancelledError:
+                logger.info("Credential checkpoint has been cancelled | stats %s", self.stats)
+                break
+            except Exception as e:
+                logger.exception(e)
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+
+def create_credential_store() -> CredentialStore:
+    backend = config.get("CREDENTIAL_STORE", "json")
+    return CredentialStore(AUTH_PATH / ("credentials.sqlite3" if backend == "sqlite" else "credentials.json"),
+                           backend=backend,
+                           debounce=config.get("CREDENTIAL_DEBOUNCE", 1))
+
+
+@functools.cache
+def get_credential_store() -> CredentialStore:
+    """
+    The process wide store, configured on first use.
+    """
+    return create_credential_store()
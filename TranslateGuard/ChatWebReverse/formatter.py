@@ -1,3 +1,4 @@
+from TranslateGuard.base_formatter import use_markers, mark_paragraphs
 from TranslateGuard.config import config
 
 
@@ -6,10 +7,14 @@ def build_prompt_web_chat_gpt(paragraphs: list[str]) -> str:
     Build and define prompt
     """
     length = len(paragraphs)
+    keep = ''
     if length == 1:
         text = paragraphs[0]
         p = "text"
-
+    elif use_markers(length):
+        text = mark_paragraphs(paragraphs)
+        p = f"{length} paragraphs"
+        keep = 'Start every translated paragraph with the [[number]] marker of its original. '
     else:
         text = '\n'.join([f"{num}. {para}" for num, para in enumerate(paragraphs, 1)])
         p = f"{length} paragraphs"
@@ -17,6 +22,7 @@ def build_prompt_web_chat_gpt(paragraphs: list[str]) -> str:
     user_prompt = (
         f'{config.SYSTEM_PROMPT}'
         f'Translate the following {p} into simplified Chinese. '
+        f'{keep}'
         f'Remember do not explain my original text, '
         f'do not generate content that is not beneficial for translation.:\n\n'
         f'{text}')
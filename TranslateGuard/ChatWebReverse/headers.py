@@ -1,3 +1,5 @@
+import functools
+
 from TranslateGuard.config import config
 
 
@@ -31,6 +33,15 @@ def get_headers_for_conversation(access_token: str,
                                  device_id: str,
                                  requirements_token: str,
                                  conversation_id: str = None) -> dict:
+    return {**_conversation_headers(access_token, device_id, conversation_id),
+            'Openai-Sentinel-Chat-Requirements-Token': requirements_token}
+
+
+@functools.lru_cache(maxsize=256)
+def _conversation_headers(access_token: str, device_id: str, conversation_id: str | None) -> dict:
+    """
+    Conversation headers without the requirements token, which changes every request.
+    """
     if conversation_id is None:
         return {
             "Origin": "https://chat.openai.com",
@@ -42,7 +53,6 @@ def get_headers_for_conversation(access_token: str,
             'Sec-Ch-Ua': config["USER_AGENT_UA"]["Sec-Ch-Ua"],
             'Oai-Device-Id': device_id,
             'Oai-Language': 'en-US',
-            'Openai-Sentinel-Chat-Requirements-Token': requirements_token,
             'Sec-Ch-Ua-Mobile': '?0'
         }
     else:
@@ -57,7 +67,6 @@ def get_headers_for_conversation(access_token: str,
             'Sec-Ch-Ua': config["USER_AGENT_UA"]["Sec-Ch-Ua"],
             'Oai-Device-Id': device_id,
             'Oai-Language': 'en-US',
-            'Openai-Sentinel-Chat-Requirements-Token': requirements_token,
             'Sec-Ch-Ua-Mobile': '?0'
         }
 
@@ -75,7 +84,11 @@ def get_headers_for_del_conversation(access_token: str, conversation_id: str) ->
     }
 
 
+@functools.lru_cache(maxsize=64)
 def get_headers_for_general(access_token: str, device_id: str) -> dict:
+    """
+    Built once per token and device, the returned dict is shared and must not be changed.
+    """
     return {
         'Origin': 'https://chat.openai.com',
         'Referer': f'https://chat.openai.com/',
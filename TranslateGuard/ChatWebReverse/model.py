@@ -1,5 +1,5 @@
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import namedtuple
 
 User = namedtuple('User', ['EMAIL', 'PASSWORD', 'USE'])
@@ -11,5 +11,5 @@ class Conversation:
     is_echo: bool = False
     is_new: bool = True
     conversation_id: str | None = None
-    current_node: str = str(uuid.uuid4())
+    current_node: str = field(default_factory=lambda: str(uuid.uuid4()))
     requirements_token: str | None = None
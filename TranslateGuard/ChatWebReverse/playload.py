@@ -1,3 +1,6 @@
+from TranslateGuard.serialization import JsonTemplate
+
+
 def get_req_con_playload(prompt: str,
                          websocket_request_id: str,
                          conversation_id: str | None,
@@ -28,6 +31,27 @@ def get_req_con_playload(prompt: str,
     }
 
 
+REQ_CON_TEMPLATE = JsonTemplate(
+    get_req_con_playload("@@prompt@@", "@@websocket_request_id@@", "@@conversation_id@@",
+                         "@@parent_message_id@@", "@@message_id@@"),
+    ("prompt", "websocket_request_id", "conversation_id", "parent_message_id", "message_id"))
+
+
+def render_req_con_playload(prompt: str,
+                            websocket_request_id: str,
+                            conversation_id: str | None,
+                            parent_message_id: str | None,
+                            message_id: str) -> bytes:
+    """
+    The next conversation playload as JSON, only the changing fields are serialized per call.
+    """
+    return REQ_CON_TEMPLATE.render(prompt=prompt,
+                                   websocket_request_id=websocket_request_id,
+                                   conversation_id=conversation_id,
+                                   parent_message_id=parent_message_id,
+                                   message_id=message_id)
+
+
 def get_continue_con_playload(conversation_id: str,
                               parent_message_id: str) -> dict:
     """
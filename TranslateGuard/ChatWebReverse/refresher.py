@@ -0,0 +1,110 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from . import logger
+
+
+class AuthRefresher:
+    """
+    Refresh access tokens and cookies with selenium before they expire, one account at a time.
+    An account being refreshed gets no new prompts, and waits for its prompts in flight first,
+    so no translation ever waits for a browser login.
+    Accounts that hit a 4xx during a translation are refreshed next.
+    """
+
+    def __init__(self,
+                 agents: list,
+                 lead: float = 86400,
+                 drain_timeout: float = 30,
+                 retry_interval: float = 300,
+                 check_interval: float = 60):
+        self.agents = agents
+        # Refresh this many seconds before the access token expires.
+        self.lead = lead
+        self.drain_timeout = drain_timeout
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self._requested: list = []
+        self._wake = asyncio.Event()
+        self._retry_at: dict[int, float] = {}
+        self.stats = {"refreshed": 0, "failed": 0, "requested": 0}
+
+    def request(self, agent):
+        """
+        Ask for agent to be refreshed as soon as possible.
+        """
+        if self._retry_at.get(id(agent), 0) > time.monotonic():
+            return
+        if agent not in self._requested and not agent.refreshing:
+            logger.warning("Auth refresh requested | Email: %s", agent.user.EMAIL)
+            self.stats["requested"] += 1
+            self._requested.append(agent)
+            self._wake.set()
+
+    def _due_in(self, agent) -> float:
+        """
+        Seconds until agent should be refreshed, 0 if it is overdue.
+        """
+        expires: datetime | None = agent.access_token_expires
+        due = 0.0 if expires is None or agent.access_token is None else \
+            (expires - datetime.now(timezone.utc)).total_seconds() - self.lead
+        retry_in = self._retry_at.get(id(agent), 0) - time.monotonic()
+        return max(due, retry_in, 0)
+
+    def _next(self) -> tuple[object | None, float]:
+        if self._requested:
+            return self._requested.pop(0), 0
+        if not self.agents:
+            return None, self.check_interval
+        agent = min(self.agents, key=self._due_in)
+        return agent, self._due_in(agent)
+
+    async def _drain(self, agent):
+        """
+        Wait until the prompts agent has in flight are answered, at most drain_timeout.
+        """
+        end = time.monotonic() + self.drain_timeout
+        while agent.idle_conversations.qsize() < len(agent.conversations) and time.monotonic() < end:
+            await asyncio.sleep(0.1)
+
+    async def refresh(self, agent):
+        agent.refreshing = True
+        start = time.monotonic()
+        try:
+            await self._drain(agent)
+            await agent.refresh_auth()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            self._retry_at[id(agent)] = time.monotonic() + self.retry_interval
+            logger.error("Auth refresh failed | Email: %s | retry in %ss | Why: %s", agent.user.EMAIL,
+                         self.retry_interval, e)
+        else:
+            self.stats["refreshed"] += 1
+            # Never log the same account in again right away, even if the new token expires soon too.
+            self._retry_at[id(agent)] = time.monotonic() + self.retry_interval
+            logger.info("Auth refreshed in %.1fs | Email: %s | expires %s", time.monotonic() - start,
+                        agent.user.EMAIL, agent.access_token_expires)
+        finally:
+            agent.refreshing = False
+
+    async def run(self):
+        """
+        Demon refreshing the account due first, then the next one.
+        """
+        try:
+            while True:
+                agent, due_in = self._next()
+                if agent is not None and due_in <= 0:
+                    await self.refresh(agent)
+                    continue
+                self._wake.clear()
+                try:
+                    # Expiries move when a token is refreshed elsewhere, look again from time to time.
+                    await asyncio.wait_for(self._wake.wait(), timeout=min(due_in, self.check_interval))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            logger.info("AuthRefresher has been cancelled | stats %s", self.stats)
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from . import logger
+
+
+class RequirementsTokenPool:
+    """
+    Fresh sentinel chat-requirements tokens of one account, fetched ahead of time,
+    so a prompt only needs the conversation POST.
+    Every token is used once and tagged with the access token it was fetched with.
+    """
+
+    def __init__(self, size: int = 2, ttl: float = 60, margin: float = 10):
+        self.size = size
+        self.ttl = ttl
+        # A token handed out must stay valid for the conversation POST, refresh it this long before expiry.
+        self.margin = margin
+        self._tokens: deque[tuple[str, float, str | None]] = deque()
+        self._wanted = asyncio.Event()
+        self.stats = {"hits": 0, "misses": 0, "fetched": 0, "expired": 0, "errors": 0}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _fresh(self, expires_at: float, owner: str | None, access_token: str | None) -> bool:
+        return owner == access_token and expires_at - self.margin > time.monotonic()
+
+    def take(self, access_token: str | None) -> str | None:
+        """
+        Oldest fresh token fetched with access_token, None if the pool ran dry.
+        """
+        self._wanted.set()
+        while self._tokens:
+            token, expires_at, owner = self._tokens.popleft()
+            if self._fresh(expires_at, owner, access_token):
+                self.stats["hits"] += 1
+                return token
+            self.stats["expired"] += 1
+        self.stats["misses"] += 1
+        return None
+
+    def clear(self):
+        self._tokens.clear()
+        self._wanted.set()
+
+    async def run(self, fetch: Callable[[], Awaitable[tuple[str, str | None]]], current: Callable[[], str | None],
+                  source: str = ""):
+        """
+        Keep size tokens ready. fetch() returns a new token and the access token it used,
+        current() is the access token of the account right now.
+        """
+        backoff = 1
+        while True:
+            stale = [item for item in self._tokens if not self._fresh(item[1], item[2], current())]
+            for item in stale:
+                self._tokens.remove(item)
+                self.stats["expired"] += 1
+            if len(self._tokens) < self.size:
+                try:
+                    token, access_token = await fetch()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.warning("Prefetch chat-requirements failed | %s | retry in %ss | Why: %s",
+                                   source, backoff, e)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+                backoff = 1
+                self._tokens.append((token, time.monotonic() + self.ttl, access_token))
+                self.stats["fetched"] += 1
+                continue
+            self._wanted.clear()
+            refresh_in = self._tokens[0][1] - self.margin - time.monotonic()
+            try:
+                await asyncio.wait_for(self._wanted.wait(), timeout=max(refresh_in, 0))
+            except asyncio.TimeoutError:
+                pass
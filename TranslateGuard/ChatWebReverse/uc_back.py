@@ -9,7 +9,6 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 
 from TranslateGuard.config import CONFIG_PATH
-from TranslateGuard.ChatWebReverse.auth_handler import save_access_token, save_cookies, get_cookies
 from TranslateGuard.config import config
 from . import logger
 from .exceptions import ChatWebReverseErrorType
@@ -64,30 +63,33 @@ class SeleniumRequests:
         return user_agent_ua
 
     # noinspection PyTestUnpassedFixture
-    def fetch_access_token_cookies(self) -> tuple[list[dict], str, str]:
+    def fetch_access_token_cookies(self, cookies: list[dict], quit_driver: bool = True) \
+            -> tuple[list[dict], dict, str]:
         """
-        Fetches the cookies and access_token(auth_again = true) from /api/auth/session.
+        Log in with cookies, then fetches the new cookies and the session json (auth_again = true)
+        from /api/auth/session. The caller keeps them in the credential store.
+        A warm browser of the browser pool keeps its driver (quit_driver=False) for the next account.
         """
-        device_id = self.chatgpt_login_with_cookies()
+        device_id = self.chatgpt_login_with_cookies(cookies)
         self.driver.get(f"https://chat.openai.com/api/auth/session")
         cookies = self.driver.get_cookies()
-        save_cookies(self.user.EMAIL, cookies)
         json_text = self.driver.find_element(By.TAG_NAME, 'pre').text
         logger.info(DebugInfoMsg.FETCH_SUCCESS, Service.ChatWebGpt, self.user.EMAIL, json_text)
-        save_access_token(self.user.EMAIL, json_text)
-        self.driver.quit()
-        self._driver = None
-        return cookies, json.loads(json_text)["accessToken"], device_id
+        if quit_driver:
+            self.driver.quit()
+            self._driver = None
+        return cookies, json.loads(json_text), device_id
 
-    def chatgpt_login_with_cookies(self, headless: bool = True) -> str:
+    def chatgpt_login_with_cookies(self, cookies_: list[dict], headless: bool = True) -> str:
         """
         Login to chat.openai.com with cookies.
         """
         if headless:
             self.driver.execute_cdp_cmd('Network.setUserAgentOverride',
                                         {'userAgent': config["USER_AGENT_UA"]["User-Agent"]})
-        cookies_ = get_cookies(self.user.EMAIL)
         self.driver.get('https://chat.openai.com')
+        # A reused browser still holds the cookies of the account it logged in before.
+        self.driver.delete_all_cookies()
         # Correct the inconsistent sameSite value exported by the EditThisCookie extension.
         for cookie in cookies_:
             try:
@@ -114,7 +116,7 @@ class SeleniumRequests:
                 self._driver = uc.Chrome(
                     driver_executable_path=_get_driver_executable_path(),
                     headless=False)
-                return self.chatgpt_login_with_cookies(False)
+                return self.chatgpt_login_with_cookies(cookies_, False)
         while True:
             try:
                 if self._wait35.until(lambda x: x.find_element(By.XPATH, '//textarea[@id="prompt-textarea"]')):
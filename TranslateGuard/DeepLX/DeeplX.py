@@ -6,12 +6,19 @@ import time
 import aiohttp
 import requests
 
+from TranslateGuard.base_exceptions import GeneralException, ErrorMsg, UnequalParagraphCountException
 from TranslateGuard.base_formatter import PATTERN_NEW_LINE
 from TranslateGuard.base_message_enum import DebugInfoMsg, Service
+from TranslateGuard.bisect_executor import bisect_ask, RetryBudget
 from TranslateGuard.config import config
+from TranslateGuard.deadline import engine_timeout
+from TranslateGuard.scheduler import Scheduler
+from TranslateGuard.serialization import JsonTemplate, loads
 
 logger = logging.getLogger(__name__)
 
+REQUEST_TEMPLATE = JsonTemplate({"text": "@@text@@", "source_lang": "EN", "target_lang": "ZH"}, ("text",))
+
 
 class DeepLXLocal:
     def __init__(self, url="https://www2.deepl.com/jsonrpc", need_proxy=False) -> None:
@@ -112,13 +119,10 @@ class DeeplX:
             resp = await self.session.post(
                 url=self.url,
                 headers=self.headers,
-                json={
-                    "text": text,
-                    "source_lang": "EN",
-                    "target_lang": "ZH"
-                }
+                data=REQUEST_TEMPLATE.render(text=text),
+                timeout=aiohttp.ClientTimeout(total=engine_timeout(Service.DeeplX, 40))
             )
-            resp = await resp.json()
+            resp = await resp.json(loads=loads)
             logger.debug(DebugInfoMsg.RESPONSE_SUCCESS, Service.DeeplX, self.url, resp)
             return resp["data"]
         except Exception as e:
@@ -128,31 +132,52 @@ class DeeplX:
 class DeepLXPool:
     def __init__(self, app):
         self.app = app
-        emails = [user["EMAIL"] for user in config.ACCOUNTS if user["USE"]]
-        self.instance_list = [DeeplX("http://localhost:1188/translate",
-                                     app["client_sessions"][emails[0]]),
-                              DeeplX("https://service-7t4cydvz-1301824650.sh.tencentapigw.com/translate",
-                                     app["client_sessions"][emails[len(emails) - 1]])]
-        self.count = -1
+        # Without chat accounts, DeepLX shares the api session.
+        sessions = list(app["client_sessions"].values()) or [app["openai_session"]]
+        urls = config.get("DEEPLX_URLS", ["http://localhost:1188/translate",
+                                          "https://service-7t4cydvz-1301824650.sh.tencentapigw.com/translate"])
+        self.instance_list = [DeeplX(url, sessions[-i % len(sessions)]) for i, url in enumerate(urls)]
+        self.scheduler = Scheduler(Service.DeeplX, self.instance_list,
+                                   label=lambda deeplx: deeplx.url,
+                                   capacity=lambda deeplx: 4)
 
     @property
     def current(self) -> DeeplX:
-        if self.count < 0:
-            return self.instance_list[0]
-        else:
-            return self.instance_list[self.count % len(self.instance_list)]
+        return self.scheduler.last
 
     @property
     def next_instance(self) -> DeeplX:
-        self.count += 1
-        return self.instance_list[self.count % len(self.instance_list)]
+        return self.scheduler.pick()
 
-    async def ask(self, paragraphs: list[str]) -> list[str] | None:
+    async def _ask_once(self, paragraphs: list[str], attempt: int) -> list[str]:
+        """
+        Paragraphs go as lines of one text, the answer must come back with as many lines.
+        """
+        instance = self.next_instance
         text = "\n".join(paragraphs)
-        logger.info(DebugInfoMsg.REQUEST_TEXT, Service.DeeplX, self.next_instance.url, text)
+        logger.info(DebugInfoMsg.REQUEST_TEXT, Service.DeeplX, instance.url, text)
+        with self.scheduler.track(instance):
+            if (result := await instance.ask(text)) is None:
+                raise GeneralException(ErrorMsg.UnhandledError, Service.DeeplX, instance.url, "no result")
+            result = result.strip("\n ")
+            if len(paragraphs) == 1:
+                # Lines of a single paragraph are all its own.
+                return [PATTERN_NEW_LINE.sub(" ", result)]
+            lines = PATTERN_NEW_LINE.split(result)
+            if len(lines) != len(paragraphs):
+                logger.error(ErrorMsg.UnequalParagraphCountError, instance.url, len(paragraphs), len(lines))
+                raise UnequalParagraphCountException(len(paragraphs), len(lines), source=instance.url)
+            return lines
+
+    async def ask(self, paragraphs: list[str]) -> list[str]:
+        """
+        An unequal line count, e.g. of a paragraph with line breaks, is bisected down to single paragraphs.
+        """
+        budget = RetryBudget(config.get("SPLIT_RETRY_BUDGET", 2) * len(paragraphs) + len(self.instance_list))
         try:
-            result = await self.next_instance.ask(text)
-        except aiohttp.ClientResponseError as e:
+            return await bisect_ask(self._ask_once, paragraphs, budget,
+                                    source=Service.DeeplX, max_attempts=len(self.instance_list) + 1)
+        except Exception as e:
             logger.error(e)
-            result = await self.next_instance.ask(text)
-        return PATTERN_NEW_LINE.split(result)
+            raise GeneralException(ErrorMsg.UnhandledError, Service.DeeplX, self.current.url, "all retries failed") \
+                from e
@@ -1,3 +1,4 @@
+from TranslateGuard.base_formatter import use_markers, mark_paragraphs
 from TranslateGuard.base_message_enum import DebugInfoMsg, Service
 from . import logger
 from ..config import config
@@ -8,14 +9,20 @@ def build_prompt_gpt_turbo(paragraphs: list[str]) -> str:
     Build and define prompt for Gpt turbo modle.
     """
     length = len(paragraphs)
+    keep = ''
     if length == 1:
         text = paragraphs[0]
         p = "text"
+    elif use_markers(length):
+        text = mark_paragraphs(paragraphs)
+        p = f"{length} paragraphs"
+        keep = 'Start every translated paragraph with the [[number]] marker of its original. '
     else:
         text = '\n'.join([f"{num}. {para}" for num, para in enumerate(paragraphs, 1)])
         p = f"{length} paragraphs"
     user_prompt = (
         f'Translate the following {p} into simplified Chinese. '
+        f'{keep}'
         f'Remember do not explain my original text, '
         f'do not generate content that is not beneficial for translation.:\n\n'
         f'{text}')
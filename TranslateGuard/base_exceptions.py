@@ -18,14 +18,17 @@ class ErrorMsg(StrEnum):
     UnequalParagraphCountError = "UnequalParagraphCountError! Source: %s, Exception: Need %s but received %s"  # noqa
     TooManyRequestsException = "TooManyRequestsException! Too many requests, your IP has been blocked by DeepL temporarily, please don't request it frequently in a short time." # noqa
     UnhandledError = "UnhandledError! Service: %s | Source: %s Failed, Exception:↓↓↓ %s" # noqa
+    NoLLMEngineError = "NoLLMEngineError! Neither %s accounts nor %s api keys are enabled in this process"
 
 
 class UnequalParagraphCountException(Exception):
-    def __init__(self, length_origin: int, length_result: int, source: str):
+    def __init__(self, length_origin: int, length_result: int, source: str, partial: list | None = None):
         self.error_type = ErrorMsg.UnequalParagraphCountError
         self.length_origin = length_origin
         self.length_result = length_result
         self.source = source
+        # Paragraphs recovered by marker, None where the marker was missing.
+        self.partial = partial
         super().__init__(ErrorMsg.UnequalParagraphCountError)
 
 
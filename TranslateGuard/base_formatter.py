@@ -1,15 +1,22 @@
 import asyncio
-import json
+import functools
 import logging
 import random
 import re
 import string
 import time
+from contextlib import aclosing
 from typing import Union
 
 from .ChatWebReverse.exceptions import ChatWebReverseException
 from .config import config
-from .base_exceptions import UnequalParagraphCountException, ErrorMsg
+from .base_exceptions import UnequalParagraphCountException, ErrorMsg, GeneralException
+from .base_message_enum import Service
+from .batch_planner import get_planner
+from . import deadline, tracing
+from .cache import cache_key
+from .serialization import JsonTemplate
+from .singleflight import AbandonedFlightException
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +27,23 @@ PATTERN_PARAGRAPH = re.compile(r'^\d+\.\s*(.+)', re.MULTILINE)
 # Parse if wrapped in p tags
 PATTERN_P_TAGS = re.compile(r'<p>(.+)</p>')
 PATTERN_NEW_LINE = re.compile(r'\n+')
-PATTERN_SPLIT = re.compile(config.PATTERN_SPLIT)
 PATTERN_B_TAG = re.compile(r"<b\d></b\d>")
+# Parse [[1]] [[2]] [[3]] ..., marking the start of each paragraph
+PATTERN_MARKER = re.compile(r'^[ \t]*\[\[(\d+)]][ \t]*', re.MULTILINE)
 
-PRINTABLE_SPLIT_STRING = config.PATTERN_SPLIT.replace("\n", "\\n")
+
+@functools.cache
+def _pattern_split() -> re.Pattern:
+    return re.compile(config.PATTERN_SPLIT)
+
+
+def __getattr__(name: str):
+    # Built from config on first use, importing this module reads no config.
+    if name == "PATTERN_SPLIT":
+        return _pattern_split()
+    if name == "PRINTABLE_SPLIT_STRING":
+        return config.PATTERN_SPLIT.replace("\n", "\\n")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def build_prompt(paragraphs: list[str], alter: str = "") -> str:
@@ -43,44 +63,109 @@ def build_prompt(paragraphs: list[str], alter: str = "") -> str:
     return user_prompt
 
 
-def build_result(raw_input: str, length: int, source: str) -> Union[list[str], None]:
+def use_markers(length: int) -> bool:
+    return length > 1 and config.get("PROMPT_MODE", "numbered") == "marked"
+
+
+def mark_paragraphs(paragraphs: list[str]) -> str:
+    """
+    Prefix every paragraph with its [[NUM]] marker.
+    """
+    return '\n'.join([f"[[{num}]] {para}" for num, para in enumerate(paragraphs, 1)])
+
+
+def parse_marked(raw_input: str, length: int) -> list[str | None]:
+    """
+    Recover paragraphs by their [[NUM]] marker. Unknown, repeated or empty markers are ignored,
+    so a merged or dropped paragraph only leaves None at its own position.
+    """
+    paragraphs: list[str | None] = [None] * length
+    matches = list(PATTERN_MARKER.finditer(raw_input))
+    for i, match in enumerate(matches):
+        num = int(match.group(1)) - 1
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(raw_input)
+        text = PATTERN_NEW_LINE.sub(' ', raw_input[match.end():end].strip())
+        if 0 <= num < length and paragraphs[num] is None and text:
+            paragraphs[num] = text
+    return paragraphs
+
+
+def build_result(raw_input: str, length: int, source: str, engine: str | None = None) -> Union[list[str], None]:
     """
     Build paragraphs joined by PATTERN_SPLIT.
+    The outcome is recorded for the batch planner if engine is given.
     """
     raw_input = raw_input.strip("\n ")
+    if use_markers(length):
+        paragraphs = parse_marked(raw_input, length)
+        found = length - paragraphs.count(None)
+        if engine is not None:
+            get_planner().record(engine, length, found == length)
+        if found != length:
+            raise UnequalParagraphCountException(length, found, source=source, partial=paragraphs)
+        return paragraphs
     if len(PATTERN_HAS_EXTRA_NUMBER.findall(raw_input)) == length:
         paragraphs = PATTERN_PARAGRAPH.findall(raw_input)
     else:
         paragraphs = PATTERN_NEW_LINE.split(raw_input)
 
+    if engine is not None:
+        get_planner().record(engine, length, len(paragraphs) == length)
     if len(paragraphs) != length:
         raise UnequalParagraphCountException(length, len(paragraphs), source=source)
     else:
         return paragraphs
 
 
-def response_normal_json(content: str) -> str:
+def completion_id() -> str:
+    return f"chatcmpl-{''.join(random.choices(string.ascii_letters + string.digits, k=30))}"  # fake
+
+
+NORMAL_RESPONSE_TEMPLATE = JsonTemplate({
+    "id": "@@id@@",
+    "object": "chat.completion",
+    "created": "@@created@@",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": "@@content@@",
+        },
+        "finish_reason": "stop"
+    }],
+    "usage": {
+        "prompt_tokens": 2048,  # fake
+        "completion_tokens": 8192,  # fake
+        "total_tokens": 10240  # fake
+    }
+}, ("id", "created", "content"))
+
+STREAM_CHUNK_TEMPLATE = JsonTemplate({
+    "id": "@@id@@",
+    "object": "chat.completion.chunk",
+    "created": "@@created@@",
+    "choices": [{
+        "index": 0,
+        "delta": "@@delta@@",
+        "finish_reason": "@@finish_reason@@"
+    }]
+}, ("id", "created", "delta", "finish_reason"))
+
+
+def response_normal_json(content: str) -> bytes:
     """
     Normal openai completion response.
     """
-    return json.dumps({
-        "id": f"chatcmpl-{''.join(random.choices(string.ascii_letters + string.digits, k=30))}",  # fake
-        "object": "chat.completion",
-        "created": int(time.time()),
-        "choices": [{
-            "index": 0,
-            "message": {
-                "role": "assistant",
-                "content": content,
-            },
-            "finish_reason": "stop"
-        }],
-        "usage": {
-            "prompt_tokens": 2048,  # fake
-            "completion_tokens": 8192,  # fake
-            "total_tokens": 10240  # fake
-        }
-    }, ensure_ascii=False)
+    return NORMAL_RESPONSE_TEMPLATE.render(id=completion_id(), created=int(time.time()), content=content)
+
+
+def response_stream_chunk(chunk_id: str, content: str | None, finish_reason: str | None = None) -> bytes:
+    """
+    One server-sent event of a streamed openai completion response.
+    """
+    delta = {} if content is None else {"role": "assistant", "content": content}
+    return b"data: " + STREAM_CHUNK_TEMPLATE.render(id=chunk_id, created=int(time.time()), delta=delta,
+                                                    finish_reason=finish_reason) + b"\n\n"
 
 
 def _has_b_tag(paragraph: str, num_b_tags=2) -> bool:
@@ -93,53 +178,197 @@ def _has_b_tag(paragraph: str, num_b_tags=2) -> bool:
         return False
 
 
-async def hybrid_response(request, content: str) -> str:
+ENGINE_POOLS = {
+    Service.DeeplX: "DeepLX",
+    Service.ChatWebGpt: "chat_agent_pool",
+    Service.GptTurbo: "GptTurbo",
+}
+
+
+def _llm_engine(app) -> Service:
+    """
+    Engine for paragraphs without b tags, LLM_ENGINE in config if its pool is registered.
+    """
+    engine = Service(config.get("LLM_ENGINE", Service.ChatWebGpt))
+    if ENGINE_POOLS[engine] in app:
+        return engine
+    other = Service.ChatWebGpt if Service.GptTurbo == engine else Service.GptTurbo
+    if ENGINE_POOLS[other] in app:
+        return other
+    raise GeneralException(ErrorMsg.NoLLMEngineError, Service.ChatWebGpt, Service.GptTurbo)
+
+
+async def _translate_group(request, engine: str, group: list[tuple[int, str]]) -> tuple[str, list[tuple[int, str]]]:
+    """
+    Translate (NUM,PARA) pairs with the pool behind engine, keep their NUM.
+    Returns the engine that answered, another one if a hedge won, with the translated pairs.
+    """
+    logger.info("(NUM,PARA) | %s | origin paragraph(s):↓↓↓\n%s", engine, group)
+    texts = [item[1] for item in group]
+    pool = request.app[ENGINE_POOLS[engine]]
+    hedger = request.app.get("hedger")
+    with tracing.span("translate", engine=engine, paragraphs=len(texts)):
+        if hedger is not None and engine == hedger.engine and ENGINE_POOLS[hedger.target] in request.app:
+            engine, result = await hedger.ask(lambda: pool.ask(texts),
+                                              lambda: request.app[ENGINE_POOLS[hedger.target]].ask(texts),
+                                              len(texts))
+        else:
+            result = await pool.ask(texts)
+    if result is None or len(result) != len(texts):
+        # Never let a misaligned answer shift translations, or reach the cache.
+        raise UnequalParagraphCountException(len(texts), 0 if result is None else len(result), source=engine)
+    group = [(piece[0], result[i]) for i, piece in enumerate(group)]
+    logger.info("Translated (NUM,PARA) | %s | paragraph(s):↓↓↓\n%s", engine, group)
+    return engine, group
+
+
+def _batches(engine: str, group: list[tuple[int, str]], batch_size: int | None) -> list[list[tuple[int, str]]]:
+    """
+    LLM groups are sized by the batch planner, DeepLX groups by batch_size only.
+    """
+    if engine != Service.DeeplX:
+        return get_planner().plan(engine, group, batch_size)
+    if not batch_size:
+        return [group]
+    return [group[i:i + batch_size] for i in range(0, len(group), batch_size)]
+
+
+async def hybrid_translate(request, content: str, batch_size: int | None = None):
+    """
+    Translate content and yield (NUM, paragraphs) as soon as a run of paragraphs
+    continuing the previous one is ready, so the output always keeps the original order.
+    Paragraphs found in the translation cache are answered directly, paragraphs already being
+    translated by a concurrent request are waited for, only the rest go to the engines,
+    in planned batches of at most batch_size paragraphs per engine call.
+    Paragraphs still pending when the request deadline is near are returned untranslated.
+    """
+    with tracing.span("split") as span:
+        paragraphs = [p.strip() for p in _pattern_split().split(content)]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Split | paragraphs:↓↓↓\n%s', paragraphs)
+        translation_cache = request.app.get("translation_cache")
+        inflight = request.app.get("inflight")
+        target_lang = config.get("TARGET_LANG", "zh-CN")
+        llm_engine = _llm_engine(request.app)
+        tag_engine = Service.DeeplX if ENGINE_POOLS[Service.DeeplX] in request.app else llm_engine
+        engines = [tag_engine if _has_b_tag(paragraph) else llm_engine for paragraph in paragraphs]
+        keys = [cache_key(paragraph, target_lang, engine) for paragraph, engine in zip(paragraphs, engines)]
+        if span is not None:
+            span.set(paragraphs=len(paragraphs))
+    results: list[str | None] = [None] * len(paragraphs)
+    owned: dict[int, asyncio.Future] = {}
+    pending = set()
+    # Tasks waiting for concurrent requests, with the nums they wait for.
+    waiters: dict[asyncio.Task, set[int]] = {}
+    cursor = 0
+
+    def schedule(nums: list[int]):
+        """
+        Translate nums, or wait for them if a concurrent request already translates them.
+        """
+        if inflight is not None:
+            claimed, waiting = inflight.claim({num: keys[num] for num in nums})
+        else:
+            claimed, waiting = dict.fromkeys(nums), {}
+        owned.update(claimed)
+        groups = {}
+        for num in sorted(claimed):
+            groups.setdefault(engines[num], []).append((num, paragraphs[num]))
+        for engine, group in groups.items():
+            for batch in _batches(engine, group, batch_size):
+                pending.add(asyncio.create_task(_translate_group(request, engine, batch)))
+        if waiting:
+            logger.info("Waiting for %s paragraph(s) in flight of concurrent requests", len(waiting))
+            waiter = asyncio.create_task(inflight.wait(waiting))
+            waiters[waiter] = set(waiting)
+            pending.add(waiter)
+
+    try:
+        if translation_cache is not None:
+            with tracing.span("cache.get") as span:
+                cached = await translation_cache.get_many(keys)
+                if span is not None:
+                    span.set(hits=len(cached))
+            for num, key in enumerate(keys):
+                results[num] = cached.get(key)
+        missing = [num for num, result in enumerate(results) if result is None]
+        if not missing:
+            logger.info("All %s paragraph(s) answered from translation cache", len(paragraphs))
+        schedule(missing)
+        while True:
+            start = cursor
+            while cursor < len(results) and results[cursor] is not None:
+                cursor += 1
+            if cursor > start:
+                yield start, results[start:cursor]
+            if not pending:
+                break
+            left = deadline.remaining()
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED,
+                timeout=None if left is None else max(left - config.get("DEADLINE_GRACE", 0.5), 0))
+            if not done:
+                # Out of time, cancel the stragglers and answer their paragraphs untranslated.
+                logger.warning("Deadline reached | %s paragraph(s) still pending fall back to the original text",
+                               results.count(None))
+                for task in pending:
+                    task.cancel()
+                pending = set()
+                # Told to the handler, so the traffic recorder counts them as not translated.
+                request["untranslated"] = results.count(None)
+                for num, paragraph in enumerate(results):
+                    if paragraph is None:
+                        results[num] = paragraphs[num]
+                continue
+            translated = {}
+            # Translations of this request by cache key of the engine that answered them.
+            fresh = {}
+            abandoned = []
+            for task in done:
+                if task in waiters:
+                    result = task.result()
+                    # The request translating these went away or ran out of time, take them over.
+                    abandoned += sorted(waiters.pop(task) - result.keys())
+                    translated.update(result)
+                    continue
+                engine, group = task.result()
+                for num, paragraph in group:
+                    translated[num] = paragraph
+                    fresh[keys[num] if engine == engines[num]
+                          else cache_key(paragraphs[num], target_lang, engine)] = paragraph
+            for num, paragraph in translated.items():
+                results[num] = paragraph
+                if inflight is not None and num in owned:
+                    inflight.resolve(keys[num], owned[num], paragraph)
+            if abandoned:
+                logger.info("Taking over %s paragraph(s) abandoned by a concurrent request", len(abandoned))
+                schedule(abandoned)
+            if translation_cache is not None:
+                with tracing.span("cache.put"):
+                    await translation_cache.put_many(fresh)
+        logger.debug("Merged translated paragraph(s):↓↓↓\n%s", results)
+    finally:
+        for task in pending:
+            task.cancel()
+        if inflight is not None:
+            # Only flights still open, a resolved key may already be another request's flight.
+            for num, future in owned.items():
+                if not future.done():
+                    inflight.fail(keys[num], future, AbandonedFlightException(keys[num]))
+
+
+async def hybrid_response(request, content: str) -> bytes | None:
     """
     Take turns requesting using the pool.
     """
-    b_tag_list_result = None
-    no_b_tag_list_result = None
-    task_with_b = None
-    task_without_b = None
-    paragraphs = [p.strip() for p in PATTERN_SPLIT.split(content)]
-    if logger.isEnabledFor(logging.DEBUG):
-        logger.debug('Split | paragraphs:↓↓↓\n%s', paragraphs)
     try:
-        if b_tag_list := [(num, paragraph) for num, paragraph in enumerate(paragraphs) if _has_b_tag(paragraph)]:
-            logger.info("(NUM,PARA) | <b></b>_tags(2+) | origin paragraph(s):↓↓↓\n%s", b_tag_list)
-            task_with_b = asyncio.create_task(request.app["DeepLX"].ask([item[1] for item in b_tag_list]))
-        if no_b_tag_list := [(num, paragraph) for num, paragraph in enumerate(paragraphs) if not _has_b_tag(paragraph)]:
-            logger.info("(NUM,PARA) | origin paragraph(s):↓↓↓\n%s", no_b_tag_list)
-            task_without_b = asyncio.create_task(
-                request.app["chat_agent_pool"].ask([item[1] for item in no_b_tag_list]))
-        if b_tag_list:
-            b_tag_list_result = await task_with_b
-            b_tag_list = [(piece[0], b_tag_list_result[i]) for i, piece in enumerate(b_tag_list)]
-            logger.info("Translated (NUM,PARA) | b_tags  paragraph(s):↓↓↓\n%s", b_tag_list)
-        if no_b_tag_list:
-            no_b_tag_list_result = await task_without_b
-            no_b_tag_list = [(piece[0], no_b_tag_list_result[i]) for i, piece in enumerate(no_b_tag_list)]
-            logger.info("Translated (NUM,PARA) | paragraph(s):↓↓↓\n%s", no_b_tag_list)
-
-        if not b_tag_list:
-            paragraphs = no_b_tag_list_result
-        elif not no_b_tag_list:
-            paragraphs = b_tag_list_result
-        else:
-            # merge algorithm
-            paragraphs = []
-            i, j = 0, 0
-            while (i < len(b_tag_list)) and (j < len(no_b_tag_list)):
-                if b_tag_list[i][0] <= no_b_tag_list[j][0]:
-                    paragraphs.append(b_tag_list[i][1])
-                    i += 1
-                else:
-                    paragraphs.append(no_b_tag_list[j][1])
-                    j += 1
-            paragraphs += [paragraph for _, paragraph in b_tag_list[i:]]
-            paragraphs += [paragraph for _, paragraph in no_b_tag_list[j:]]
-        logger.debug("Merged translated paragraph(s):↓↓↓\n%s", paragraphs)
-        return response_normal_json(config.PATTERN_SPLIT.join(paragraphs))
+        paragraphs = []
+        async with aclosing(hybrid_translate(request, content)) as chunks:
+            async for _, chunk in chunks:
+                paragraphs += chunk
+        request["translated"] = len(paragraphs) - request.get("untranslated", 0)
+        with tracing.span("merge", paragraphs=len(paragraphs)):
+            return response_normal_json(config.PATTERN_SPLIT.join(paragraphs))
     except ChatWebReverseException as e:
         logger.error(e)
     except Exception as e:
@@ -15,4 +15,4 @@ class DebugInfoMsg(StrEnum):
     TRANSLATED_TEXT = "Translated text: Service: %s | Source: %s | Paragraphs:↓↓↓\n%s"
     REQUEST_TEXT = "To Translate text: Service: %s | Source: %s | Paragraphs:↓↓↓\n%s"
     PROMPT = "To Translate text: Service: %s | Source: %s | Prompt is:↓↓↓\n%s"
-    RETRY = "RETRY: Service: % | Source: %s Why: %s"
+    RETRY = "RETRY: Job: %s | Source: %s | Why: %s"
@@ -0,0 +1,118 @@
+import logging
+import math
+import re
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+# CJK, kana and hangul are roughly one token per character, other scripts about four characters per token.
+PATTERN_WIDE_CHAR = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+# Numbering and newline the prompt adds around each paragraph.
+PARAGRAPH_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    wide = len(PATTERN_WIDE_CHAR.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4) + PARAGRAPH_OVERHEAD_TOKENS
+
+
+def _bucket(size: int) -> int:
+    """
+    Batch sizes 1, 2-3, 4-7, 8-15 ... share their statistics.
+    """
+    return size.bit_length()
+
+
+class BatchPlanner:
+    """
+    Size LLM batches from estimated tokens and from how often build_result could
+    recover the paragraph count for batches of that size before.
+    """
+
+    def __init__(self,
+                 max_tokens: int = 1200,
+                 max_paragraphs: int = 32,
+                 target_success: float = 0.9,
+                 decay: float = 0.98,
+                 prior_success: float = 0.99,
+                 prior_weight: float = 4):
+        self.max_tokens = max_tokens
+        self.max_paragraphs = max_paragraphs
+        self.target_success = target_success
+        self.decay = decay
+        self.prior_success = prior_success
+        self.prior_weight = prior_weight
+        # engine -> bucket -> [decayed successes, decayed total]
+        self.stats: dict[str, dict[int, list[float]]] = {}
+
+    def record(self, engine: str, size: int, ok: bool):
+        """
+        Every outcome decays all buckets of the engine, so sizes that stopped being
+        chosen after failures drift back to the prior and get tried again.
+        """
+        stats = self.stats.setdefault(engine, {})
+        for stat in stats.values():
+            stat[0] *= self.decay
+            stat[1] *= self.decay
+        stat = stats.setdefault(_bucket(size), [0.0, 0.0])
+        stat[0] += ok
+        stat[1] += 1
+
+    def success_rate(self, engine: str, size: int) -> float:
+        """
+        Smoothed towards an optimistic prior, so sizes never tried are still explored.
+        """
+        successes, total = self.stats.get(engine, {}).get(_bucket(size), (0.0, 0.0))
+        return (successes + self.prior_success * self.prior_weight) / (total + self.prior_weight)
+
+    def max_batch_size(self, engine: str) -> int:
+        size = 1
+        while size * 2 <= self.max_paragraphs and self.success_rate(engine, size * 2) >= self.target_success:
+            size *= 2
+        # The whole bucket passed, its largest member is allowed too.
+        return min(size * 2 - 1, self.max_paragraphs)
+
+    def plan(self, engine: str, group: list[tuple[int, str]], max_paragraphs: int | None = None) \
+            -> list[list[tuple[int, str]]]:
+        """
+        Split (NUM,PARA) pairs into consecutive batches of balanced token counts.
+        """
+        if not group:
+            return []
+        limit = self.max_batch_size(engine)
+        if max_paragraphs:
+            limit = min(limit, max_paragraphs)
+        tokens = [estimate_tokens(paragraph) for _, paragraph in group]
+        count = max(math.ceil(sum(tokens) / self.max_tokens), math.ceil(len(group) / limit), 1)
+        target = sum(tokens) / count
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for item, token in zip(group, tokens):
+            if batch and (len(batch) >= limit or batch_tokens + token / 2 > target):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += token
+        batches.append(batch)
+        if len(batches) > 1:
+            logger.info("Planned %s | %s paragraph(s) into batches of %s", engine, len(group),
+                        [len(batch) for batch in batches])
+        return batches
+
+
+_planner: BatchPlanner | None = None
+
+
+def get_planner() -> BatchPlanner:
+    """
+    The process wide planner, configured on first use.
+    """
+    global _planner
+    if _planner is None:
+        _planner = BatchPlanner(max_tokens=config.get("BATCH_MAX_TOKENS", 1200),
+                                max_paragraphs=config.get("BATCH_MAX_PARAGRAPHS", 32),
+                                target_success=config.get("BATCH_TARGET_SUCCESS", 0.9))
+    return _planner
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from . import metrics
+from .base_exceptions import UnequalParagraphCountException
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """
+    Extra engine calls one request may spend on retries and splits.
+    """
+
+    def __init__(self, calls: int):
+        self.calls = calls
+        self.spent = 0
+
+    def take(self, calls: int = 1) -> bool:
+        if self.spent + calls > self.calls:
+            return False
+        self.spent += calls
+        return True
+
+
+async def bisect_ask(ask: Callable[[list[str], int], Awaitable[list[str] | None]],
+                     paragraphs: list[str],
+                     budget: RetryBudget,
+                     source: str = "",
+                     max_attempts: int = 2) -> list[str]:
+    """
+    Translate paragraphs with ask(paragraphs, attempt), where each call may land on another instance
+    and attempt counts the earlier answers of the same range that came back unequal (or None).
+    A range whose paragraph count comes back unequal (or None) is bisected and both halves run
+    concurrently, so halves that succeed are kept and only failing sub-ranges are split again,
+    down to single paragraphs, which are retried while the budget lasts.
+    If markers recovered part of a range, only its missing paragraphs are asked again.
+    Any other error retries the same range, up to max_attempts calls, within the budget.
+    """
+
+    async def solve(part: list[str], attempt: int = 0, errors: int = 0) -> list[str]:
+        try:
+            if (result := await ask(part, attempt)) is not None:
+                return result
+            error = None
+        except UnequalParagraphCountException as e:
+            error = e
+        except Exception as e:
+            if attempt + errors + 1 < max_attempts and budget.take():
+                logger.warning("Retry %s paragraph(s) | source: %s | Why: %s", len(part), source, e)
+                metrics.BISECT.inc(source, "retry")
+                # The answer was not the problem, attempt stays as it was.
+                return await solve(part, attempt, errors + 1)
+            raise
+        if error is not None and error.partial and any(error.partial) and budget.take():
+            # Markers aligned part of the answer, only re-ask the paragraphs that are missing.
+            missing = [i for i, paragraph in enumerate(error.partial) if paragraph is None]
+            logger.warning("Re-ask %s missing of %s paragraph(s) | source: %s", len(missing), len(part), source)
+            metrics.BISECT.inc(source, "reask")
+            result = list(error.partial)
+            for i, paragraph in zip(missing, await solve([part[i] for i in missing])):
+                result[i] = paragraph
+            return result
+        if len(part) == 1:
+            if budget.take():
+                metrics.BISECT.inc(source, "retry")
+                return await solve(part, attempt + 1, errors)
+            raise error or UnequalParagraphCountException(1, 0, source)
+        if not budget.take(2):
+            raise error or UnequalParagraphCountException(len(part), 0, source)
+        half = len(part) // 2
+        logger.warning("Split %s paragraph(s) into %s + %s | source: %s", len(part), half, len(part) - half, source)
+        metrics.BISECT.inc(source, "split")
+        tasks = [asyncio.create_task(solve(part[:half])), asyncio.create_task(solve(part[half:]))]
+        try:
+            left, right = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return left + right
+
+    return await solve(paragraphs)
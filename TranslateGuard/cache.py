@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .config import config, CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+PATTERN_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """
+    Collapse whitespace so that re-flowed copies of a paragraph share one cache entry.
+    """
+    return PATTERN_WHITESPACE.sub(' ', text).strip()
+
+
+def cache_key(text: str, target_lang: str, engine: str) -> str:
+    return hashlib.sha1(f"{engine}\x00{target_lang}\x00{normalize(text)}".encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    """
+    Two tiers paragraph cache: an in-memory LRU in front of a SQLite store.
+    Memory hits never leave the event loop, disk access runs in a worker thread.
+    """
+
+    def __init__(self,
+                 path: Path | None,
+                 memory_size: int = 4096,
+                 disk_size: int = 200000,
+                 ttl: float = 7 * 24 * 3600):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._db_lock = threading.Lock()
+        self._inserts = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS translation ("
+                            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS translation_created ON translation(created)")
+
+    def _memory_get(self, key: str, now: float) -> str | None:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        value, created = item
+        if now - created > self.ttl:
+            del self._memory[key]
+            self.stats["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: str, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_get_many(self, keys: list[str]) -> dict[str, tuple[str, float]]:
+        rows = []
+        with self._db_lock:
+            # Stay below SQLITE_MAX_VARIABLE_NUMBER of old sqlite builds.
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows += self.db.execute(
+                    f"SELECT key, value, created FROM translation WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+        return {key: (value, created) for key, value, created in rows}
+
+    def _disk_put_many(self, items: list[tuple[str, str, float]]):
+        with self._db_lock:
+            self.db.executemany("INSERT OR REPLACE INTO translation(key, value, created) VALUES (?, ?, ?)", items)
+            self._inserts += len(items)
+            if self._inserts >= max(self.disk_size // 100, 1):
+                self._inserts = 0
+                self.db.execute("DELETE FROM translation WHERE created < ?", (time.time() - self.ttl,))
+                self.db.execute("DELETE FROM translation WHERE key IN (SELECT key FROM translation "
+                                "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.disk_size,))
+
+    async def get_many(self, keys: list[str]) -> dict[str, str]:
+        """
+        Look up keys, memory first. Disk hits are promoted into memory.
+        """
+        now = time.time()
+        found = {}
+        missing = []
+        for key in keys:
+            if (value := self._memory_get(key, now)) is not None:
+                found[key] = value
+                self.stats["memory_hits"] += 1
+            else:
+                missing.append(key)
+        if missing and self.db is not None:
+            try:
+                rows = await asyncio.to_thread(self._disk_get_many, missing)
+            except sqlite3.Error as e:
+                logger.error("Translation cache read failed: %s", e)
+                rows = {}
+            for key, (value, created) in rows.items():
+                if now - created <= self.ttl:
+                    found[key] = value
+                    self._memory_put(key, value, created)
+                    self.stats["disk_hits"] += 1
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def put_many(self, items: dict[str, str]):
+        now = time.time()
+        for key, value in items.items():
+            self._memory_put(key, value, now)
+        if items and self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_put_many, [(k, v, now) for k, v in items.items()])
+            except sqlite3.Error as e:
+                logger.error("Translation cache write failed: %s", e)
+
+    def hot_keys(self) -> list[str]:
+        """
+        Keys held in memory, least recently used first.
+        """
+        return list(self._memory)
+
+    async def warm(self, keys: list[str]) -> int:
+        """
+        Load keys from disk into memory in their order, so the last one is the most recently used.
+        """
+        if not keys or self.db is None:
+            return 0
+        keys = keys[-self.memory_size:]
+        try:
+            rows = await asyncio.to_thread(self._disk_get_many, keys)
+        except sqlite3.Error as e:
+            logger.error("Translation cache warm up failed: %s", e)
+            return 0
+        now = time.time()
+        for key in keys:
+            if (row := rows.get(key)) is not None and now - row[1] <= self.ttl:
+                self._memory_put(key, row[0], row[1])
+        return len(self._memory)
+
+    def close(self):
+        if self.db is not None:
+            with self._db_lock:
+                self.db.close()
+            self.db = None
+
+
+def create_cache() -> TranslationCache | None:
+    if not config.get("CACHE_ENABLE", True):
+        return None
+    return TranslationCache(CONFIG_PATH / "translation_cache.sqlite3" if config.get("CACHE_PERSIST", True) else None,
+                            memory_size=config.get("CACHE_MEMORY_SIZE", 4096),
+                            disk_size=config.get("CACHE_DISK_SIZE", 200000),
+                            ttl=config.get("CACHE_TTL", 7 * 24 * 3600))
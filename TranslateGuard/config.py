@@ -1,9 +1,11 @@
 import json
 import logging.config
+import os
 from pathlib import Path
 
 ROOT_PATH: Path = Path(__file__).parent.parent
-CONFIG_PATH: Path = ROOT_PATH / ".TranslateGuard"
+# TRANSLATEGUARD_CONFIG_PATH points a process at another config dir, e.g. one of the benchmarks.
+CONFIG_PATH: Path = Path(os.environ.get("TRANSLATEGUARD_CONFIG_PATH") or ROOT_PATH / ".TranslateGuard")
 
 
 class LogJsonVerboseFilter(logging.Filter):
@@ -18,9 +20,22 @@ class LogJsonVerboseFilter(logging.Filter):
         return False
 
 
-with open(CONFIG_PATH / "logging_config.json") as json_file:
-    logging.config.dictConfig(json.load(json_file))
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+def setup_logging():
+    """
+    Configure logging from logging_config.json, called by the entry points instead of on import.
+    """
+    from .tracing import RequestIdFilter
+    with open(CONFIG_PATH / "logging_config.json") as json_file:
+        logging_config = json.load(json_file)
+    # Module loggers exist by now, dictConfig would disable them all by default.
+    logging_config.setdefault("disable_existing_loggers", False)
+    logging.config.dictConfig(logging_config)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    # Every record gets request_id, so formats may use %(request_id)s.
+    loggers = [logging.getLogger()] + [item for item in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(item, logging.Logger)]
+    for handler in {handler for item in loggers for handler in item.handlers}:
+        handler.addFilter(RequestIdFilter())
 
 
 def _get_user_agent_ua_local() -> dict | None:
@@ -39,8 +54,12 @@ def _get_user_agent_ua_local() -> dict | None:
 
 
 class Config:
+    """
+    Settings of config.json, read on first access rather than on import.
+    """
     __slots__ = (
         "config",
+        "config_file_path",
         "USER_AGENT_UA",
         "ACCOUNTS",
         "API_KEYS",
@@ -56,8 +75,20 @@ class Config:
     )
 
     def __init__(self, config_file_path):
-        self.config = self.load_config(config_file_path)
+        self.config_file_path = config_file_path
+
+    @property
+    def loaded(self) -> bool:
+        try:
+            object.__getattribute__(self, "config")
+            return True
+        except AttributeError:
+            return False
+
+    def _load(self) -> dict:
+        self.config = self.load_config(self.config_file_path)
         self.config["USER_AGENT_UA"] = _get_user_agent_ua_local()
+        return self.config
 
     @staticmethod
     def load_config(config_file_path):
@@ -65,10 +96,27 @@ class Config:
             return json.load(f)
 
     def __getattr__(self, name):
+        if name == "config":
+            return self._load()
         return self.config[name]
 
     def __getitem__(self, key):
         return self.config[key]
 
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+
+    def partition(self, worker: int, workers: int):
+        """
+        Keep the share of worker out of workers processes: every workers-th used account, starting at worker.
+        Api keys are split the same way if there are enough of them, shared by all workers otherwise.
+        """
+        accounts = [user for user in self.config.get("ACCOUNTS") or [] if user["USE"]]
+        api_keys = [api_key for api_key in self.config.get("API_KEYS") or [] if api_key["USE"]]
+        self.config["ACCOUNTS"] = accounts[worker::workers]
+        self.config["API_KEYS"] = api_keys[worker::workers] if len(api_keys) >= workers else api_keys
+        self.config["WORKER"] = worker
+        self.config["WORKERS"] = workers
+
 
 config = Config(CONFIG_PATH / 'config.json')
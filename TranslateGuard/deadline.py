@@ -0,0 +1,82 @@
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """
+    Point in time a whole /v1/chat/completions request has to be answered by.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+# Tasks copy the context they are created in, so every engine call of a request sees its deadline.
+current_deadline: ContextVar[Deadline | None] = ContextVar("current_deadline", default=None)
+
+
+def start(seconds: float) -> Deadline:
+    deadline = Deadline(seconds)
+    current_deadline.set(deadline)
+    return deadline
+
+
+def remaining() -> float | None:
+    """
+    Seconds left for the current request, None outside of a request.
+    """
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def timeout(default: float) -> float:
+    """
+    default, shortened to what is left of the current request.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    return max(min(default, left), 0.01)
+
+
+class LatencyWindow:
+    """
+    Latencies of the most recent successful calls of one engine.
+    """
+
+    def __init__(self, size: int = 256):
+        self.samples: deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+latency_windows: dict[str, LatencyWindow] = {}
+
+
+def engine_timeout(engine: str, default: float) -> float:
+    """
+    Timeout of one call to engine: a multiple of its observed p99 once enough calls were seen,
+    never above default, and shortened to the current request deadline.
+    """
+    window = latency_windows.get(engine)
+    if window is not None and len(window.samples) >= config.get("ADAPTIVE_TIMEOUT_MIN_SAMPLES", 20):
+        adaptive = window.percentile(0.99) * config.get("ADAPTIVE_TIMEOUT_FACTOR", 2)
+        default = min(max(adaptive, config.get("ADAPTIVE_TIMEOUT_FLOOR", 5)), default)
+    return timeout(default)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from .base_message_enum import Service
+from .config import config
+from .deadline import LatencyWindow, latency_windows
+from .utils import RetryTokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """
+    Send a slow batch a second time to another engine once it runs past a percentile of the
+    recent latencies of its own engine. The first valid answer wins, the other call is cancelled.
+    Hedges are paid from a token bucket, so they never add more than max_ratio extra calls.
+    """
+
+    def __init__(self,
+                 engine: str,
+                 target: str,
+                 percentile: float = 0.95,
+                 min_samples: int = 20,
+                 min_delay: float = 1,
+                 max_ratio: float = 0.1):
+        self.engine = engine
+        self.target = target
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies: LatencyWindow = latency_windows.setdefault(engine, LatencyWindow())
+        self.bucket = RetryTokenBucket(ratio=max_ratio, max_tokens=10)
+        self.stats = {"batches": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "skipped_budget": 0,
+                      "extra_paragraphs": 0, "saved_seconds": 0.0}
+
+    def threshold(self) -> float | None:
+        """
+        Seconds after which a batch is hedged, None until enough latencies were seen.
+        """
+        if len(self.latencies.samples) < self.min_samples:
+            return None
+        return max(self.latencies.percentile(self.percentile), self.min_delay)
+
+    def _expected_tail(self, delay: float) -> float:
+        """
+        Mean latency of the calls that took longer than delay, what a hedged primary would likely have taken.
+        """
+        tail = [latency for latency in self.latencies.samples if latency > delay]
+        return sum(tail) / len(tail) if tail else delay
+
+    async def ask(self,
+                  primary: Callable[[], Awaitable[list[str]]],
+                  hedge: Callable[[], Awaitable[list[str] | None]],
+                  length: int) -> tuple[str, list[str]]:
+        """
+        Await primary(), and hedge() too if primary is still running after threshold().
+        A hedge answer only counts if it has length paragraphs.
+        Returns the engine that answered, engine or target, with its answer.
+        """
+        self.stats["batches"] += 1
+        self.bucket.deposit()
+        start = time.monotonic()
+        first = asyncio.create_task(primary())
+        tasks = [first]
+        try:
+            if (delay := self.threshold()) is None:
+                return self.engine, await first
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return self.engine, first.result()
+            if not self.bucket.withdraw():
+                self.stats["skipped_budget"] += 1
+                return self.engine, await first
+            logger.warning("Hedge %s paragraph(s) | %s slower than %.2fs", length, self.engine, delay)
+            self.stats["hedged"] += 1
+            self.stats["extra_paragraphs"] += length
+            tasks.append(asyncio.create_task(hedge()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (task for task in tasks if task in done):
+                    if task.exception() is not None:
+                        logger.warning("Hedged %s call failed: %s", "primary" if task is first else "hedge",
+                                       task.exception())
+                        continue
+                    if (result := task.result()) is None or len(result) != length:
+                        continue
+                    if task is first:
+                        self.stats["primary_wins"] += 1
+                        return self.engine, result
+                    self.stats["hedge_wins"] += 1
+                    self.stats["saved_seconds"] += max(self._expected_tail(delay) - (time.monotonic() - start), 0)
+                    return self.target, result
+            # Nothing valid, surface the primary outcome as without hedging.
+            return self.engine, first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        # Extra engine calls per batch, against the tail seconds the winning hedges saved.
+        stats["extra_load"] = stats["hedged"] / stats["batches"] if stats["batches"] else 0.0
+        stats["threshold"] = self.threshold()
+        return stats
+
+
+def create_hedger() -> Hedger | None:
+    if not config.get("HEDGE_ENABLE", False):
+        return None
+    return Hedger(Service.ChatWebGpt,
+                  Service(config.get("HEDGE_ENGINE", Service.ChatWebGpt)),
+                  percentile=config.get("HEDGE_PERCENTILE", 0.95),
+                  min_samples=config.get("HEDGE_MIN_SAMPLES", 20),
+                  min_delay=config.get("HEDGE_MIN_DELAY", 1),
+                  max_ratio=config.get("HEDGE_MAX_RATIO", 0.1))
@@ -0,0 +1,174 @@
+import bisect
+import math
+from typing import Callable, Iterator
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A metric family in the Prometheus text format, one value per tuple of label values.
+    Updates are plain dict operations on the event loop, nothing is locked.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self.registry = registry if registry is not None else REGISTRY
+        self.registry.register(self)
+
+    def _labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in self.registry.const_labels.items()]
+        pairs += [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_total(self, value: float, *labels):
+        """
+        Mirror a total that is counted elsewhere, e.g. in a stats dict.
+        """
+        self._values[labels] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """
+    Observations counted into fixed buckets, rendered cumulative with _bucket, _sum and _count.
+    """
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 45, 60)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if buckets[-1] != math.inf else ())
+        # Per label values: count of each bucket (not cumulative), then sum.
+        self._rows: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels):
+        if (row := self._rows.get(labels)) is None:
+            row = self._rows[labels] = [0] * (len(self.buckets) + 1)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, row in self._rows.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{self._labels(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {_format_value(row[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+    def clear(self):
+        self._rows.clear()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        # Labels of every sample, e.g. the worker process, so series of workers never mix.
+        self.const_labels: dict[str, str] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self, collect: Callable[[], None] | None = None) -> bytes:
+        """
+        The text exposition of every metric, after collect copied in state kept elsewhere.
+        """
+        if collect is not None:
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+REGISTRY = Registry()
+
+# ---- serving ----
+HTTP_REQUESTS = Counter("translateguard_http_requests_total",
+                        "Translation requests served, by stream mode and status.", ("stream", "status"))
+HTTP_LATENCY = Histogram("translateguard_http_request_seconds",
+                         "Time to serve a translation request.", ("stream",))
+
+# ---- engines, instance is the account email, api key url or DeepLX url ----
+ENGINE_LATENCY = Histogram("translateguard_engine_request_seconds",
+                           "Latency of engine calls.", ("engine", "instance"))
+ENGINE_REQUESTS = Counter("translateguard_engine_requests_total",
+                          "Engine calls by outcome: ok, unequal (paragraph count), error, cancelled.",
+                          ("engine", "instance", "outcome"))
+ENGINE_INFLIGHT = Gauge("translateguard_engine_inflight", "Engine calls in flight.", ("engine", "instance"))
+ENGINE_READY = Gauge("translateguard_engine_ready_instances", "Instances able to take a call.", ("engine",))
+CIRCUIT_STATE = Gauge("translateguard_circuit_breaker_state",
+                      "Circuit breaker state: 0 closed, 1 half open, 2 open.", ("engine", "instance"))
+CIRCUIT_OPENED = Counter("translateguard_circuit_breaker_opened_total",
+                         "Times the circuit breaker opened.", ("engine", "instance"))
+BISECT = Counter("translateguard_bisect_total",
+                 "Extra engine calls of a batch: retry, reask (missing paragraphs) and split.", ("engine", "action"))
+
+# ---- ChatGPT accounts ----
+CHAT_QUEUE_WAIT = Histogram("translateguard_chat_queue_wait_seconds",
+                            "Wait for an idle conversation of the account.", ("account",),
+                            buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+CHAT_WEBSOCKET_DELAY = Histogram("translateguard_chat_websocket_delay_seconds",
+                                 "Delay of the websocket answer after the conversation post returned.",
+                                 ("account",))
+SELENIUM_REFRESHES = Counter("translateguard_selenium_refreshes_total",
+                             "Selenium logins refreshing cookies and access token, by outcome.",
+                             ("account", "outcome"))
+SELENIUM_REFRESH_LATENCY = Histogram("translateguard_selenium_refresh_seconds",
+                                     "Duration of selenium logins.", ("account",),
+                                     buckets=(5, 10, 20, 30, 45, 60, 90, 120, 180))
+
+# ---- translation cache ----
+CACHE_LOOKUPS = Counter("translateguard_cache_lookups_total",
+                        "Paragraph lookups of the translation cache: memory_hits, disk_hits, misses.", ("result",))
+CACHE_EVICTIONS = Counter("translateguard_cache_evictions_total", "Entries evicted from memory or expired.",
+                          ("reason",))
@@ -0,0 +1,127 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+_running = False
+
+
+async def _exclusive(coro):
+    """
+    Run one profile at a time, a second one would profile the first.
+    """
+    global _running
+    if _running:
+        coro.close()
+        raise ProfilerBusy()
+    _running = True
+    try:
+        return await coro
+    finally:
+        _running = False
+
+
+async def _cpu(seconds: float, sort: str, limit: int) -> str:
+    profiler = cProfile.Profile()
+    # Hooks the event loop thread, so every task of the process is profiled.
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+async def profile_cpu(seconds: float, sort: str = "cumulative", limit: int = 60) -> str:
+    """
+    Deterministic profile of the event loop for seconds, as pstats text.
+    """
+    return await _exclusive(_cpu(seconds, sort, limit))
+
+
+def _frame_name(frame) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def _sample(thread_id: int, seconds: float, interval: float) -> tuple[Counter, int]:
+    stacks = Counter()
+    samples = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+            samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+async def _sampled(seconds: float, interval: float) -> str:
+    stacks, samples = await asyncio.to_thread(_sample, threading.get_ident(), seconds, interval)
+    lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+    return f"# {samples} samples every {interval * 1000:.0f} ms of the event loop thread, collapsed stacks\n" + \
+        "\n".join(lines) + "\n"
+
+
+async def profile_sampling(seconds: float, interval: float = 0.005) -> str:
+    """
+    Statistical profile of the event loop thread for seconds, as collapsed stacks
+    ("root;...;leaf count" lines) for flamegraph.pl or speedscope. Costs the loop almost nothing.
+    """
+    return await _exclusive(_sampled(seconds, interval))
+
+
+class TracemallocSession:
+    """
+    Allocation tracing started on demand. Every report compares with the snapshot taken at start,
+    so what keeps growing between reports points at a leak.
+    """
+
+    def __init__(self):
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.started_at = 0.0
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def start(self, frames: int = 10) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.started_at = time.monotonic()
+            self.baseline = self._take()
+        return "tracemalloc started, ask again for the growth since then\n"
+
+    def report(self, limit: int = 25, key_type: str = "lineno") -> str:
+        snapshot = self._take()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"# traced {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB, "
+                 f"growth over {time.monotonic() - self.started_at:.0f}s by {key_type}"]
+        lines += [str(stat) for stat in snapshot.compare_to(self.baseline, key_type)[:limit]]
+        return "\n".join(lines) + "\n"
+
+    def stop(self) -> str:
+        tracemalloc.stop()
+        self.baseline = None
+        return "tracemalloc stopped\n"
@@ -0,0 +1,156 @@
+import functools
+import gzip
+import logging
+import random
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from .config import config, CONFIG_PATH
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    """
+    Append served requests as JSON lines: arrival time, request id, stream mode, status, seconds,
+    seconds to the first stream chunk, paragraph count of the request and of the answer, and the request body.
+    The file rotates at max_bytes, rotated files are gzipped if compress and only the newest backups are kept.
+    Lines are buffered, a killed process loses its last few.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 64 * 2 ** 20, backups: int = 10, compress: bool = True,
+                 sample: float = 1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.sample = sample
+        self.pattern_split = re.compile(config.PATTERN_SPLIT)
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._compressing: set[threading.Thread] = set()
+        self.recorded = 0
+
+    def record(self, arrived: float, request_id: str | None, body: dict, stream: bool, status: int,
+               seconds: float, first_byte: float | None, translated: int | None):
+        """
+        translated is the count of paragraphs answered translated, None if nothing was answered.
+        """
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+        paragraphs = len(self.pattern_split.split(body["messages"][1]["content"]))
+        line = dumps({"ts": round(arrived, 3), "id": request_id, "stream": stream, "status": status,
+                      "seconds": round(seconds, 4),
+                      "first_byte": None if first_byte is None else round(first_byte, 4),
+                      "paragraphs": paragraphs, "translated": translated or 0,
+                      "body": body}) + b"\n"
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._open()
+                elif self._size + len(line) > self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._size += len(line)
+            self.recorded += 1
+        except OSError as e:
+            logger.error("Recording request %s to %s failed: %s", request_id, self.path, e)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        # Named by time and a sequence of the second, so names sort oldest first.
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        n = 0
+        while True:
+            rotated = self.path.with_name(f"{self.path.stem}-{stamp}-{n:02d}{self.path.suffix}")
+            if not rotated.exists() and not rotated.with_name(rotated.name + ".gz").exists():
+                break
+            n += 1
+        self.path.rename(rotated)
+        self._open()
+        if self.compress:
+            # Compressing 64 MiB takes a second, not on the event loop.
+            thread = threading.Thread(target=self._compress, args=(rotated,), name="recorder-gzip", daemon=True)
+            self._compressing.add(thread)
+            thread.start()
+        else:
+            self._prune()
+
+    def _compress(self, path: Path):
+        try:
+            with open(path, 'rb') as src, gzip.open(path.with_name(path.name + ".gz"), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            path.unlink()
+            self._prune()
+        except OSError as e:
+            logger.error("Compressing %s failed: %s", path, e)
+        finally:
+            self._compressing.discard(threading.current_thread())
+
+    def rotated(self) -> list[Path]:
+        """
+        Rotated files, oldest first.
+        """
+        return sorted(path for path in self.path.parent.glob(f"{self.path.stem}-*{self.path.suffix}*")
+                      if path.name.endswith((self.path.suffix, self.path.suffix + ".gz")))
+
+    def _prune(self):
+        for path in self.rotated()[:-self.backups or None]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        for thread in list(self._compressing):
+            thread.join()
+
+
+def read_records(*paths: Path) -> list[dict]:
+    """
+    Records of recorder files, gzipped or not, in arrival order.
+    """
+    records = []
+    for path in paths:
+        with (gzip.open(path, 'rb') if path.suffix == ".gz" else open(path, 'rb')) as f:
+            for line in f:
+                if line.strip():
+                    records.append(loads(line))
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+@functools.cache
+def get_recorder() -> TrafficRecorder | None:
+    """
+    The recorder of RECORD_PATH (relative to the config dir), None if not configured.
+    Worker processes write a file each.
+    """
+    if not (path := config.get("RECORD_PATH")):
+        return None
+    path = CONFIG_PATH / path
+    if config.get("WORKERS", 1) > 1:
+        path = path.with_name(f"{path.stem}-{config.WORKER}{path.suffix}")
+    logger.warning("Recording served requests, bodies included, to %s", path)
+    return TrafficRecorder(path, max_bytes=config.get("RECORD_MAX_BYTES", 64 * 2 ** 20),
+                           backups=config.get("RECORD_BACKUPS", 10), compress=config.get("RECORD_GZIP", True),
+                           sample=config.get("RECORD_SAMPLE", 1.0))
+
+
+def close_recorder():
+    if (recorder := get_recorder()) is not None:
+        recorder.close()
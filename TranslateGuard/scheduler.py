@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Generic, TypeVar
+
+from .base_exceptions import UnequalParagraphCountException
+from .config import config
+from .deadline import LatencyWindow, latency_windows
+from . import metrics, tracing
+from .utils import CircuitBreaker, CircuitState
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CIRCUIT_STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class InstanceStats:
+    __slots__ = ("label", "capacity", "latency", "error_rate", "inflight", "consecutive_errors", "cooldown_until",
+                 "picks", "successes", "errors")
+
+    def __init__(self, label: str, capacity: int):
+        self.label = label
+        self.capacity = capacity
+        self.latency: float | None = None  # EWMA seconds
+        self.error_rate = 0.0  # EWMA of failures
+        self.inflight = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+        self.picks = 0
+        self.successes = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class Scheduler(Generic[T]):
+    """
+    Pick the instance with the lowest expected completion time, from its EWMA latency,
+    requests in flight, recent error rate and cooldown after failures.
+    Instances whose circuit breaker is open get no traffic.
+    """
+
+    def __init__(self,
+                 name: str,
+                 instances: list[T],
+                 label: Callable[[T], str] = str,
+                 capacity: Callable[[T], int] = lambda instance: 1,
+                 alpha: float = 0.3,
+                 cooldown: float = 5,
+                 max_cooldown: float = 60,
+                 healthy_exceptions: tuple = (UnequalParagraphCountException,)):
+        self.name = name
+        self.instances = instances
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.healthy_exceptions = healthy_exceptions
+        self.stats = {id(instance): InstanceStats(label(instance), capacity(instance)) for instance in instances}
+        self.breakers = {id(instance): CircuitBreaker(config.get("CIRCUIT_FAILURE_THRESHOLD", 3),
+                                                      config.get("CIRCUIT_RESET_TIMEOUT", 30))
+                         for instance in instances}
+        # Extra predicates an instance has to pass, e.g. readiness.
+        self.filters: list[Callable[[T], bool]] = []
+        self.last: T | None = instances[0] if instances else None
+        # Pool wide latencies, for adaptive timeouts.
+        self.latencies = latency_windows.setdefault(name, LatencyWindow())
+        self.counters = {"picks": 0, "skipped_cooldown": 0, "skipped_filtered": 0, "skipped_circuit_open": 0,
+                         "fallback_all_unavailable": 0}
+
+    def _expected_time(self, stats: InstanceStats, default_latency: float) -> float:
+        latency = stats.latency if stats.latency is not None else default_latency
+        return (stats.inflight / stats.capacity + 1) * latency * (1 + 4 * stats.error_rate)
+
+    def _unusable(self, instance: T, now: float) -> str | None:
+        """
+        Why instance can't take a call now, None if it can.
+        """
+        if not all(f(instance) for f in self.filters):
+            return "skipped_filtered"
+        if not self.breakers[id(instance)].available:
+            return "skipped_circuit_open"
+        if self.stats[id(instance)].cooldown_until > now:
+            return "skipped_cooldown"
+        return None
+
+    def pick(self) -> T:
+        now = time.monotonic()
+        known = [stats.latency for stats in self.stats.values() if stats.latency is not None]
+        # Never measured instances look average, so they get explored.
+        default_latency = sum(known) / len(known) if known else 1.0
+        candidates = []
+        for instance in self.instances:
+            if (reason := self._unusable(instance, now)) is not None:
+                self.counters[reason] += 1
+                continue
+            candidates.append(instance)
+        if not candidates:
+            # Everything is cooling down or open, the least bad one is still better than failing outright.
+            self.counters["fallback_all_unavailable"] += 1
+            candidates = sorted(self.instances, key=lambda i: self.stats[id(i)].cooldown_until)[:1]
+        instance = min(candidates, key=lambda i: (self._expected_time(self.stats[id(i)], default_latency),
+                                                  self.stats[id(i)].picks))
+        self.stats[id(instance)].picks += 1
+        self.breakers[id(instance)].on_call()
+        self.counters["picks"] += 1
+        self.last = instance
+        return instance
+
+    def record(self, instance: T, latency: float | None, ok: bool):
+        stats = self.stats[id(instance)]
+        if latency is not None:
+            stats.latency = latency if stats.latency is None else \
+                self.alpha * latency + (1 - self.alpha) * stats.latency
+            self.latencies.add(latency)
+        stats.error_rate = (1 - self.alpha) * stats.error_rate + self.alpha * (not ok)
+        if ok:
+            stats.successes += 1
+            stats.consecutive_errors = 0
+            self.breakers[id(instance)].record_success()
+        else:
+            stats.errors += 1
+            self.breakers[id(instance)].record_failure()
+            stats.consecutive_errors += 1
+            stats.cooldown_until = time.monotonic() + min(self.cooldown * 2 ** (stats.consecutive_errors - 1),
+                                                          self.max_cooldown)
+            logger.warning("%s | %s cooling down after %s error(s)", self.name, stats.label,
+                           stats.consecutive_errors)
+
+    @contextmanager
+    def track(self, instance: T):
+        """
+        Count the call in flight on instance and record its latency and outcome.
+        """
+        stats = self.stats[id(instance)]
+        stats.inflight += 1
+        start = time.monotonic()
+        outcome = "error"
+        with tracing.span(f"{self.name}.call", instance=stats.label) as span:
+            try:
+                yield
+            except self.healthy_exceptions:
+                # The instance answered, the answer was just unusable.
+                outcome = "unequal"
+                self.record(instance, time.monotonic() - start, True)
+                raise
+            except asyncio.CancelledError:
+                # A cancelled half-open probe proved nothing, let the next call probe.
+                outcome = "cancelled"
+                self.breakers[id(instance)].probing = False
+                raise
+            except Exception:
+                self.record(instance, None, False)
+                raise
+            else:
+                outcome = "ok"
+                self.record(instance, time.monotonic() - start, True)
+            finally:
+                stats.inflight -= 1
+                metrics.ENGINE_REQUESTS.inc(self.name, stats.label, outcome)
+                metrics.ENGINE_LATENCY.observe(time.monotonic() - start, self.name, stats.label)
+                if span is not None:
+                    span.set(outcome=outcome)
+
+    def capacity(self) -> dict:
+        """
+        Instances and concurrent calls the pool can take right now.
+        """
+        now = time.monotonic()
+        usable = [instance for instance in self.instances if self._unusable(instance, now) is None]
+        return {"instances": len(self.instances),
+                "ready": len(usable),
+                "capacity": sum(self.stats[id(instance)].capacity for instance in usable),
+                "inflight": sum(stats.inflight for stats in self.stats.values())}
+
+    def collect_metrics(self):
+        """
+        Copy in flight calls and circuit breaker states into their gauges.
+        """
+        now = time.monotonic()
+        metrics.ENGINE_READY.set(sum(self._unusable(instance, now) is None for instance in self.instances), self.name)
+        for key, stats in self.stats.items():
+            breaker = self.breakers[key]
+            metrics.ENGINE_INFLIGHT.set(stats.inflight, self.name, stats.label)
+            metrics.CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[breaker.state], self.name, stats.label)
+            metrics.CIRCUIT_OPENED.set_total(breaker.opened, self.name, stats.label)
+
+    def snapshot(self) -> dict:
+        return {"counters": dict(self.counters),
+                "instances": [dict(stats.as_dict(), circuit=str(self.breakers[key].state))
+                              for key, stats in self.stats.items()]}
@@ -0,0 +1,64 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional, pip install orjson
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+else:
+    # json.dumps with arguments builds a new encoder every call.
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def loads(data: bytes | str):
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+class JsonTemplate:
+    """
+    A JSON document serialized once, with fields filled in per call.
+    Every field is a string value "@@name@@" of the template, rendered with the JSON of its value.
+    """
+
+    def __init__(self, template: dict, fields: tuple[str, ...]):
+        self.fields = fields
+        data = dumps(template)
+        self.parts: list[bytes] = []
+        self.order: list[str] = []
+        while True:
+            found = [(data.find(b'"@@%s@@"' % field.encode()), field) for field in fields]
+            found = [(index, field) for index, field in found if index >= 0]
+            if not found:
+                break
+            index, field = min(found)
+            self.parts.append(data[:index])
+            self.order.append(field)
+            data = data[index + len(field) + 6:]
+        self.parts.append(data)
+        if missing := set(fields) - set(self.order):
+            raise ValueError(f"Template has no field {missing}")
+
+    def render(self, **values) -> bytes:
+        chunks = [self.parts[0]]
+        for field, part in zip(self.order, self.parts[1:]):
+            chunks.append(dumps(values[field]))
+            chunks.append(part)
+        return b"".join(chunks)
@@ -1,75 +1,434 @@
+import argparse
 import asyncio
+import hmac
 import json
 import logging
+import math
+import multiprocessing
+import signal
 import ssl
+import time
+import tracemalloc
+from contextlib import aclosing
 
 import aiohttp
 import certifi
 from aiohttp import web, TCPConnector, ClientTimeout
 
-from .ChatWebReverse.chat_reverse import ChatAgentPool
-from .DeepLX.DeeplX import DeepLXPool
-from .base_formatter import hybrid_response
-from .config import config
+from . import deadline, metrics, profiling, tracing
+from .ChatWebReverse.credential_store import get_credential_store
+from .base_message_enum import Service
+from .base_exceptions import GeneralException
+from .base_formatter import _llm_engine, hybrid_response, hybrid_translate, completion_id, response_stream_chunk
+from .cache import create_cache
+from .hedging import create_hedger
+from .recorder import get_recorder, close_recorder
+from .serialization import dumps, loads
+from .singleflight import SingleFlight
+from .snapshot import restore_snapshot, save_snapshot
+from .config import config, setup_logging
 
 logger = logging.getLogger(__name__)
 
 
+def request_deadline(request) -> float:
+    """
+    Seconds of X-Request-Timeout, at most REQUEST_DEADLINE, which also replaces invalid, non-finite
+    or non-positive values.
+    """
+    limit = config.get("REQUEST_DEADLINE", 60)
+    try:
+        seconds = float(request.headers.get("X-Request-Timeout", limit))
+    except ValueError:
+        return limit
+    if not math.isfinite(seconds) or seconds <= 0:
+        return limit
+    return min(seconds, limit)
+
+
 async def handle(request):
-    json_data = await request.json()
-    if logger.isEnabledFor(logging.DEBUG):
-        logger.debug("immersive_translate post data:↓↓↓\n%s",
-                     json.dumps(json_data, indent=4))
-    content = json_data["messages"][1]["content"]
-    logger.debug("immersive_translate json->messages->content:\n%s", content)
-    text = await hybrid_response(request, content)
-    if text:
-        return web.json_response(text=text)
-    else:
-        return web.Response(status=500, text='内部服务器错误')
+    deadline.start(request_deadline(request))
+    with tracing.request(request.headers.get("X-Request-Id")) as root:
+        request["request_id"] = tracing.current_request_id.get()
+        # The body is parsed whole on purpose: content is nearly all of it, so extracting it alone
+        # saves little (about 3 us for 4 KB with orjson), and stream and the recorder need the rest.
+        json_data = loads(await request.read())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("immersive_translate post data:↓↓↓\n%s",
+                         json.dumps(json_data, indent=4))
+        content = json_data["messages"][1]["content"]
+        logger.debug("immersive_translate json->messages->content:\n%s", content)
+        stream = bool(json_data.get("stream"))
+        if root is not None:
+            root.set(stream=stream)
+        start = time.monotonic()
+        status = 500
+        try:
+            if stream:
+                response = await stream_handle(request, content)
+            elif body := await hybrid_response(request, content):
+                response = web.Response(body=body, content_type="application/json")
+            else:
+                response = web.Response(status=500, text='内部服务器错误')
+            status = response.status
+            return response
+        except asyncio.CancelledError:
+            # Client closed the connection.
+            status = 499
+            raise
+        finally:
+            metrics.HTTP_REQUESTS.inc(str(stream).lower(), status)
+            seconds = time.monotonic() - start
+            metrics.HTTP_LATENCY.observe(seconds, str(stream).lower())
+            if root is not None:
+                root.set(status=status)
+            if (recorder := get_recorder()) is not None:
+                first_byte = request.get("first_byte")
+                recorder.record(time.time() - seconds, request["request_id"], json_data, stream, status, seconds,
+                                None if first_byte is None else first_byte - start, request.get("translated"))
+
+
+async def add_request_id(request, response):
+    if (request_id := request.get("request_id")) is not None:
+        response.headers["X-Request-Id"] = request_id
+
+
+async def stream_handle(request, content: str):
+    """
+    Send translated paragraphs as chat.completion.chunk events once they are ready, in original order.
+    """
+    response = None
+    chunk_id = completion_id()
+    try:
+        async with aclosing(hybrid_translate(request, content, config.get("STREAM_BATCH_SIZE", 8))) as chunks:
+            async for start, paragraphs in chunks:
+                if response is None:
+                    response = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                                           "Cache-Control": "no-cache"})
+                    await response.prepare(request)
+                    request["first_byte"] = time.monotonic()
+                text = config.PATTERN_SPLIT.join(paragraphs)
+                if start:
+                    text = config.PATTERN_SPLIT + text
+                await response.write(response_stream_chunk(chunk_id, text))
+                request["translated"] = start + len(paragraphs) - request.get("untranslated", 0)
+    except (ConnectionResetError, asyncio.CancelledError):
+        logger.info("Client went away while streaming %s", chunk_id)
+        raise
+    except Exception as e:
+        logger.error(e)
+        if response is None:
+            return web.Response(status=500, text='内部服务器错误')
+        await response.write(b"data: " + dumps({'error': {'message': str(e)}}) + b"\n\n")
+        await response.write_eof()
+        return response
+    if response is None:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+    await response.write(response_stream_chunk(chunk_id, None, "stop"))
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+async def warm_up_agent(app, email: str, instance, restored: bool):
+    """
+    Register the websocket of one account, at most WARM_UP_TIMEOUT seconds, then start listening on it.
+    The account joins the pool once its websocket is connected.
+    """
+    # A restored wss_url that went stale is registered again by wss_client_background.
+    if not restored or not instance.wss_url:
+        try:
+            await asyncio.wait_for(instance.register_websocket(), config.get("WARM_UP_TIMEOUT", 20))
+        except asyncio.TimeoutError:
+            logger.warning("Warm up of %s timed out, it keeps registering in the background", email)
+    app['websocket_background_tasks'][email] = asyncio.create_task(instance.wss_client_background())
+
+
+async def warm_up_agents(app):
+    """
+    Restore or register the websockets of all accounts concurrently.
+    """
+    restored = await restore_snapshot(app) if config.get("SNAPSHOT_ENABLE", True) else []
+    await asyncio.gather(*[warm_up_agent(app, email, instance, email in restored)
+                           for email, instance in app['chat_agent_pool'].instances.items()])
+
+
+def engine_capacity(app) -> dict:
+    return {str(app[name].scheduler.name): app[name].scheduler.capacity()
+            for name in ('chat_agent_pool', 'DeepLX', 'GptTurbo') if name in app}
+
+
+async def health(request):
+    """
+    Liveness, with the capacity of every engine.
+    """
+    return web.json_response({"status": "ok", "worker": config.get("WORKER", 0),
+                              "engines": engine_capacity(request.app)})
+
+
+async def ready(request):
+    """
+    200 as soon as the engine plain paragraphs go to can take traffic, 503 before.
+    DeepLX alone does not count, it only translates tagged paragraphs.
+    """
+    engines = engine_capacity(request.app)
+    try:
+        engine = _llm_engine(request.app)
+    except GeneralException:
+        engine = None
+    is_ready = engine is not None and engines.get(str(engine), {}).get("ready", 0) > 0
+    return web.json_response({"ready": is_ready, "engine": engine, "engines": engines},
+                             status=200 if is_ready else 503)
+
+
+def collect_metrics(app):
+    """
+    Copy state the engines and the cache keep themselves into /metrics.
+    """
+    for name in ('chat_agent_pool', 'DeepLX', 'GptTurbo'):
+        if name in app:
+            app[name].scheduler.collect_metrics()
+    if (cache := app.get('translation_cache')) is not None:
+        for result in ("memory_hits", "disk_hits", "misses"):
+            metrics.CACHE_LOOKUPS.set_total(cache.stats[result], result)
+        for reason in ("evictions", "expired"):
+            metrics.CACHE_EVICTIONS.set_total(cache.stats[reason], reason)
+
+
+async def metrics_handler(request):
+    """
+    Prometheus text format.
+    """
+    return web.Response(body=metrics.REGISTRY.render(lambda: collect_metrics(request.app)),
+                        headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+def _admin_allowed(request) -> bool:
+    """
+    The X-Admin-Token header has to match ADMIN_TOKEN. Without the token the admin routes are not served,
+    behind a reverse proxy on the same host every client would look like loopback.
+    """
+    token = config.get("ADMIN_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+def _seconds(request) -> float:
+    return min(max(float(request.query.get("seconds", 10)), 0.1), config.get("ADMIN_PROFILE_MAX_SECONDS", 300))
+
+
+async def admin_profile(request):
+    """
+    Profile the live process, /admin/profile?seconds=10&mode=cprofile|sampling&sort=cumulative
+    """
+    if not _admin_allowed(request):
+        return web.Response(status=403)
+    try:
+        seconds = _seconds(request)
+        if request.query.get("mode", "cprofile") == "sampling":
+            text = await profiling.profile_sampling(seconds, float(request.query.get("interval", 0.005)))
+        else:
+            text = await profiling.profile_cpu(seconds, request.query.get("sort", "cumulative"),
+                                               int(request.query.get("limit", 60)))
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+    except profiling.ProfilerBusy:
+        return web.Response(status=409, text="A profile is already running\n")
+    return web.Response(text=text)
+
+
+async def admin_tracemalloc(request):
+    """
+    /admin/tracemalloc starts tracing, later calls show the growth since, ?stop=1 stops it.
+    """
+    if not _admin_allowed(request):
+        return web.Response(status=403)
+    session = request.app['tracemalloc']
+    if request.query.get("stop"):
+        return web.Response(text=session.stop())
+    try:
+        if session.baseline is None or not tracemalloc.is_tracing():
+            text = await asyncio.to_thread(session.start, int(request.query.get("frames", 10)))
+        else:
+            text = await asyncio.to_thread(session.report, int(request.query.get("limit", 25)),
+                                           request.query.get("key", "lineno"))
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+    return web.Response(text=text)
+
 
 async def start_background_tasks(app):
-    for instance in app['chat_agent_pool'].instances.values():
-        await instance.register_websocket()
-    app['websocket_background_tasks'] = {
-        user["EMAIL"]: asyncio.create_task(app['chat_agent_pool'].instances[user["EMAIL"]].wss_client_background())
-        for user in config.ACCOUNTS if user["USE"]}
+    app['websocket_background_tasks'] = {}
+    app['warm_up_task'] = None
+    app['browser_warm_up'] = None
+    if 'chat_agent_pool' not in app:
+        return
+    if config.get("WARM_UP_IN_BACKGROUND", False):
+        # Serve right away, accounts take traffic once their websocket is connected.
+        app['warm_up_task'] = asyncio.create_task(warm_up_agents(app))
+    else:
+        await warm_up_agents(app)
+    if app['chat_agent_pool'].browser_pool is not None:
+        # Chrome starts in the worker processes while the server already serves.
+        app['browser_warm_up'] = asyncio.create_task(app['chat_agent_pool'].browser_pool.warm_up())
+    app['auth_refresher_task'] = asyncio.create_task(app['chat_agent_pool'].auth_refresher.run()) \
+        if app['chat_agent_pool'].auth_refresher is not None else None
+    app['credential_checkpoint_task'] = asyncio.create_task(get_credential_store().checkpoint_background(
+        app['chat_agent_pool'].instance_list, config.get("CREDENTIAL_CHECKPOINT_INTERVAL", 300)))
+    app['requirements_background_tasks'] = [asyncio.create_task(agent.requirements_background())
+                                            for agent in app['chat_agent_pool'].instance_list
+                                            if agent.requirements is not None]
 
 
 async def cleanup_background_tasks(app):
     logger.debug('start cleanup in background tasks')
-    await app['chat_agent_pool'].close()
-    for wss_client in app['websocket_background_tasks'].values():
-        wss_client.cancel()
-        await wss_client
+    for name in ('chat_agent_pool', 'DeepLX', 'GptTurbo'):
+        if name in app:
+            logger.info("Scheduler %s: %s", name, app[name].scheduler.snapshot())
+    if 'chat_agent_pool' in app:
+        if app['warm_up_task'] is not None:
+            app['warm_up_task'].cancel()
+            await asyncio.gather(app['warm_up_task'], return_exceptions=True)
+        if app['browser_warm_up'] is not None:
+            app['browser_warm_up'].cancel()
+            await asyncio.gather(app['browser_warm_up'], return_exceptions=True)
+        await app['chat_agent_pool'].close()
+        if config.get("SNAPSHOT_ENABLE", True):
+            await save_snapshot(app)
+        for wss_client in app['websocket_background_tasks'].values():
+            wss_client.cancel()
+            await wss_client
+        if app['auth_refresher_task'] is not None:
+            app['auth_refresher_task'].cancel()
+            await app['auth_refresher_task']
+        for prefetch in app['requirements_background_tasks']:
+            prefetch.cancel()
+            await prefetch
+        app['credential_checkpoint_task'].cancel()
+        await app['credential_checkpoint_task']
+        await get_credential_store().close()
     for session in app['client_sessions'].values():
         await session.close()
         await asyncio.sleep(0)
+    await app['openai_session'].close()
+    if app['hedger'] is not None:
+        logger.info("Hedging %s -> %s: %s", app['hedger'].engine, app['hedger'].target, app['hedger'].snapshot())
+    if app['translation_cache'] is not None:
+        logger.info("Translation cache stats: %s", app['translation_cache'].stats)
+        app['translation_cache'].close()
+    tracing.close_exporter()
+    close_recorder()
 
 
 async def init_app():
     timeout = ClientTimeout(total=40, connect=15, sock_read=30)
     app = web.Application()
+    # Every worker process keeps its own metrics, a scrape reaches one of them.
+    metrics.REGISTRY.const_labels["worker"] = str(config.get("WORKER", 0))
+    emails = [user["EMAIL"] for user in config.ACCOUNTS if user["USE"]]
     app['client_sessions'] = {
-        user["EMAIL"]: aiohttp.ClientSession(
+        email: aiohttp.ClientSession(
             connector=TCPConnector(ssl=ssl.create_default_context(cafile=certifi.where())),
             raise_for_status=True,
             timeout=timeout)
-        for user in config.ACCOUNTS if user["USE"]
+        for email in emails
     }
-    app['chat_agent_pool']: ChatAgentPool = ChatAgentPool(app)
-    app['DeepLX'] = DeepLXPool(app)
-    app.add_routes([web.post('/v1/chat/completions', handle)])
+    # One pooled session shared by all api keys, so requests across keys run concurrently.
+    app['openai_session'] = aiohttp.ClientSession(
+        connector=TCPConnector(ssl=ssl.create_default_context(cafile=certifi.where()),
+                               limit=config.get("GPT_TURBO_CONNECTIONS", 100)),
+        timeout=timeout)
+    # Engines are only imported when enabled.
+    if emails:
+        from .ChatWebReverse.chat_reverse import ChatAgentPool
+        await get_credential_store().load(emails)
+        app['chat_agent_pool'] = ChatAgentPool(app)
+    if config.get("DEEPLX_ENABLE", True):
+        from .DeepLX.DeeplX import DeepLXPool
+        app['DeepLX'] = DeepLXPool(app)
+    if any(api_key["USE"] for api_key in config.get("API_KEYS", [])):
+        from .GptTurbo.gpt_turbo_route import OpenaiRoutePool
+        app['GptTurbo'] = OpenaiRoutePool(app)
+    app['translation_cache'] = create_cache()
+    app['inflight'] = SingleFlight()
+    # Optional, a second engine takes over ChatGPT batches stuck in the latency tail.
+    app['hedger'] = create_hedger()
+    app.add_routes([web.post('/v1/chat/completions', handle),
+                    web.get('/health', health),
+                    web.get('/ready', ready),
+                    web.get('/metrics', metrics_handler)])
+    if config.get("ADMIN_TOKEN"):
+        app.add_routes([web.get('/admin/profile', admin_profile),
+                        web.get('/admin/tracemalloc', admin_tracemalloc)])
+        app['tracemalloc'] = profiling.TracemallocSession()
+    app.on_response_prepare.append(add_request_id)
     app.on_startup.append(start_background_tasks)
     app.on_cleanup.append(cleanup_background_tasks)
     return app
 
 
-def run():
-    app = init_app()
+def use_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("UVLOOP is enabled but uvloop is not installed, using the asyncio event loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def serve(host: str, port: int, worker: int = 0, workers: int = 1):
+    """
+    Run one server process. With workers > 1 it owns its partition of the accounts and api keys,
+    and shares the port with the other workers by SO_REUSEPORT.
+    """
+    setup_logging()
+    if workers > 1:
+        has_accounts = any(user["USE"] for user in config.get("ACCOUNTS") or [])
+        config.partition(worker, workers)
+        if has_accounts and not config.ACCOUNTS:
+            logger.warning("Worker %s of %s got no account, it serves with %s only", worker, workers, Service.GptTurbo)
+    if config.get("UVLOOP", False):
+        use_uvloop()
     try:
-        web.run_app(app, host='127.0.0.1', port=5050)
+        web.run_app(init_app(), host=host, port=port, reuse_port=workers > 1 or None,
+                    print=print if worker == 0 else None)
     except KeyboardInterrupt:
         logger.info(f"\nServer will shut down...")
     except Exception as e:
         logger.exception(e)
+
+
+def run(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m TranslateGuard")
+    parser.add_argument("--host", default=None, help="defaults to HOST of config.json, else 127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="defaults to PORT of config.json, else 5050")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="server processes sharing the port, defaults to WORKERS of config.json, else 1")
+    args = parser.parse_args(argv)
+    setup_logging()
+    host = args.host or config.get("HOST", "127.0.0.1")
+    port = args.port or config.get("PORT", 5050)
+    workers = args.workers or config.get("WORKERS", 1)
+    accounts = sum(1 for user in config.get("ACCOUNTS") or [] if user["USE"])
+    if workers > 1 and 0 < accounts < workers and not any(api_key["USE"] for api_key in config.get("API_KEYS") or []):
+        # Without api keys, a worker without an account could not translate anything but tagged paragraphs.
+        logger.warning("%s account(s) and no api key, starting %s worker(s) instead of %s", accounts, accounts, workers)
+        workers = accounts
+    if workers <= 1:
+        serve(host, port)
+        return
+    # Spawned, the workers must not inherit sessions or loops of this process.
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=serve, args=(host, port, worker, workers), name=f"worker-{worker}")
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info("Started %s workers on %s:%s", workers, host, port)
+    # Every worker shuts down gracefully on SIGTERM, SIGINT reaches them through the process group.
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+        logger.info(f"\nServer will shut down...")
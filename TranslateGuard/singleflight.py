@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AbandonedFlightException(Exception):
+    def __init__(self, key: str):
+        super().__init__(f"In-flight translation was abandoned by its owner | key: {key}")
+        self.key = key
+
+
+def _consume_exception(future: asyncio.Future):
+    # A failed flight may have no follower, don't let asyncio report it as never retrieved.
+    if not future.cancelled():
+        future.exception()
+
+
+class SingleFlight:
+    """
+    Track paragraphs currently being translated, so concurrent requests for the same
+    paragraph wait on the first request instead of asking the engines again.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def claim(self, keys: dict[int, str]) -> tuple[dict[int, asyncio.Future], dict[int, asyncio.Future]]:
+        """
+        Split {num: key} into the futures of nums the caller owns and must resolve or fail,
+        and the futures of nums another caller (or an earlier num) is already translating.
+        """
+        owned = {}
+        waiting = {}
+        for num, key in keys.items():
+            if (future := self._inflight.get(key)) is not None:
+                waiting[num] = future
+                self.stats["followers"] += 1
+            else:
+                future = asyncio.get_running_loop().create_future()
+                future.add_done_callback(_consume_exception)
+                self._inflight[key] = future
+                owned[num] = future
+                self.stats["leaders"] += 1
+        return owned, waiting
+
+    def _release(self, key: str, future: asyncio.Future) -> bool:
+        # The key may have been resolved and claimed again by another caller, leave that flight alone.
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        return not future.done()
+
+    def resolve(self, key: str, future: asyncio.Future, value: str):
+        if self._release(key, future):
+            future.set_result(value)
+
+    def fail(self, key: str, future: asyncio.Future, exception: BaseException):
+        if self._release(key, future):
+            future.set_exception(exception)
+
+    @staticmethod
+    async def wait(waiting: dict[int, asyncio.Future]) -> dict[int, str]:
+        """
+        Wait for other callers' flights. Shielded, so a cancelled follower never cancels the owner.
+        Nums whose owner gave up are left out, for the caller to claim again.
+        """
+        if not waiting:
+            return {}
+        values = await asyncio.gather(*[asyncio.shield(future) for future in waiting.values()],
+                                      return_exceptions=True)
+        result = {}
+        for num, value in zip(waiting.keys(), values):
+            if isinstance(value, AbandonedFlightException):
+                continue
+            if isinstance(value, BaseException):
+                raise value
+            result[num] = value
+        return result
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from .config import config, CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_path():
+    """
+    One snapshot per worker process, each holds the accounts of its partition.
+    """
+    if config.get("WORKERS", 1) > 1:
+        return CONFIG_PATH / f"snapshot-{config.WORKER}-of-{config.WORKERS}.json"
+    return CONFIG_PATH / "snapshot.json"
+
+
+def take_snapshot(app) -> dict:
+    """
+    Runtime state of every chat agent and the hot keys of the translation cache.
+    """
+    agents = {agent.user.EMAIL: agent.runtime_state() for agent in app['chat_agent_pool'].instance_list}
+    if config.SHOULD_DEL_CON:
+        # Conversations are deleted on shutdown, nothing left to continue.
+        for state in agents.values():
+            state["conversations"] = []
+    cache = app.get('translation_cache')
+    return {"version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "agents": agents,
+            "cache_keys": cache.hot_keys() if cache is not None and cache.db is not None else []}
+
+
+def _write(snapshot: dict):
+    path = snapshot_path()
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _read() -> dict | None:
+    path = snapshot_path()
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        snapshot = json.load(f)
+    # One restart only, a crash later must not bring back stale state.
+    os.remove(path)
+    return snapshot
+
+
+async def save_snapshot(app):
+    snapshot = take_snapshot(app)
+    try:
+        await asyncio.to_thread(_write, snapshot)
+        logger.info("Saved snapshot of %s agent(s) and %s cache key(s)", len(snapshot["agents"]),
+                    len(snapshot["cache_keys"]))
+    except OSError as e:
+        logger.error("Saving snapshot failed: %s", e)
+
+
+async def restore_snapshot(app) -> list[str]:
+    """
+    Restore a snapshot saved at most SNAPSHOT_MAX_AGE seconds ago.
+    Agents only take their state back if their access token is still the one it was saved with.
+    Returns the emails of the agents restored.
+    """
+    try:
+        snapshot = await asyncio.to_thread(_read)
+    except (OSError, ValueError) as e:
+        logger.warning("Snapshot unreadable, starting cold: %s", e)
+        return []
+    if snapshot is None:
+        return []
+    age = time.time() - snapshot.get("saved_at", 0)
+    if snapshot.get("version") != SNAPSHOT_VERSION or age > config.get("SNAPSHOT_MAX_AGE", 600):
+        logger.info("Snapshot from %.0fs ago is too old, starting cold", age)
+        return []
+    restored = []
+    for email, state in snapshot["agents"].items():
+        agent = app['chat_agent_pool'].instances.get(email)
+        try:
+            if agent is not None and agent.restore_runtime_state(state):
+                restored.append(email)
+        except (KeyError, TypeError) as e:
+            logger.warning("Snapshot of %s unusable: %s", email, e)
+    cache = app.get('translation_cache')
+    warmed = await cache.warm(snapshot["cache_keys"]) if cache is not None else 0
+    logger.info("Restored snapshot from %.0fs ago | agents %s | %s cache entries warm", age, restored, warmed)
+    return restored
@@ -0,0 +1,225 @@
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from .config import config, CONFIG_PATH
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    A timed stage of a request.
+    """
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str | None, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.attributes = attributes
+        self.error: str | None = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Trace:
+    """
+    Spans of one request, ids in the W3C trace context format.
+    """
+    __slots__ = ("trace_id", "request_id", "spans")
+
+    def __init__(self, request_id: str):
+        self.trace_id = "%032x" % random.getrandbits(128)
+        self.request_id = request_id
+        self.spans: list[Span] = []
+
+    def summary(self) -> str:
+        """
+        Span tree with durations, children indented below their parent in start order.
+        """
+        children: dict[str | None, list[Span]] = {}
+        for span in sorted(self.spans, key=lambda s: s.start_ns):
+            children.setdefault(span.parent_id, []).append(span)
+        lines = []
+
+        def walk(parent_id: str | None, depth: int):
+            for span in children.get(parent_id, []):
+                attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+                lines.append(f"{'  ' * depth}{span.name} {span.seconds:.3f}s {attributes}"
+                             + (f" error={span.error}" if span.error else ""))
+                walk(span.span_id, depth + 1)
+
+        walk(None, 0)
+        return "\n".join(lines)
+
+
+# Tasks copy the context they are created in, so spans of engine calls land below the request.
+current_request_id: ContextVar[str | None] = ContextVar("current_request_id", default=None)
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage below the current span, a no-op outside of a traced request.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.spans.append(child)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        current_span.reset(token)
+
+
+@contextmanager
+def request(request_id: str | None = None, name: str = "request", **attributes):
+    """
+    Trace one request: set its id for the logs and, with TRACE_ENABLE, time its spans.
+    A request slower than TRACE_SLOW_SECONDS logs its span tree, traces are exported if configured.
+    """
+    request_id = request_id or "%016x" % random.getrandbits(64)
+    id_token = current_request_id.set(request_id)
+    if not config.get("TRACE_ENABLE", True):
+        try:
+            yield None
+        finally:
+            current_request_id.reset(id_token)
+        return
+    trace = Trace(request_id)
+    root = Span(trace, name, None, attributes)
+    trace.spans.append(root)
+    span_token = current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = type(e).__name__
+        raise
+    finally:
+        root.end_ns = time.time_ns()
+        current_span.reset(span_token)
+        if root.seconds >= config.get("TRACE_SLOW_SECONDS", 10):
+            logger.warning("Slow request %s took %.2fs:\n%s", request_id, root.seconds, trace.summary())
+        if (exporter := get_exporter()) is not None:
+            exporter.export(trace)
+        current_request_id.reset(id_token)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Add the id of the current request to records as request_id, "-" outside of requests.
+    Use it in a format of logging_config.json with %(request_id)s.
+    """
+
+    def filter(self, record):
+        record.request_id = current_request_id.get() or "-"
+        return True
+
+
+def _attributes(attributes: dict) -> list[dict]:
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            values.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            values.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            values.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            values.append({"key": key, "value": {"stringValue": str(value)}})
+    return values
+
+
+class FileSpanExporter:
+    """
+    Append traces as OTLP/JSON lines, one ExportTraceServiceRequest per request,
+    the format of the OpenTelemetry collector file exporter and receiver.
+    """
+
+    def __init__(self, path: Path, sample: float = 1.0, service_name: str = "TranslateGuard"):
+        self.path = path
+        self.sample = sample
+        self.resource = {"attributes": _attributes({"service.name": service_name, "process.pid": os.getpid()})}
+        self._lock = threading.Lock()
+        self._file = None
+        self.exported = 0
+
+    def _span(self, span: Span) -> dict:
+        data = {"traceId": span.trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                # SERVER for the request, INTERNAL for its stages.
+                "kind": 2 if span.parent_id is None else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+                "attributes": _attributes(dict(span.attributes, **{"request.id": span.trace.request_id})),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1}}
+        if span.parent_id is not None:
+            data["parentSpanId"] = span.parent_id
+        return data
+
+    def export(self, trace: Trace):
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+        line = dumps({"resourceSpans": [{"resource": self.resource,
+                                         "scopeSpans": [{"scope": {"name": __name__},
+                                                         "spans": [self._span(s) for s in trace.spans]}]}]})
+        try:
+            with self._lock:
+                if self._file is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self.path, 'ab')
+                self._file.write(line + b"\n")
+                self._file.flush()
+            self.exported += 1
+        except OSError as e:
+            logger.error("Exporting trace %s to %s failed: %s", trace.request_id, self.path, e)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@functools.cache
+def get_exporter() -> FileSpanExporter | None:
+    """
+    The exporter of TRACE_EXPORT_PATH (relative to the config dir), None if not configured.
+    Worker processes write a file each.
+    """
+    if not (path := config.get("TRACE_EXPORT_PATH")):
+        return None
+    path = CONFIG_PATH / path
+    if config.get("WORKERS", 1) > 1:
+        path = path.with_name(f"{path.stem}-{config.WORKER}{path.suffix}")
+    return FileSpanExporter(path, sample=config.get("TRACE_EXPORT_SAMPLE", 1.0))
+
+
+def close_exporter():
+    if (exporter := get_exporter()) is not None:
+        exporter.close()
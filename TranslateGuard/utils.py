@@ -1,10 +1,12 @@
+import asyncio
 import logging
 import random
 import time
-from typing import Callable
+from typing import Awaitable, Callable
 
-
-from .base_exceptions import ErrorMsg, RetryException
+from . import deadline
+from .base_exceptions import ErrorMsg, StrEnum
+from .base_message_enum import DebugInfoMsg
 
 logger = logging.getLogger(__name__)
 
@@ -19,37 +21,145 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
-def retry(
-        func: Callable,
-        e_type_list: list[ErrorMsg],
-        initial_delay: float = 1,
-        exponential_base: float = 2,
-        jitter: bool = True,
-        max_retries: int = 3
-):
-    """Retry a function with exponential backoff."""
+class RetryTokenBucket:
+    """
+    Global retry budget. Every call deposits ratio tokens and every retry withdraws one,
+    so a backend that fails everything sees at most ratio extra load instead of a retry storm.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 20):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
 
-    def wrapper(*args, **kwargs):
-        # Initialize variables
+retry_budget = RetryTokenBucket()
+
+
+class RetryPolicy:
+    """
+    Retry a coroutine with jittered exponential backoff, bounded by max_retries,
+    an overall deadline for all attempts, the request deadline and the global retry budget.
+    """
+
+    def __init__(self,
+                 retry_on: Callable[[Exception], bool],
+                 max_retries: int = 2,
+                 initial_delay: float = 0.5,
+                 exponential_base: float = 2,
+                 max_delay: float = 8,
+                 jitter: bool = True,
+                 deadline: float | None = None,
+                 budget: RetryTokenBucket = retry_budget):
+        self.retry_on = retry_on
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.exponential_base = exponential_base
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.budget = budget
+
+    async def run(self,
+                  func: Callable[..., Awaitable],
+                  *args,
+                  source: str = "",
+                  before_retry: Callable[[Exception], Awaitable] | None = None,
+                  **kwargs):
+        """
+        await func(*args, **kwargs), before_retry(exception) runs before every retry,
+        e.g. to refresh credentials.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        delay = self.initial_delay
         num_retries = 0
-        delay = initial_delay
-        type_list = tuple(e_type_list)
-        # Loop until a successful response or max_retries is hit or an exception is raised
+        self.budget.deposit()
         while True:
             try:
-                return func(*args, **kwargs)
-
-            # Retry on specified errors
+                return await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                if e.error_type in type_list:
-                    logger.warning(e)
-                    num_retries += 1
-                    if num_retries > max_retries:
-                        logger.error(ErrorMsg.RetryError)
-                        raise e
-                    delay *= exponential_base * (1 + jitter * random.random())
-
-                    time.sleep(delay)
-                else:
-                    raise RetryException(ErrorMsg.RetryError)
-    return wrapper
+                if num_retries >= self.max_retries or not self.retry_on(e):
+                    raise
+                wait = min(delay, self.max_delay)
+                if self.jitter:
+                    wait *= 0.5 + random.random()
+                if self.deadline is not None and loop.time() - start + wait > self.deadline:
+                    raise
+                if (left := deadline.remaining()) is not None and left < wait:
+                    # The request would be over before the retry even starts.
+                    raise
+                if not self.budget.withdraw():
+                    logger.warning(ErrorMsg.RetryError, num_retries, source, "global retry budget exhausted")
+                    raise
+                logger.warning(DebugInfoMsg.RETRY, getattr(func, "__name__", func), source, e)
+                if before_retry is not None:
+                    await before_retry(e)
+                await asyncio.sleep(wait)
+                delay *= self.exponential_base
+                num_retries += 1
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Open after failure_threshold consecutive failures, so the instance gets no traffic.
+    After reset_timeout one probe call is let through (half-open), its outcome closes or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._state = CircuitState.CLOSED
+        self.opened = 0
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = CircuitState.HALF_OPEN
+            self.probing = False
+        return self._state
+
+    @property
+    def available(self) -> bool:
+        state = self.state
+        return state == CircuitState.CLOSED or (state == CircuitState.HALF_OPEN and not self.probing)
+
+    def on_call(self):
+        if self.state == CircuitState.HALF_OPEN:
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        self._state = CircuitState.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != CircuitState.OPEN:
+                self.opened += 1
+            self._state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
@@ -0,0 +1,276 @@
+"""
+Local stand-ins for the backends of TranslateGuard, so throughput can be measured offline.
+
+- ChatGPT web: device id page, sentinel chat-requirements, register-websocket, conversation post and delete,
+  answers pushed as base64 `data:` frames over the websocket of the posting access token.
+- DeepLX: POST /translate.
+- OpenAI: POST /v1/chat/completions.
+
+Translations keep the "N." / "[[N]]" prefixes of the prompt and mark the text, latency and failures are
+drawn per call. With --unequal-rate a multi paragraph answer drops a paragraph to exercise the bisect.
+
+    python -m benchmarks.fakes --latency 2 --jitter 1 --failure-rate 0.02 --unequal-rate 0.05
+"""
+import argparse
+import asyncio
+import base64
+import random
+import re
+import uuid
+
+from aiohttp import web
+
+from TranslateGuard.serialization import dumps, dumps_str, loads
+
+# The prompt builders end their instructions with ":\n\n", the paragraphs follow.
+PROMPT_SEPARATOR = ":\n\n"
+PATTERN_PREFIX = re.compile(r"^(\d+\.\s*|\[\[\d+]]\s*)?(.*)$")
+DONE_BODY = base64.b64encode(b"data: [DONE]\n\n").decode()
+
+
+class Behaviour:
+    """
+    Latency and failure rates of a fake backend.
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.5, failure_rate: float = 0.0,
+                 unequal_rate: float = 0.0, failure_status: int = 500, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.unequal_rate = unequal_rate
+        self.failure_status = failure_status
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, self.random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+
+    def fail(self) -> bool:
+        self.calls += 1
+        if self.random.random() < self.failure_rate:
+            self.failures += 1
+            return True
+        return False
+
+    def failure(self) -> web.Response:
+        return web.json_response({"detail": "fake failure"}, status=self.failure_status)
+
+    def translate(self, text: str) -> str:
+        """
+        Translation of the paragraph lines of a prompt, one line per paragraph with its prefix kept.
+        """
+        lines = [line for line in text.split("\n") if line.strip()]
+        translated = []
+        for line in lines:
+            prefix, body = PATTERN_PREFIX.match(line).groups()
+            translated.append(f"{prefix or ''}【译】{body}")
+        if len(translated) > 1 and self.random.random() < self.unequal_rate:
+            del translated[self.random.randrange(len(translated))]
+        return "\n".join(translated)
+
+
+def _paragraphs(prompt: str) -> str:
+    return prompt.split(PROMPT_SEPARATOR, 1)[-1]
+
+
+def _token(request: web.Request) -> str:
+    return request.headers.get("Authorization", "").removeprefix("Bearer ")
+
+
+def chatgpt_app(behaviour: Behaviour) -> web.Application:
+    """
+    The chat.openai.com endpoints used by ChatAgent, base url http://host:port.
+    """
+    # Websockets by access token, every account only hears its own answers.
+    sockets: dict[str, set[web.WebSocketResponse]] = {}
+    background: set[asyncio.Task] = set()
+
+    async def device_id(request):
+        return web.Response(text='<script>{"DeviceId": "%s"}</script>' % uuid.uuid4(), content_type="text/html")
+
+    async def requirements(request):
+        return web.json_response({"token": f"fake-requirements-{uuid.uuid4()}"})
+
+    async def register_websocket(request):
+        token = _token(request)
+        return web.json_response({"wss_url": f"ws://{request.host}/ws?token={token}"})
+
+    async def websocket(request):
+        ws = web.WebSocketResponse(heartbeat=30, protocols=("json.reliable.webpubsub.azure.v1",))
+        await ws.prepare(request)
+        token = request.query.get("token", "")
+        sockets.setdefault(token, set()).add(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            sockets[token].discard(ws)
+        return ws
+
+    async def push(token: str, conversation_id: str, parent_id: str, prompt: str):
+        await behaviour.delay()
+        message_id = str(uuid.uuid4())
+        event = {"message": {"id": message_id, "author": {"role": "assistant"},
+                             "content": {"content_type": "text", "parts": [behaviour.translate(_paragraphs(prompt))]},
+                             "metadata": {"parent_id": parent_id}},
+                 "conversation_id": conversation_id}
+        body = base64.b64encode(b"data: " + dumps(event) + b"\n\n").decode()
+        for ws in list(sockets.get(token, ())):
+            if ws.closed:
+                continue
+            await ws.send_str(dumps_str({"type": "message", "data": {
+                "body": body, "message_id": message_id, "conversation_id": conversation_id}}))
+            await ws.send_str(dumps_str({"type": "message", "data": {
+                "body": DONE_BODY, "conversation_id": conversation_id}}))
+
+    async def conversation(request):
+        data = loads(await request.read())
+        if behaviour.fail():
+            return behaviour.failure()
+        conversation_id = data.get("conversation_id") or str(uuid.uuid4())
+        message = data["messages"][0]
+        task = asyncio.create_task(push(_token(request), conversation_id, message["id"],
+                                        message["content"]["parts"][0]))
+        background.add(task)
+        task.add_done_callback(background.discard)
+        return web.json_response({"conversation_id": conversation_id, "wss_url": None})
+
+    async def delete_conversation(request):
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.add_routes([web.get("/", device_id),
+                    web.post("/backend-api/sentinel/chat-requirements", requirements),
+                    web.post("/backend-api/register-websocket", register_websocket),
+                    web.post("/backend-api/conversation", conversation),
+                    web.patch("/backend-api/conversation/{conversation_id}", delete_conversation),
+                    web.get("/ws", websocket)])
+    return app
+
+
+def deeplx_app(behaviour: Behaviour) -> web.Application:
+    """
+    A DeepLX server, url http://host:port/translate.
+    """
+
+    async def translate(request):
+        data = loads(await request.read())
+        await behaviour.delay()
+        if behaviour.fail():
+            return behaviour.failure()
+        return web.json_response({"code": 200, "id": random.getrandbits(32), "data": behaviour.translate(data["text"]),
+                                  "source_lang": data.get("source_lang"), "target_lang": data.get("target_lang")})
+
+    app = web.Application()
+    app.add_routes([web.post("/translate", translate)])
+    return app
+
+
+def openai_app(behaviour: Behaviour) -> web.Application:
+    """
+    The OpenAI chat completions api, url http://host:port/v1/chat/completions.
+    """
+
+    async def completions(request):
+        data = loads(await request.read())
+        await behaviour.delay()
+        if behaviour.fail():
+            return behaviour.failure()
+        content = behaviour.translate(_paragraphs(data["messages"][-1]["content"]))
+        return web.Response(body=dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "model": data.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}),
+            content_type="application/json")
+
+    app = web.Application()
+    app.add_routes([web.post("/v1/chat/completions", completions)])
+    return app
+
+
+class FakeBackends:
+    """
+    The three fakes served on localhost, started and stopped together.
+    """
+
+    def __init__(self, behaviour: Behaviour, host: str = "127.0.0.1",
+                 chatgpt_port: int = 0, deeplx_port: int = 0, openai_port: int = 0):
+        self.behaviour = behaviour
+        self.host = host
+        self.ports = {"chatgpt": chatgpt_port, "deeplx": deeplx_port, "openai": openai_port}
+        self.runners: list[web.AppRunner] = []
+
+    async def start(self):
+        for name, factory in (("chatgpt", chatgpt_app), ("deeplx", deeplx_app), ("openai", openai_app)):
+            runner = web.AppRunner(factory(self.behaviour), access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, self.host, self.ports[name])
+            await site.start()
+            # Port 0 picks a free one.
+            self.ports[name] = runner.addresses[0][1]
+            self.runners.append(runner)
+
+    async def stop(self):
+        for runner in self.runners:
+            await runner.cleanup()
+        self.runners.clear()
+
+    @property
+    def chatgpt_url(self) -> str:
+        return f"http://{self.host}:{self.ports['chatgpt']}"
+
+    @property
+    def deeplx_url(self) -> str:
+        return f"http://{self.host}:{self.ports['deeplx']}/translate"
+
+    @property
+    def openai_url(self) -> str:
+        return f"http://{self.host}:{self.ports['openai']}/v1/chat/completions"
+
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds of a backend call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency is uniform in mean +- jitter")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls failing with an http error")
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--unequal-rate", type=float, default=0.0,
+                        help="share of multi paragraph answers missing a paragraph")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def behaviour_from_args(args) -> Behaviour:
+    return Behaviour(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                     unequal_rate=args.unequal_rate, failure_status=args.failure_status, seed=args.seed)
+
+
+async def _serve(backends: FakeBackends):
+    await backends.start()
+    print(f"CHATGPT_BASE_URL  {backends.chatgpt_url}")
+    print(f"DEEPLX_URLS       {backends.deeplx_url}")
+    print(f"API_KEYS URL      {backends.openai_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await backends.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--chatgpt-port", type=int, default=18080)
+    parser.add_argument("--deeplx-port", type=int, default=18081)
+    parser.add_argument("--openai-port", type=int, default=18082)
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+    backends = FakeBackends(behaviour_from_args(args), args.host, args.chatgpt_port, args.deeplx_port,
+                            args.openai_port)
+    try:
+        asyncio.run(_serve(backends))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
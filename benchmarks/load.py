@@ -0,0 +1,354 @@
+"""
+End-to-end load benchmark of TranslateGuard against the local fake backends of benchmarks.fakes.
+
+Writes a throwaway config dir (fake accounts with valid credentials, api keys and DeepLX pointing at the fakes),
+starts `python -m TranslateGuard` on it, waits for /ready and drives /v1/chat/completions with Immersive
+Translate like payloads: paragraphs joined by PATTERN_SPLIT, some with <bN></bN> tags that go to DeepLX.
+Reports throughput, latency percentiles and answers with a wrong paragraph count.
+
+    python -m benchmarks.load --engine ChatWebGpt --accounts 4 --concurrency 32 --requests 500
+    python -m benchmarks.load --engine GPT-Turbo --api-keys 2 --workers 2 --stream --latency 0.5
+    python -m benchmarks.load --target http://127.0.0.1:5050 --duration 60   # a server already running
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiohttp
+
+from TranslateGuard.serialization import dumps, loads
+from benchmarks.fakes import FakeBackends, add_behaviour_arguments, behaviour_from_args
+
+ROOT = Path(__file__).parent.parent
+PATTERN_SPLIT = "\n\n%%\n\n"
+# What Immersive Translate sends as system message of its OpenAI service.
+SYSTEM_MESSAGE = ("You are a professional, authentic machine translation engine. "
+                  "Translate the following source text to Chinese (Simplified), "
+                  "Output translation directly without any additional text.")
+WORDS = ("the quick brown fox jumps over a lazy dog while engineers measure latency of every request "
+         "in production systems and readers translate long articles about distributed databases caches "
+         "queues schedulers batches throughput percentiles websockets sessions tokens").split()
+
+
+class PayloadFactory:
+    """
+    Immersive Translate like request bodies. A share of paragraphs is drawn again from earlier ones,
+    as pages repeat navigation and footers, which the translation cache serves.
+    """
+
+    def __init__(self, paragraphs: tuple[int, int] = (1, 12), words: tuple[int, int] = (8, 60),
+                 tag_rate: float = 0.1, repeat_rate: float = 0.0, seed: int | None = None):
+        self.paragraphs = paragraphs
+        self.words = words
+        self.tag_rate = tag_rate
+        self.repeat_rate = repeat_rate
+        self.random = random.Random(seed)
+        self.seen: list[str] = []
+        self.counter = 0
+
+    def paragraph(self) -> str:
+        if self.seen and self.random.random() < self.repeat_rate:
+            return self.random.choice(self.seen)
+        self.counter += 1
+        words = [self.random.choice(WORDS) for _ in range(self.random.randint(*self.words))]
+        words[0] = f"{self.counter}:{words[0].capitalize()}"
+        if self.random.random() < self.tag_rate:
+            # Inline markup becomes empty <bN></bN> pairs, more than two of them route to DeepLX.
+            for n in range(3):
+                words.insert(self.random.randrange(len(words) + 1), f"<b{n}></b{n}>")
+        text = " ".join(words) + "."
+        self.seen.append(text)
+        return text
+
+    def __call__(self, stream: bool) -> tuple[bytes, int]:
+        """
+        Body and paragraph count of a request.
+        """
+        paragraphs = [self.paragraph() for _ in range(self.random.randint(*self.paragraphs))]
+        return dumps({"model": "gpt-3.5-turbo", "temperature": 0, "stream": stream,
+                      "messages": [{"role": "system", "content": SYSTEM_MESSAGE},
+                                   {"role": "user", "content": PATTERN_SPLIT.join(paragraphs)}]}), len(paragraphs)
+
+
+class Results:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.first_bytes: list[float] = []
+        self.paragraphs = 0
+        self.errors: dict[str, int] = {}
+        self.unequal = 0
+        self.seconds = 0.0
+
+    def error(self, reason: str):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    @staticmethod
+    def percentile(values: list[float], q: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, round(q * (len(values) - 1)))] if values else float("nan")
+
+    def summary(self) -> dict:
+        ok = len(self.latencies)
+        data = {"requests_ok": ok, "errors": sum(self.errors.values()), "error_reasons": self.errors,
+                "unequal": self.unequal, "seconds": round(self.seconds, 3),
+                "requests_per_second": round(ok / self.seconds, 2) if self.seconds else 0,
+                "paragraphs_per_second": round(self.paragraphs / self.seconds, 2) if self.seconds else 0}
+        for q in (0.5, 0.95, 0.99):
+            data[f"p{round(q * 100)}"] = round(self.percentile(self.latencies, q), 4)
+        data["max"] = round(max(self.latencies, default=float("nan")), 4)
+        if self.first_bytes:
+            data["first_byte_p50"] = round(self.percentile(self.first_bytes, 0.5), 4)
+            data["first_byte_p95"] = round(self.percentile(self.first_bytes, 0.95), 4)
+        return data
+
+
+async def _read_answer(resp: aiohttp.ClientResponse, stream: bool, start: float, results: Results) -> str:
+    if not stream:
+        return loads(await resp.read())["choices"][0]["message"]["content"]
+    parts = []
+    first = True
+    async for line in resp.content:
+        if first:
+            results.first_bytes.append(time.perf_counter() - start)
+            first = False
+        line = line.strip()
+        if not line.startswith(b"data: ") or line == b"data: [DONE]":
+            continue
+        event = loads(line[6:])
+        if "error" in event:
+            raise RuntimeError(event["error"]["message"])
+        if content := event["choices"][0]["delta"].get("content"):
+            parts.append(content)
+    return "".join(parts)
+
+
+async def send(session: aiohttp.ClientSession, url: str, body: bytes, count: int, stream: bool, results: Results):
+    """
+    Post one request and add its outcome to results.
+    """
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as resp:
+            if resp.status != 200:
+                results.error(f"http {resp.status}")
+                await resp.read()
+                return
+            answer = await _read_answer(resp, stream, start, results)
+    except Exception as e:
+        results.error(type(e).__name__)
+        return
+    results.latencies.append(time.perf_counter() - start)
+    results.paragraphs += count
+    if len(answer.split(PATTERN_SPLIT)) != count:
+        results.unequal += 1
+
+
+def client_session(concurrency: int, timeout: float = 120) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency),
+                                 timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def drive(url: str, payloads: PayloadFactory, concurrency: int, requests: int | None,
+                duration: float | None, stream: bool) -> Results:
+    """
+    Send requests from concurrency clients until requests are sent or duration is over.
+    """
+    results = Results()
+    sent = 0
+    end = time.perf_counter() + duration if duration else None
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal sent
+        while (requests is None or sent < requests) and (end is None or time.perf_counter() < end):
+            sent += 1
+            body, count = payloads(stream)
+            await send(session, url, body, count, stream, results)
+
+    async with client_session(concurrency) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+        results.seconds = time.perf_counter() - started
+    return results
+
+
+def write_config(path: Path, backends: FakeBackends, accounts: int, api_keys: int, engine: str, port: int,
+                 extra: dict) -> Path:
+    """
+    A config dir whose accounts, api keys and DeepLX are the fakes, credentials included so no browser starts.
+    """
+    (path / "ChatgptAuth").mkdir(parents=True, exist_ok=True)
+    emails = [f"bench{i}@example.com" for i in range(accounts)]
+    config = {
+        "ACCOUNTS": [{"EMAIL": email, "PASSWORD": "-", "USE": True} for email in emails],
+        "API_KEYS": [{"URL": backends.openai_url, "KEY": f"sk-bench-{i:04d}", "NEED_PROXY": False, "USE": True}
+                     for i in range(api_keys)],
+        "PROXIES": None, "DEBUG": False, "DRIVER_EXECUTABLE_PATH": None,
+        "HOST": "127.0.0.1", "PORT": port,
+        "PATTERN_SPLIT": PATTERN_SPLIT, "SYSTEM_PROMPT": "You are a translator. ", "USER_PROMPT_ADD": "",
+        "SHOULD_DEL_CON": False, "FORCE_USING_CHAT_WEB_NUM": 0,
+        "LLM_ENGINE": engine,
+        "CHATGPT_BASE_URL": backends.chatgpt_url, "CHATGPT_PROXY": None,
+        "DEEPLX_URLS": [backends.deeplx_url],
+        "AUTH_REFRESH_ENABLE": False, "SNAPSHOT_ENABLE": False, "CACHE_PERSIST": False,
+        **extra,
+    }
+    (path / "config.json").write_text(dumps(config).decode())
+    (path / "logging_config.json").write_text(dumps({
+        "version": 1, "disable_existing_loggers": False,
+        "formatters": {"plain": {"format": "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"}},
+        "handlers": {"file": {"class": "logging.FileHandler", "formatter": "plain",
+                              "filename": str(path / "server.log")}},
+        "root": {"level": "WARNING", "handlers": ["file"]}}).decode())
+    (path / "user_agent_ua.in").write_text(
+        "120\nMozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36\n\"Not_A Brand\";v=\"8\", \"Chromium\";v=\"120\"\n")
+    credentials = {email: {"cookies": [{"name": "__Secure-next-auth.session-token", "value": f"bench-{i}"}],
+                           "access_token": {"accessToken": f"bench-token-{i}", "expires": "2099-01-01T00:00:00.000Z"}}
+                   for i, email in enumerate(emails)}
+    (path / "ChatgptAuth" / "credentials.json").write_text(dumps(credentials).decode())
+    return path
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60) -> bool:
+    end = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < end:
+            if process.poll() is not None:
+                return False
+            try:
+                async with session.get(f"{base_url}/ready") as resp:
+                    if resp.status == 200:
+                        return True
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    return False
+
+
+def start_server(config_path: Path, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, TRANSLATEGUARD_CONFIG_PATH=str(config_path))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return subprocess.Popen([sys.executable, "-m", "TranslateGuard", "--workers", str(workers)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def report(args, results: Results, backends: FakeBackends | None) -> dict:
+    data = results.summary()
+    print(f"{data['requests_ok']} ok, {data['errors']} errors {data['error_reasons'] or ''}, "
+          f"{data['unequal']} with a wrong paragraph count, in {data['seconds']:.1f}s")
+    print(f"throughput   {data['requests_per_second']:.1f} req/s, {data['paragraphs_per_second']:.1f} paragraphs/s")
+    print(f"latency      p50 {data['p50']:.3f}s  p95 {data['p95']:.3f}s  p99 {data['p99']:.3f}s  max {data['max']:.3f}s")
+    if "first_byte_p50" in data:
+        print(f"first byte   p50 {data['first_byte_p50']:.3f}s  p95 {data['first_byte_p95']:.3f}s")
+    if backends is not None:
+        behaviour = backends.behaviour
+        print(f"backend      {behaviour.calls} calls, {behaviour.failures} failed")
+        data["backend_calls"], data["backend_failures"] = behaviour.calls, behaviour.failures
+    return data
+
+
+def write_json(args, data: dict):
+    if args.json:
+        data["args"] = {key: value for key, value in vars(args).items() if key != "json"}
+        Path(args.json).write_text(dumps(data).decode())
+
+
+@asynccontextmanager
+async def local_server(args):
+    """
+    Base url of the server to benchmark and the fakes behind it: args.target as is,
+    else a server started on a throwaway config dir with the fakes, stopped again on exit.
+    """
+    if args.target:
+        yield args.target, None
+        return
+    backends = FakeBackends(behaviour_from_args(args))
+    await backends.start()
+    config_path = Path(tempfile.mkdtemp(prefix="translateguard-bench-"))
+    process = None
+    keep = args.keep
+    try:
+        port = _free_port()
+        write_config(config_path, backends, args.accounts, args.api_keys, args.engine, port,
+                     loads(args.config) if args.config else {})
+        process = start_server(config_path, args.workers)
+        base_url = f"http://127.0.0.1:{port}"
+        if not await wait_ready(base_url, process):
+            keep = True
+            raise RuntimeError(f"TranslateGuard did not get ready, see {config_path / 'server.log'}")
+        print(f"engine {args.engine}, {args.accounts} account(s), {args.api_keys} api key(s), "
+              f"{args.workers} worker(s), fake latency {args.latency}s +- {args.jitter}s")
+        yield base_url, backends
+    finally:
+        if process is not None and process.poll() is None:
+            process.terminate()
+            # Leave the event loop serving the fakes while the server shuts down its sessions.
+            await asyncio.to_thread(process.wait, 20)
+        await backends.stop()
+        if keep:
+            print(f"config dir and server.log kept in {config_path}")
+        else:
+            shutil.rmtree(config_path, ignore_errors=True)
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--target", help="base url of a running server, no fakes or server are started")
+    parser.add_argument("--engine", default="ChatWebGpt", choices=("ChatWebGpt", "GPT-Turbo"),
+                        help="LLM_ENGINE for paragraphs without tags")
+    parser.add_argument("--accounts", type=int, default=4, help="fake ChatGPT accounts")
+    parser.add_argument("--api-keys", type=int, default=2, help="fake OpenAI api keys")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--config", help='JSON merged into config.json, e.g. \'{"CACHE_ENABLE": false}\'')
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the config dir and server.log")
+    add_behaviour_arguments(parser)
+
+
+async def run(args) -> int:
+    payloads = PayloadFactory(paragraphs=(args.min_paragraphs, args.max_paragraphs), tag_rate=args.tag_rate,
+                              repeat_rate=args.repeat_rate, seed=args.seed)
+    requests = None if args.duration and not args.requests else args.requests or 200
+    try:
+        async with local_server(args) as (base_url, backends):
+            print(f"concurrency {args.concurrency}, stream {args.stream}")
+            results = await drive(f"{base_url}/v1/chat/completions", payloads, args.concurrency, requests,
+                                  args.duration, args.stream)
+            write_json(args, report(args, results, backends))
+    except RuntimeError as e:
+        print(e)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_server_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=None, help="requests to send, 200 without --duration")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to send requests for")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--min-paragraphs", type=int, default=1)
+    parser.add_argument("--max-paragraphs", type=int, default=12)
+    parser.add_argument("--tag-rate", type=float, default=0.1, help="share of paragraphs with tags (DeepLX)")
+    parser.add_argument("--repeat-rate", type=float, default=0.0, help="share of paragraphs seen before (cache)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
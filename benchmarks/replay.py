@@ -0,0 +1,142 @@
+"""
+Replay traffic captured by the recorder of TranslateGuard (RECORD_PATH in config.json).
+
+Requests are sent again with the gaps they arrived with, divided by --speed, or back to back with
+--speed max, against a running server (--target) or one started on the fake backends of benchmarks.fakes.
+Reports throughput and latency percentiles next to the latencies recorded in production.
+
+    python -m benchmarks.replay .TranslateGuard/traffic --speed 10
+    python -m benchmarks.replay requests.jsonl requests-20261018-120000.jsonl.gz --speed max --concurrency 64
+    python -m benchmarks.replay .TranslateGuard/traffic --speed 1 --target http://127.0.0.1:5050
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from TranslateGuard.recorder import read_records
+from TranslateGuard.serialization import dumps
+from benchmarks.load import Results, add_server_arguments, client_session, local_server, report, send, write_json
+
+
+def record_files(paths: list[str]) -> list[Path]:
+    """
+    The given files, and the recorder files in the given dirs.
+    """
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(p for p in path.iterdir() if p.name.endswith((".jsonl", ".jsonl.gz")))
+        else:
+            files.append(path)
+    return files
+
+
+def select(records: list[dict], args) -> list[dict]:
+    if args.only_ok:
+        records = [record for record in records if record["status"] == 200]
+    if args.skip:
+        records = records[args.skip:]
+    if args.limit:
+        records = records[:args.limit]
+    return records
+
+
+async def replay(url: str, records: list[dict], speed: float | None, concurrency: int, stream: bool | None
+                 ) -> tuple[Results, float]:
+    """
+    Send records at their recorded pace divided by speed, or as fast as concurrency allows if speed is None.
+    Also the seconds sends started later than scheduled at most, as the server or concurrency held them back.
+    """
+    results = Results()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    lag = 0.0
+
+    async def one(session, record):
+        try:
+            body = record["body"] if stream is None else dict(record["body"], stream=stream)
+            await send(session, url, dumps(body), record["paragraphs"], bool(body.get("stream")), results)
+        finally:
+            slots.release()
+
+    async with client_session(concurrency) as session:
+        started = time.perf_counter()
+        first = records[0]["ts"]
+        for record in records:
+            if speed is not None:
+                due = started + (record["ts"] - first) / speed
+                if (wait := due - time.perf_counter()) > 0:
+                    await asyncio.sleep(wait)
+            await slots.acquire()
+            if speed is not None:
+                lag = max(lag, time.perf_counter() - due)
+            task = asyncio.create_task(one(session, record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        results.seconds = time.perf_counter() - started
+    return results, lag
+
+
+def recorded(records: list[dict]) -> dict:
+    """
+    Latencies and pace of the records as they were served when recorded.
+    """
+    latencies = [record["seconds"] for record in records if record["status"] == 200]
+    span = records[-1]["ts"] - records[0]["ts"]
+    return {"requests": len(records), "seconds": round(span, 3),
+            "requests_per_second": round(len(records) / span, 2) if span else 0,
+            "paragraphs": sum(record["paragraphs"] for record in records),
+            "p50": Results.percentile(latencies, 0.5), "p95": Results.percentile(latencies, 0.95),
+            "p99": Results.percentile(latencies, 0.99)}
+
+
+async def run(args) -> int:
+    files = record_files(args.paths)
+    if not files:
+        print("No recorder files found")
+        return 1
+    records = select(read_records(*files), args)
+    if not records:
+        print("No records to replay")
+        return 1
+    speed = None if args.speed == "max" else float(args.speed)
+    stream = {"recorded": None, "on": True, "off": False}[args.stream]
+    before = recorded(records)
+    print(f"{before['requests']} recorded requests, {before['paragraphs']} paragraphs over {before['seconds']:.1f}s "
+          f"from {len(files)} file(s), replayed at {'max speed' if speed is None else f'{speed:g}x'}")
+    try:
+        async with local_server(args) as (base_url, backends):
+            results, lag = await replay(f"{base_url}/v1/chat/completions", records, speed, args.concurrency, stream)
+            data = report(args, results, backends)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print(f"recorded     p50 {before['p50']:.3f}s  p95 {before['p95']:.3f}s  p99 {before['p99']:.3f}s  "
+          f"at {before['requests_per_second']:.2f} req/s")
+    if speed is not None:
+        print(f"send lag     {lag:.3f}s at most behind schedule")
+        data["lag"] = round(lag, 4)
+    data["recorded"] = before
+    write_json(args, data)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="recorder files (.jsonl, .jsonl.gz) or dirs of them")
+    parser.add_argument("--speed", default="1", help="1, 10, ... times the recorded pace, or max")
+    parser.add_argument("--concurrency", type=int, default=256, help="requests in flight at most")
+    parser.add_argument("--stream", choices=("recorded", "on", "off"), default="recorded")
+    parser.add_argument("--only-ok", action="store_true", help="skip requests that failed when recorded")
+    parser.add_argument("--skip", type=int, default=0, help="records to skip from the start")
+    parser.add_argument("--limit", type=int, default=None, help="records to replay at most")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Serialization benchmark of TranslateGuard.
+
+Compares per call cost of building the JSON sent and parsed on every translation the way it used to be
+(json.dumps of a fresh dict) with the pre-serialized templates and the JSON backend now in use.
+
+    python -m benchmarks.serialization --number 20000
+"""
+import argparse
+import base64
+import json
+import timeit
+import uuid
+
+from TranslateGuard.ChatWebReverse.playload import get_req_con_playload, render_req_con_playload
+from TranslateGuard.base_formatter import NORMAL_RESPONSE_TEMPLATE, STREAM_CHUNK_TEMPLATE
+from TranslateGuard.serialization import JSON_BACKEND, loads
+
+PARAGRAPHS = "\n\n%%\n\n".join(f"Paragraph {i} of a page, the quick brown fox jumps over the lazy dog." for i in range(8))
+TRANSLATED = "\n\n%%\n\n".join(f"第 {i} 段，敏捷的棕色狐狸跳过了懒狗。" for i in range(8))
+IDS = dict(websocket_request_id=str(uuid.uuid4()), conversation_id=str(uuid.uuid4()),
+           parent_message_id=str(uuid.uuid4()), message_id=str(uuid.uuid4()))
+FRAME = json.dumps({"type": "message", "data": {
+    "conversation_id": IDS["conversation_id"], "message_id": IDS["message_id"],
+    "body": base64.b64encode(("data: " + json.dumps({"message": {"content": {"parts": [TRANSLATED]}}}, ensure_ascii=False)
+                              ).encode()).decode()}})
+
+
+def _old_payload():
+    return json.dumps(get_req_con_playload(PARAGRAPHS, IDS["websocket_request_id"], IDS["conversation_id"],
+                                           IDS["parent_message_id"], IDS["message_id"])).encode("utf-8")
+
+
+def _new_payload():
+    return render_req_con_playload(PARAGRAPHS, **IDS)
+
+
+def _old_response():
+    return json.dumps({
+        "id": "chatcmpl-x", "object": "chat.completion", "created": 0,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": TRANSLATED}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 2048, "completion_tokens": 8192, "total_tokens": 10240}
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def _new_response():
+    return NORMAL_RESPONSE_TEMPLATE.render(id="chatcmpl-x", created=0, content=TRANSLATED)
+
+
+def _old_chunk():
+    return ("data: " + json.dumps({
+        "id": "chatcmpl-x", "object": "chat.completion.chunk", "created": 0,
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": TRANSLATED}, "finish_reason": None}]
+    }, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+
+def _new_chunk():
+    return b"data: " + STREAM_CHUNK_TEMPLATE.render(id="chatcmpl-x", created=0, finish_reason=None,
+                                                    delta={"role": "assistant", "content": TRANSLATED}) + b"\n\n"
+
+
+CASES = {
+    "conversation payload": (_old_payload, _new_payload),
+    "completion response": (_old_response, _new_response),
+    "stream chunk": (_old_chunk, _new_chunk),
+    "websocket frame": (lambda: json.loads(FRAME), lambda: loads(FRAME)),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {JSON_BACKEND}")
+    for name, (old, new) in CASES.items():
+        if isinstance(old(), bytes):
+            assert json.loads(old().removeprefix(b"data: ")) == json.loads(new().removeprefix(b"data: ")), name
+        old_us, new_us = (min(timeit.repeat(func, number=args.number, repeat=args.repeat)) / args.number * 1e6
+                          for func in (old, new))
+        print(f"{name:<22} json {old_us:7.2f} us | now {new_us:7.2f} us | x{old_us / new_us:.1f}")
+
+
+if __name__ == "__main__":
+    main()
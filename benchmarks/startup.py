@@ -0,0 +1,118 @@
+"""
+Startup benchmark of TranslateGuard.
+
+Measures in fresh interpreters how long `import TranslateGuard.server` takes, checks that no browser
+dependency is imported on the way, and optionally how long `python -m TranslateGuard` needs until it
+accepts connections. Exits with 1 if the import time budget is exceeded or selenium got imported.
+
+    python -m benchmarks.startup --budget-ms 400
+    python -m benchmarks.startup --serve --port 5050
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+# Only a login needs a browser, importing the server must not pull these in.
+FORBIDDEN = ("selenium", "undetected_chromedriver")
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+from TranslateGuard.config import config
+print(int(config.loaded))
+print(",".join(sorted({{name.split(".")[0] for name in sys.modules if name.split(".")[0] in {forbidden!r}}})))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_import(module: str) -> tuple[float, bool, list[str]]:
+    """
+    Seconds to import module in a fresh interpreter, if config.json got read, forbidden modules imported.
+    """
+    out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, forbidden=FORBIDDEN)],
+                         capture_output=True, text=True, env=_env(), check=True).stdout.splitlines()
+    return float(out[0]), out[1] == "1", [name for name in out[2].split(",") if name]
+
+
+def slowest_imports(module: str, top: int = 10) -> list[tuple[int, str]]:
+    """
+    (self microseconds, module) of the slowest imports, from python -X importtime.
+    """
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, env=_env(), check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def measure_serve(port: int, timeout: float = 60) -> float | None:
+    """
+    Seconds from launching python -m TranslateGuard until it accepts a connection on port.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "TranslateGuard"], env=_env(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="TranslateGuard.server")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=400, help="median import time allowed")
+    parser.add_argument("--serve", action="store_true", help="also time python -m TranslateGuard until it listens")
+    parser.add_argument("--port", type=int, default=5050)
+    args = parser.parse_args()
+
+    results = [measure_import(args.module) for _ in range(args.runs)]
+    median_ms = statistics.median(seconds for seconds, _, _ in results) * 1000
+    forbidden = sorted({name for _, _, names in results for name in names})
+    config_read = any(read for _, read, _ in results)
+    print(f"import {args.module}: median {median_ms:.0f} ms over {args.runs} run(s), budget {args.budget_ms:.0f} ms")
+    print(f"config.json read on import: {config_read}")
+    print(f"browser modules imported: {', '.join(forbidden) or 'none'}")
+    print("slowest imports (self us):")
+    for self_us, name in slowest_imports(args.module):
+        print(f"  {self_us:>8}  {name}")
+    if args.serve:
+        seconds = measure_serve(args.port)
+        print(f"python -m TranslateGuard listening after: {'failed' if seconds is None else f'{seconds:.2f} s'}")
+
+    failed = median_ms > args.budget_ms or forbidden
+    if failed:
+        print("FAILED: import time budget exceeded" if median_ms > args.budget_ms else
+              "FAILED: browser modules imported on startup")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import pytest
+
+from TranslateGuard.config import config
+
+SETTINGS = {"ACCOUNTS": [], "API_KEYS": [], "PATTERN_SPLIT": "\n\n%%\n\n", "SYSTEM_PROMPT": "",
+            "LLM_ENGINE": "GPT-Turbo", "USER_AGENT_UA": None}
+
+
+@pytest.fixture
+def settings():
+    """
+    config.json replaced by SETTINGS, changes of a test stay in that test.
+    """
+    config.config = dict(SETTINGS)
+    yield config.config
+    del config.config
@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+
+from TranslateGuard.server import _admin_allowed
+
+
+def _request(remote: str, token: str | None = None):
+    return SimpleNamespace(remote=remote, headers={} if token is None else {"X-Admin-Token": token})
+
+
+def test_admin_needs_the_token_even_from_loopback(settings):
+    assert not _admin_allowed(_request("127.0.0.1"))
+    settings["ADMIN_TOKEN"] = "secret"
+    assert not _admin_allowed(_request("127.0.0.1"))
+    assert not _admin_allowed(_request("127.0.0.1", "wrong"))
+    assert _admin_allowed(_request("10.0.0.1", "secret"))
@@ -0,0 +1,34 @@
+import asyncio
+
+import aiohttp
+
+from TranslateGuard.base_exceptions import UnequalParagraphCountException
+from TranslateGuard.bisect_executor import RetryBudget, bisect_ask
+
+
+def _ask(outcomes: list):
+    """
+    ask answering with outcomes in turn, with the attempts it was called with.
+    """
+    attempts = []
+
+    async def ask(paragraphs: list[str], attempt: int) -> list[str]:
+        attempts.append(attempt)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return ask, attempts
+
+
+def test_transport_error_retries_without_counting_an_attempt():
+    ask, attempts = _ask([aiohttp.ClientConnectionError(), ["T:a"]])
+    assert asyncio.run(bisect_ask(ask, ["a"], RetryBudget(4), max_attempts=3)) == ["T:a"]
+    assert attempts == [0, 0]
+
+
+def test_bad_answer_counts_an_attempt():
+    ask, attempts = _ask([UnequalParagraphCountException(1, 2, "test"), aiohttp.ClientConnectionError(), ["T:a"]])
+    assert asyncio.run(bisect_ask(ask, ["a"], RetryBudget(4), max_attempts=3)) == ["T:a"]
+    assert attempts == [0, 1, 1]
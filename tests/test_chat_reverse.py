@@ -0,0 +1,113 @@
+import asyncio
+import base64
+
+import pytest
+
+from TranslateGuard.ChatWebReverse.chat_reverse import ChatgptAgent, _put_capped
+from TranslateGuard.ChatWebReverse.model import Conversation, User
+from TranslateGuard.serialization import dumps
+
+USER = User("a@example.com", "", True)
+
+
+class StubResponse:
+    cookies = {}
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    async def json(self, loads):
+        return self.data
+
+
+class StubSession:
+    """
+    Accepts every prompt post on the conversation of the posted payload.
+    """
+
+    class cookie_jar:
+        @staticmethod
+        def update_cookies(cookies):
+            pass
+
+    async def post(self, url, data, **kwargs):
+        return StubResponse({"conversation_id": "conversation-1"})
+
+
+def _agent() -> ChatgptAgent:
+    agent = ChatgptAgent.__new__(ChatgptAgent)
+    agent.user = USER
+    agent.session = StubSession()
+    agent.proxy = None
+    agent.base_url = "http://chatgpt.invalid"
+    agent.pending = {}
+    agent._pending_conversations = {}
+    agent._latest_frames = {}
+    agent._orphans = {}
+    return agent
+
+
+def _frame(text: str, parent_id: str | None, conversation_id: str = "conversation-1") -> dict:
+    message = {"id": f"answer-{text}", "content": {"parts": [text]}, "metadata": {"parent_id": parent_id}}
+    event = {"message": message, "conversation_id": conversation_id}
+    return {"body": base64.b64encode(b"data: " + dumps(event) + b"\n\n").decode(), "conversation_id": conversation_id}
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_late_answer_does_not_reach_next_prompt(settings):
+    async def main():
+        agent = _agent()
+        conversation = Conversation(user=USER)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(agent._complete_conversation(conversation, {}, b"", "prompt-a"), 0.01)
+        second = asyncio.create_task(agent._complete_conversation(conversation, {}, b"", "prompt-b"))
+        await _until(lambda: "prompt-b" in agent.pending)
+        await asyncio.sleep(0)
+        agent._route_frame(_frame("ANSWER OF A", "prompt-a"))
+        await asyncio.sleep(0)
+        assert not second.done()
+        agent._route_frame(_frame("ANSWER OF B", "prompt-b"))
+        assert await second == "ANSWER OF B"
+
+    asyncio.run(main())
+
+
+def test_answer_before_its_prompt_is_kept_by_parent_id(settings):
+    async def main():
+        agent = _agent()
+        conversation = Conversation(user=USER, is_new=False, conversation_id="conversation-1")
+        agent._route_frame(_frame("ANSWER OF A", "prompt-a"))
+        agent._route_frame(_frame("ANSWER OF B", "prompt-b"))
+        assert await agent._complete_conversation(conversation, {}, b"", "prompt-b") == "ANSWER OF B"
+        assert list(agent._orphans) == ["prompt-a"]
+
+    asyncio.run(main())
+
+
+def test_answer_without_parent_id_needs_a_single_pending_prompt(settings):
+    agent = _agent()
+    loop = asyncio.new_event_loop()
+    try:
+        for message_id in ("prompt-a", "prompt-b"):
+            agent.pending[message_id] = loop.create_future()
+            agent._pending_conversations[message_id] = "conversation-1"
+        agent._route_frame(_frame("ANSWER", None))
+        assert not any(future.done() for future in agent.pending.values())
+        del agent.pending["prompt-a"], agent._pending_conversations["prompt-a"]
+        agent._route_frame(_frame("ANSWER", None))
+        assert agent.pending["prompt-b"].result() == ("ANSWER", "answer-ANSWER")
+    finally:
+        loop.close()
+
+
+def test_capped_entries_drop_the_oldest():
+    entries = {}
+    for n in range(40):
+        _put_capped(entries, f"response-{n % 35}", n)
+    assert len(entries) == 32
+    # Updated responses count as new, untouched ones go first.
+    assert list(entries)[-5:] == [f"response-{n}" for n in range(5)]
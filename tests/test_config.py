@@ -0,0 +1,12 @@
+import json
+import logging
+
+from TranslateGuard import config as config_module
+
+
+def test_setup_logging_keeps_module_loggers(tmp_path, monkeypatch):
+    (tmp_path / "logging_config.json").write_text(json.dumps({"version": 1, "root": {"level": "INFO"}}))
+    monkeypatch.setattr(config_module, "CONFIG_PATH", tmp_path)
+    logger = logging.getLogger("TranslateGuard.server")
+    config_module.setup_logging()
+    assert not logger.disabled
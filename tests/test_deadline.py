@@ -0,0 +1,14 @@
+from types import SimpleNamespace
+
+import pytest
+
+from TranslateGuard.server import request_deadline
+
+
+@pytest.mark.parametrize("header, seconds", [
+    (None, 60), ("15", 15), ("abc", 60), ("nan", 60), ("inf", 60), ("-inf", 60), ("0", 60), ("-1", 60), ("1e9", 60),
+])
+def test_request_deadline_is_clamped(settings, header, seconds):
+    settings["REQUEST_DEADLINE"] = 60
+    headers = {} if header is None else {"X-Request-Timeout": header}
+    assert request_deadline(SimpleNamespace(headers=headers)) == seconds
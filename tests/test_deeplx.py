@@ -0,0 +1,28 @@
+import asyncio
+
+from TranslateGuard.DeepLX.DeeplX import DeepLXPool
+
+
+def _pool(settings, answer):
+    settings["DEEPLX_URLS"] = ["http://deeplx.invalid/translate"]
+    pool = DeepLXPool({"client_sessions": {}, "openai_session": None})
+    calls = []
+
+    async def ask(text):
+        calls.append(text)
+        return answer(text)
+
+    pool.instance_list[0].ask = ask
+    return pool, calls
+
+
+def test_short_answer_is_bisected(settings):
+    # Batches drop their last line, single paragraphs come back whole.
+    pool, calls = _pool(settings, lambda text: "\n".join(f"T:{line}" for line in text.split("\n")[:-1] or [text]))
+    assert asyncio.run(pool.ask(["a", "b", "c"])) == ["T:a", "T:b", "T:c"]
+    assert calls[0] == "a\nb\nc"
+
+
+def test_paragraph_with_line_breaks_keeps_alignment(settings):
+    pool, _ = _pool(settings, lambda text: "\n".join(f"T:{line}" for line in text.split("\n")))
+    assert asyncio.run(pool.ask(["a", "b\nb2", "c"])) == ["T:a", "T:b T:b2", "T:c"]
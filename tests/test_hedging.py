@@ -0,0 +1,52 @@
+import asyncio
+
+from TranslateGuard.base_formatter import hybrid_response
+from TranslateGuard.base_message_enum import Service
+from TranslateGuard.cache import TranslationCache, cache_key
+from TranslateGuard.deadline import LatencyWindow
+from TranslateGuard.hedging import Hedger
+from TranslateGuard.serialization import loads
+from tests.test_singleflight import StubRequest
+
+
+class StubPool:
+    def __init__(self, prefix: str, delay: float):
+        self.prefix = prefix
+        self.delay = delay
+
+    async def ask(self, paragraphs: list[str]) -> list[str]:
+        await asyncio.sleep(self.delay)
+        return [f"{self.prefix}:{paragraph}" for paragraph in paragraphs]
+
+
+def _hedger() -> Hedger:
+    hedger = Hedger(Service.ChatWebGpt, Service.GptTurbo, min_samples=1, min_delay=0.01)
+    hedger.latencies = LatencyWindow()
+    hedger.latencies.add(0.01)
+    return hedger
+
+
+def test_hedge_answer_is_cached_as_its_own_engine(settings):
+    settings["LLM_ENGINE"] = Service.ChatWebGpt
+
+    async def main():
+        cache = TranslationCache(None)
+        request = StubRequest({"chat_agent_pool": StubPool("chat", 5), "GptTurbo": StubPool("turbo", 0),
+                               "hedger": _hedger(), "translation_cache": cache})
+        body = await asyncio.wait_for(hybrid_response(request, "paragraph"), 1)
+        assert loads(body)["choices"][0]["message"]["content"] == "turbo:paragraph"
+        assert request.app["hedger"].stats["hedge_wins"] == 1
+        assert await cache.get_many([cache_key("paragraph", "zh-CN", Service.ChatWebGpt)]) == {}
+        assert await cache.get_many([cache_key("paragraph", "zh-CN", Service.GptTurbo)]) != {}
+
+    asyncio.run(main())
+
+
+def test_hedger_reports_the_primary_when_it_wins():
+    async def main():
+        hedger = _hedger()
+        primary, hedge = StubPool("chat", 0), StubPool("turbo", 0)
+        assert await hedger.ask(lambda: primary.ask(["a"]), lambda: hedge.ask(["a"]), 1) == \
+               (Service.ChatWebGpt, ["chat:a"])
+
+    asyncio.run(main())
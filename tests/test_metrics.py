@@ -0,0 +1,14 @@
+from TranslateGuard.metrics import Counter, Histogram, Registry
+
+
+def test_const_labels_come_first_on_every_sample():
+    registry = Registry()
+    registry.const_labels["worker"] = "1"
+    Counter("requests_total", "Requests.", ("status",), registry=registry).inc("200")
+    Counter("plain_total", "No labels.", registry=registry).inc()
+    Histogram("seconds", "Latency.", buckets=(1,), registry=registry).observe(0.5)
+    text = registry.render().decode()
+    assert 'requests_total{worker="1",status="200"} 1' in text
+    assert 'plain_total{worker="1"} 1' in text
+    assert 'seconds_bucket{worker="1",le="1"} 1' in text
+    assert 'seconds_count{worker="1"} 1' in text
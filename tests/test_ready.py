@@ -0,0 +1,25 @@
+import asyncio
+from types import SimpleNamespace
+
+from TranslateGuard import server
+
+
+def _pool(ready: int):
+    capacity = {"instances": 2, "ready": ready, "capacity": 4 * ready, "inflight": 0}
+    return SimpleNamespace(scheduler=SimpleNamespace(name="pool", capacity=lambda: capacity))
+
+
+def _status(app: dict) -> int:
+    for name, pool in app.items():
+        pool.scheduler.name = {"DeepLX": "DeeplX", "chat_agent_pool": "ChatWebGpt", "GptTurbo": "GPT-Turbo"}[name]
+    return asyncio.run(server.ready(SimpleNamespace(app=app))).status
+
+
+def test_deeplx_alone_is_not_ready(settings):
+    assert _status({"DeepLX": _pool(2)}) == 503
+
+
+def test_ready_follows_the_llm_engine(settings):
+    settings["LLM_ENGINE"] = "ChatWebGpt"
+    assert _status({"DeepLX": _pool(2), "chat_agent_pool": _pool(0), "GptTurbo": _pool(1)}) == 503
+    assert _status({"DeepLX": _pool(2), "chat_agent_pool": _pool(1)}) == 200
@@ -0,0 +1,39 @@
+import asyncio
+
+from TranslateGuard import deadline
+from TranslateGuard.base_formatter import hybrid_response
+from TranslateGuard.recorder import TrafficRecorder, read_records
+from TranslateGuard.serialization import loads
+from tests.test_singleflight import CONTENT, StubRequest
+
+
+class HangingPool:
+    async def ask(self, paragraphs: list[str]) -> list[str]:
+        await asyncio.Event().wait()
+
+
+def test_deadline_fallback_is_not_counted_as_translated(settings):
+    settings["DEADLINE_GRACE"] = 0
+
+    async def main():
+        request = StubRequest({"GptTurbo": HangingPool()})
+        deadline.start(0.05)
+        body = await hybrid_response(request, CONTENT)
+        return request, body
+
+    request, body = asyncio.run(main())
+    assert loads(body)["choices"][0]["message"]["content"] == CONTENT
+    assert request["translated"] == 0
+
+
+def test_records_round_trip_through_rotation(settings, tmp_path):
+    recorder = TrafficRecorder(tmp_path / "requests.jsonl", max_bytes=400, backups=10)
+    body = {"messages": [{"role": "system", "content": ""}, {"role": "user", "content": CONTENT}]}
+    for i in range(5):
+        recorder.record(1000.0 + i, str(i), body, False, 200, 0.5, None, 1)
+    recorder.close()
+    files = sorted(tmp_path.iterdir())
+    assert any(path.name.endswith(".gz") for path in files)
+    records = read_records(*files)
+    assert [record["id"] for record in records] == ["0", "1", "2", "3", "4"]
+    assert records[0]["paragraphs"] == 2 and records[0]["translated"] == 1
@@ -0,0 +1,84 @@
+import asyncio
+
+from TranslateGuard.base_formatter import hybrid_response
+from TranslateGuard.serialization import loads
+from TranslateGuard.singleflight import AbandonedFlightException, SingleFlight
+
+CONTENT = "first paragraph\n\n%%\n\nsecond paragraph"
+
+
+class StubRequest(dict):
+    """
+    What the handlers use of a request: its app and its item storage.
+    """
+
+    def __init__(self, app: dict):
+        super().__init__()
+        self.app = app
+
+
+class StubPool:
+    """
+    Translates by prefixing, the first call hangs until cancelled.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ask(self, paragraphs: list[str]) -> list[str]:
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.Event().wait()
+        return [f"T:{paragraph}" for paragraph in paragraphs]
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_follower_takes_over_when_leader_is_cancelled(settings):
+    async def main():
+        pool = StubPool()
+        request = StubRequest({"GptTurbo": pool, "inflight": SingleFlight()})
+        leader = asyncio.create_task(hybrid_response(request, CONTENT))
+        await _until(lambda: pool.calls == 1)
+        follower = asyncio.create_task(hybrid_response(request, CONTENT))
+        await _until(lambda: request.app["inflight"].stats["followers"] == 2)
+        # The client of the leader went away.
+        leader.cancel()
+        body = await asyncio.wait_for(follower, 5)
+        assert body is not None
+        assert loads(body)["choices"][0]["message"]["content"] == "T:first paragraph\n\n%%\n\nT:second paragraph"
+        assert pool.calls == 2
+
+    asyncio.run(main())
+
+
+def test_late_fail_leaves_a_new_flight_of_the_key_alone():
+    async def main():
+        inflight = SingleFlight()
+        owned_a, _ = inflight.claim({0: "key"})
+        inflight.resolve("key", owned_a[0], "first")
+        owned_b, _ = inflight.claim({0: "key"})
+        _, waiting_c = inflight.claim({0: "key"})
+        assert waiting_c[0] is owned_b[0]
+        # A cleans up after B claimed the key again.
+        inflight.fail("key", owned_a[0], AbandonedFlightException("key"))
+        assert not owned_b[0].done()
+        inflight.resolve("key", owned_b[0], "second")
+        assert await SingleFlight.wait(waiting_c) == {0: "second"}
+
+    asyncio.run(main())
+
+
+def test_wait_leaves_out_abandoned_flights():
+    async def main():
+        inflight = SingleFlight()
+        owned, _ = inflight.claim({0: "a", 1: "b"})
+        _, waiting = inflight.claim({0: "a", 1: "b"})
+        inflight.resolve("a", owned[0], "A")
+        inflight.fail("b", owned[1], AbandonedFlightException("b"))
+        assert await SingleFlight.wait(waiting) == {0: "A"}
+
+    asyncio.run(main())
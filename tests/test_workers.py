@@ -0,0 +1,33 @@
+import pytest
+
+from TranslateGuard import server
+from TranslateGuard.base_exceptions import GeneralException
+from TranslateGuard.base_formatter import _llm_engine
+
+
+def test_workers_are_capped_to_accounts_without_api_keys(settings, monkeypatch):
+    settings["ACCOUNTS"] = [{"EMAIL": f"{i}@example.com", "PASSWORD": "", "USE": True} for i in range(2)]
+    started = []
+    monkeypatch.setattr(server, "setup_logging", lambda: None)
+    monkeypatch.setattr(server, "serve", lambda *args: started.append(args))
+    monkeypatch.setattr(server.signal, "signal", lambda *args: None)
+
+    class Process:
+        def __init__(self, target, args, name):
+            self.args = args
+
+        def start(self):
+            started.append(self.args)
+
+        def join(self):
+            pass
+
+    monkeypatch.setattr(server.multiprocessing, "get_context", lambda method: type("Context", (), {"Process": Process}))
+    server.run(["--workers", "4"])
+    assert [args[2:] for args in started] == [(0, 2), (1, 2)]
+
+
+def test_llm_engine_needs_a_pool(settings):
+    with pytest.raises(GeneralException):
+        _llm_engine({"DeepLX": object()})
+    assert _llm_engine({"DeepLX": object(), "chat_agent_pool": object()}) == "ChatWebGpt"